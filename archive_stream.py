@@ -0,0 +1,362 @@
+import os
+import gzip
+import queue
+import struct
+import tarfile
+import threading
+import zlib
+import collections
+import concurrent.futures
+from worker_pool import workerPool
+from transfer_engine import partial_suffix
+__author__ = 'MCE123'
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+gzip_block_size = 1024 * 1024     #Uncompressed bytes per independently compressed block.
+gzip_window = 32 * 1024           #Size of the deflate window, the tail of each block primes the next block's dictionary.
+default_level = 6                 #Default gzip compression level, the same as gzip and tar -z.
+default_codec = "gzip-6"          #Default codec of streamed archives.
+stream_queue_chunks = 16          #Number of compressed chunks buffered between the archiving thread and the upload.
+extract_writers = 4               #Number of threads writing extracted members to disk.
+extract_chunk_size = 1024 * 1024  #Size of each read of a member while it is extracted.
+member_queue_chunks = 4           #Number of chunks of one member buffered for its writer.
+codec_extensions = {'none': '.tar', 'gzip': '.tar.gz', 'zstd': '.tar.zst', 'lz4': '.tar.lz4'}
+codec_levels = {'gzip': [1, 9], 'zstd': [1, 22]}   #Compression levels each family accepts; the others take none.
+archive_extensions = {'.tar.gz': 'gzip', '.tgz': 'gzip', '.tar.zst': 'zstd', '.tar.lz4': 'lz4', '.tar': 'none'}
+unstreamable_extensions = ('.7z', '.rar')   #Archives that need random access to unpack, so they can't be extracted while they download.
+
+def compress_block(block, zdict, level, final):
+    """
+    This function compresses one block as raw deflate data. Blocks other than the last end with a sync flush,
+    which leaves the stream byte-aligned and unfinished, so consecutive blocks concatenate into one valid
+    deflate stream. zdict is the end of the previous block, so matches across the block boundary still compress.
+    block:   type bytes, the uncompressed block
+    zdict:   type bytes, up to gzip_window bytes preceding block, b"" for the first block
+    level:   type int, compression level 1-9
+    final:   type bool, True for the last block of the stream
+    Returns: type bytes, the compressed block
+    """
+    if len(zdict) > 0:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    if final:
+        return compressor.compress(block) + compressor.flush(zlib.Z_FINISH)
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+class parallelGzip:
+    """
+    This class defines a writable file object that gzips what is written to it in independent blocks compressed
+    concurrently on executor, the same way pigz does. zlib releases the GIL while compressing, so a thread pool
+    uses every core. The compressed blocks are passed to sink in order, and together with the header and trailer
+    written here form one ordinary gzip file that any gunzip or tarfile can read.
+    To Call: parallelGzip(sink, executor, level, max_pending)
+    Whereas: sink:        a callable that receives the compressed output in order, as bytes
+             executor:    type concurrent.futures.Executor, runs compress_block
+             level:       type int, compression level 1-9
+             max_pending: type int, the number of blocks that may be compressing at once
+    """
+    def __init__(self, sink, executor, level=default_level, max_pending=2):
+        self.sink = sink
+        self.executor = executor
+        self.level = level
+        self.max_pending = max_pending
+        self.pending = collections.deque()
+        self.block = bytearray()
+        self.zdict = b""
+        self.crc = 0
+        self.size = 0
+        #Header: magic, deflate, no flags, no mtime, no extra flags, unknown OS
+        self.sink(b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff")
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.block += data
+        while len(self.block) >= gzip_block_size:
+            block = bytes(self.block[:gzip_block_size])
+            del self.block[:gzip_block_size]
+            self.submit(block, False)
+        return len(data)
+
+    def submit(self, block, final):
+        self.pending.append(self.executor.submit(compress_block, block, self.zdict, self.level, final))
+        self.zdict = block[-gzip_window:]
+        while len(self.pending) > self.max_pending:
+            self.sink(self.pending.popleft().result())
+
+    def close(self):
+        """
+        Compresses the last block and writes the trailer. Returns: None
+        """
+        self.submit(bytes(self.block), True)
+        self.block = bytearray()
+        while len(self.pending) > 0:
+            self.sink(self.pending.popleft().result())
+        self.sink(struct.pack('<II', self.crc & 0xffffffff, self.size & 0xffffffff))
+        return None
+
+class streamCompressor:
+    """
+    This class defines a writable file object that compresses what is written to it with a zstandard or lz4 frame
+    compressor and passes the output to sink, or passes it through unchanged for the "none" codec.
+    To Call: streamCompressor(sink, compressor)
+    Whereas: sink:       a callable that receives the output in order, as bytes
+             compressor: an object with compress(data) and flush() methods, or None to not compress
+    """
+    def __init__(self, sink, compressor=None):
+        self.sink = sink
+        self.compressor = compressor
+
+    def write(self, data):
+        if self.compressor == None:
+            self.sink(bytes(data))
+        else:
+            self.sink(self.compressor.compress(data))
+        return len(data)
+
+    def close(self):
+        if self.compressor != None:
+            self.sink(self.compressor.flush())
+        return None
+
+def parse_codec(codec):
+    """
+    This function splits a codec name such as "gzip-6", "zstd-3", "lz4" or "none" into its family and level.
+    Raises ValueError for an unknown family or a level the family doesn't accept.
+    Returns: List [<family>, <level or None>]
+    """
+    family, dash, level = codec.partition("-")
+    if family not in codec_extensions:
+        raise ValueError("Unknown codec " + codec + ", expected none, gzip-<1-9>, zstd-<1-22> or lz4")
+    if family == 'zstd' and zstandard == None:
+        raise ImportError("The zstd codec requires zstandard. Install it with: pip install zstandard")
+    if family == 'lz4' and lz4frame == None:
+        raise ImportError("The lz4 codec requires lz4. Install it with: pip install lz4")
+    if level == "":
+        return [family, default_level if family == 'gzip' else None]
+    if family not in codec_levels:
+        raise ValueError("Invalid codec " + codec + ": " + family + " takes no level")
+    low, high = codec_levels[family]
+    if not level.isdigit() or int(level) < low or int(level) > high:
+        raise ValueError("Invalid codec " + codec + ": the " + family + " level must be an integer from " + str(low) + " to " + str(high))
+    return [family, int(level)]
+
+def open_compressor(codec, sink, executor, max_workers):
+    """
+    This function returns a writable file object that compresses with codec into sink. gzip is compressed in
+    parallel blocks on executor; zstd uses its own max_workers threads; lz4 is fast enough to run on one.
+    Returns: type parallelGzip or streamCompressor
+    """
+    family, level = parse_codec(codec)
+    if family == 'gzip':
+        return parallelGzip(sink, executor, level, max_workers * 2)
+    if family == 'zstd':
+        return streamCompressor(sink, zstandard.ZstdCompressor(level=level if level != None else 3, threads=max_workers).compressobj())
+    if family == 'lz4':
+        compressor = lz4frame.LZ4FrameCompressor()
+        sink(compressor.begin())
+        return streamCompressor(sink, compressor)
+    return streamCompressor(sink)
+
+def open_decompressor(codec, stream):
+    """
+    Returns: a readable file-like object over the decompressed contents of stream, compressed with codec
+    """
+    family, level = parse_codec(codec)
+    if family == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if family == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    if family == 'lz4':
+        return lz4frame.LZ4FrameFile(stream, mode='rb')
+    return stream
+
+def archive_key(key, codec):
+    """
+    This function gives key the extension of codec, replacing any archive extension it already has,
+    e.g. "x02-y02-FTC-orig.tar.gz" becomes "x02-y02-FTC-orig.tar.zst" for "zstd-3".
+    """
+    for ext in sorted(archive_extensions, key=len, reverse=True):
+        if key.endswith(ext):
+            key = key[:-len(ext)]
+            break
+    return key + codec_extensions[parse_codec(codec)[0]]
+
+def tar_stream(files, codec=default_codec, max_workers=None):
+    """
+    This function builds a tar archive of files on the fly, compressed with codec, and yields it as chunks, so it
+    can be fed straight into an upload without an archive ever being written to disk. The tar stream is written
+    by a background thread into the compressor, and at most stream_queue_chunks chunks wait for the consumer.
+    files:       type iter, of [<full_path>, <name in the archive>]
+    codec:       type str, "none", "gzip-<level>", "zstd-<level>" or "lz4"
+    max_workers: type int, the number of compressing threads, None for one per CPU
+    Returns:     generator of type bytes
+    """
+    chunks = queue.Queue(maxsize=stream_queue_chunks)
+    stopped = threading.Event()
+    def put_chunk(chunk):
+        #Gives up once the consumer has stopped, so an abandoned stream doesn't block this thread forever
+        while not stopped.is_set():
+            try:
+                chunks.put(chunk, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    def sink(data):
+        if len(data) > 0 and not put_chunk(data):
+            raise OSError("The archive stream was abandoned")
+    if max_workers == None:
+        max_workers = os.cpu_count() or 1
+    def write_archive():
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+                compressor = open_compressor(codec, sink, executor, max_workers)
+                tar = tarfile.open(fileobj=compressor, mode='w|')
+                for full_path, arcname in files:
+                    tar.add(full_path, arcname, recursive=False)
+                tar.close()
+                compressor.close()
+            put_chunk(None)
+        except Exception as e:
+            put_chunk(e)
+    writer = threading.Thread(target=write_archive, name="Archiver", daemon=True)
+    writer.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk == None:
+                return None
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        stopped.set()
+        writer.join()
+
+def archive_codec(key):
+    """
+    Returns: type str, the codec family of the archive key from its extension, or None if key isn't an archive
+    that extract_archive can unpack
+    """
+    for ext in sorted(archive_extensions, key=len, reverse=True):
+        if key.endswith(ext):
+            return archive_extensions[ext]
+    return None
+
+def is_archive(key):
+    """
+    Returns: True if key is an archive that extract_archive can unpack
+    """
+    return archive_codec(key) != None
+
+def is_unstreamable(key):
+    """
+    Returns: True if key is an archive extract_archive can't unpack as it downloads, such as 7z or rar, whose
+             index is at the end and which have no standard-library reader
+    """
+    return key.lower().endswith(unstreamable_extensions)
+
+def member_path(outdir, name):
+    """
+    This function returns where the archive member name is extracted to inside outdir, refusing absolute names
+    and names that climb out of outdir with "..".
+    """
+    path = os.path.normpath(name)
+    if os.path.isabs(path) or path == ".." or path.startswith(".." + os.sep):
+        raise ValueError("Refusing to extract " + name + " outside of " + outdir)
+    return os.path.join(outdir, path)
+
+def write_member(worker_name, full_path, chunks, mtime):
+    """
+    This function is run by a workerPool worker to write one member from chunks, a queue of bytes ending with
+    True once the whole member was read, or False if the archive failed first. The member is written to
+    full_path + partial_suffix and renamed once complete, so an interrupted extraction never leaves a truncated
+    file under a real name. The queue is always drained, even after an error, so the reader never blocks on it.
+    Returns: None
+    """
+    tmp_path = full_path + partial_suffix
+    error = None
+    fout = None
+    try:
+        dest_dir = os.path.dirname(full_path)
+        if dest_dir != "" and not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir, exist_ok=True)
+        fout = open(tmp_path, 'wb')
+    except OSError as e:
+        error = e
+    item = chunks.get()
+    while not isinstance(item, bool):
+        if error == None:
+            try:
+                fout.write(item)
+            except OSError as e:
+                error = e
+        item = chunks.get()
+    if fout != None:
+        fout.close()
+    if error != None or not item:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            None
+        if error != None:
+            raise error
+        return None
+    os.utime(tmp_path, (mtime, mtime))
+    os.replace(tmp_path, full_path)
+    return None
+
+def extract_archive(stream, outdir, codec="gzip"):
+    """
+    This function unpacks a tar archive compressed with codec from stream into outdir as the bytes arrive, without
+    the archive itself ever being written to disk. Members are decompressed in order, which the codecs require,
+    while writing them to disk runs on extract_writers threads, so decompression, disk writes and the download of
+    later ranges all overlap. Each member is read in extract_chunk_size chunks and handed to its writer through
+    a queue of member_queue_chunks chunks, and at most extract_writers members wait for a writer, so memory stays
+    bounded however large the members are. Only regular files and directories are extracted; links and devices
+    are skipped.
+    stream:  a readable binary file-like object, such as a rangeStream
+    outdir:  type str, relative or absolute path to the output directory
+    codec:   type str, the codec of the archive, see archive_codec
+    Returns: List [<number of files extracted>, <number of bytes extracted>]
+    """
+    count_files = 0
+    num_bytes = 0
+    tar = tarfile.open(fileobj=open_decompressor(codec, stream), mode='r|')
+    try:
+        with workerPool(extract_writers, extract_writers, name="Extract") as pool:
+            for member in tar:
+                full_path = member_path(outdir, member.name)
+                if member.isdir():
+                    os.makedirs(full_path, exist_ok=True)
+                elif member.isfile():
+                    chunks = queue.Queue(maxsize=member_queue_chunks)
+                    pool.submit(write_member, full_path, chunks, member.mtime)
+                    complete = False
+                    fin = tar.extractfile(member)
+                    try:
+                        data = fin.read(extract_chunk_size)
+                        while data:
+                            chunks.put(data)
+                            num_bytes += len(data)
+                            data = fin.read(extract_chunk_size)
+                        complete = True
+                    finally:
+                        fin.close()
+                        chunks.put(complete)
+                    count_files += 1
+    finally:
+        tar.close()
+    if len(pool.errors) > 0:
+        raise pool.errors[0][1]
+    return [count_files, num_bytes]
@@ -0,0 +1,351 @@
+import os
+import time
+import asyncio
+import traceback
+import concurrent.futures
+from transfer_engine import parse_bucket_path, localBackend, default_part_size, default_max_parts, default_threshold, default_part_retries
+from transfer_engine import partial_suffix, first_response, multipart_size, plan_parts, retry_delay
+__author__ = 'MCE123'
+
+try:
+    from aiobotocore.session import get_session
+    from aiobotocore.config import AioConfig
+    from botocore.exceptions import ClientError
+except ImportError:
+    get_session = None
+    AioConfig = None
+    ClientError = None
+
+default_requests = 256            #Default number of requests in flight at once if not specified.
+default_io_threads = 8            #Number of threads doing blocking file reads and writes for the event loop.
+
+def read_bytes(full_path, start=0, length=-1):
+    fin = open(full_path, 'rb')
+    try:
+        fin.seek(start)
+        return fin.read(length)
+    finally:
+        fin.close()
+
+def write_bytes(full_path, data, start=None, size=None):
+    """
+    Writes data to full_path, at offset start of the existing file if start is given, otherwise as a new file
+    preallocated to size bytes if size is given. Returns: None
+    """
+    if start != None:
+        fout = open(full_path, 'r+b')
+        fout.seek(start)
+    else:
+        fout = open(full_path, 'wb')
+        if size != None:
+            fout.truncate(size)
+    try:
+        fout.write(data)
+    finally:
+        fout.close()
+    return None
+
+def make_parent(full_path):
+    dest_dir = os.path.dirname(full_path)
+    if dest_dir != "" and not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir, exist_ok=True)
+
+def remove_file(full_path):
+    try:
+        os.remove(full_path)
+    except FileNotFoundError:
+        None
+
+async def wait_all(coroutines):
+    """
+    Runs coroutines concurrently and waits for every one of them, even after one fails, so nothing is still
+    writing to a file or a multipart upload that is being discarded.
+    Returns: type list, their results in order, or raises the first exception
+    """
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+class asyncLocalBackend:
+    """
+    This class defines the asyncio version of localBackend. Every call is plain file I/O, so it runs the
+    localBackend method on executor and awaits it, keeping the event loop free.
+    To Call: asyncLocalBackend(root_dir, executor)
+    Whereas: root_dir: type str, relative or absolute path to the directory standing in for the bucket
+             executor: type concurrent.futures.Executor, runs the blocking calls
+    """
+    min_part_size = localBackend.min_part_size
+    def __init__(self, root_dir, executor):
+        self.backend = localBackend(root_dir)
+        self.executor = executor
+
+    async def call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def open(self):
+        return None
+
+    async def close(self):
+        return None
+
+    async def put_bytes(self, data, key):
+        return await self.call(self.backend.put_bytes, data, key)
+
+    async def read_range(self, key, start, end, if_match=None):
+        def read():
+            stream, total_size, etag = self.backend.open_range(key, start, end, if_match=if_match)
+            try:
+                return [stream.read(), total_size, etag]
+            finally:
+                stream.close()
+        return await self.call(read)
+
+    async def create_multipart(self, key):
+        return await self.call(self.backend.create_multipart, key)
+
+    async def upload_part(self, key, upload_id, part_number, data):
+        return await self.call(self.backend.upload_part, key, upload_id, part_number, data)
+
+    async def complete_multipart(self, key, upload_id, parts):
+        return await self.call(self.backend.complete_multipart, key, upload_id, parts)
+
+    async def abort_multipart(self, key, upload_id):
+        return await self.call(self.backend.abort_multipart, key, upload_id)
+
+class asyncS3Backend:
+    """
+    This class defines the asyncio version of s3Backend, on one aiobotocore client whose connection pool is shared
+    by every request in flight on the event loop.
+    To Call: asyncS3Backend(bucket_name, prefix, max_connections)
+    Whereas: bucket_name:     type str, name of the S3 bucket
+             prefix:          type str, key prefix inside the bucket, "" for the bucket root
+             max_connections: type int, size of the shared HTTP connection pool
+    """
+    min_part_size = 5 * 1024 * 1024
+    def __init__(self, bucket_name, prefix="", max_connections=default_requests):
+        if get_session == None:
+            raise ImportError("The asyncio S3 backend requires aiobotocore. Install it with: pip install aiobotocore")
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.max_connections = max_connections
+        self.client_context = None
+        self.client = None
+
+    async def open(self):
+        config = AioConfig(max_pool_connections=self.max_connections, retries={'max_attempts': 5, 'mode': 'standard'})
+        self.client_context = get_session().create_client('s3', config=config)
+        self.client = await self.client_context.__aenter__()
+
+    async def close(self):
+        if self.client_context != None:
+            await self.client_context.__aexit__(None, None, None)
+            self.client_context = None
+            self.client = None
+
+    def full_key(self, key):
+        return self.prefix + key
+
+    async def put_bytes(self, data, key):
+        response = await self.client.put_object(Bucket=self.bucket_name, Key=self.full_key(key), Body=data)
+        return [len(data), response['ETag'].strip('"')]
+
+    async def read_range(self, key, start, end, if_match=None):
+        kwargs = {'Bucket': self.bucket_name, 'Key': self.full_key(key)}
+        if if_match != None:
+            kwargs['IfMatch'] = '"' + if_match + '"'
+        try:
+            response = await self.client.get_object(Range="bytes=" + str(start) + "-" + str(end), **kwargs)
+        except ClientError as e:
+            #S3 rejects any range on an empty object, so fall back to a plain GET
+            if e.response.get('Error', {}).get('Code') != 'InvalidRange' or start != 0:
+                raise
+            response = await self.client.get_object(**kwargs)
+        async with response['Body'] as body:
+            data = await body.read()
+        content_range = response.get('ContentRange')
+        total_size = len(data) if content_range == None else int(content_range.split("/")[-1])
+        return [data, total_size, response['ETag'].strip('"')]
+
+    async def create_multipart(self, key):
+        response = await self.client.create_multipart_upload(Bucket=self.bucket_name, Key=self.full_key(key))
+        return response['UploadId']
+
+    async def upload_part(self, key, upload_id, part_number, data):
+        response = await self.client.upload_part(Bucket=self.bucket_name, Key=self.full_key(key), UploadId=upload_id, PartNumber=part_number, Body=data)
+        return response['ETag'].strip('"')
+
+    async def complete_multipart(self, key, upload_id, parts):
+        part_list = []
+        for part_number, etag in parts:
+            part_list.append({'PartNumber': part_number, 'ETag': '"' + etag + '"'})
+        response = await self.client.complete_multipart_upload(Bucket=self.bucket_name, Key=self.full_key(key), UploadId=upload_id, MultipartUpload={'Parts': part_list})
+        return response['ETag'].strip('"')
+
+    async def abort_multipart(self, key, upload_id):
+        await self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.full_key(key), UploadId=upload_id)
+        return None
+
+class asyncEngine:
+    """
+    This class defines the asyncio transfer engine, the alternative to transferEngine for many small objects.
+    Every request runs as a coroutine on one event loop, so max_requests requests can be in flight over the
+    pooled connections without a thread (and its stack) per request. Blocking file reads and writes run on a few
+    io threads. Large objects are split into parts like transferEngine, with at most max_parts parts in flight.
+    To Call: asyncEngine(bucket_path, max_requests, part_size, max_parts, threshold)
+    Whereas: bucket_path:  type str, "s3://bucket-name/" or "file://directory/", see parse_bucket_path
+             max_requests: type int, the number of transfers in flight at once
+             part_size:    type int, size in bytes of each part of a large object
+             max_parts:    type int, number of parts (across all large objects) that may be in flight at once
+             threshold:    type int, size in bytes above which uploads are split into parts
+    """
+    def __init__(self, bucket_path, max_requests=default_requests, part_size=default_part_size, max_parts=default_max_parts, threshold=default_threshold):
+        if max_requests < 1 or part_size < 1 or max_parts < 1:
+            raise ValueError("max_requests, part_size and max_parts must be positive")
+        scheme, location, prefix = parse_bucket_path(bucket_path)
+        self.bucket_path = bucket_path
+        self.max_requests = max_requests
+        self.part_size = part_size
+        self.max_parts = max_parts
+        self.threshold = threshold
+        self.part_retries = default_part_retries
+        self.io_executor = concurrent.futures.ThreadPoolExecutor(default_io_threads)
+        if scheme == "s3":
+            self.backend = asyncS3Backend(location, prefix, max_requests + max_parts)
+        else:
+            self.backend = asyncLocalBackend(location, self.io_executor)
+        self.part_slots = None
+
+    async def io(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.io_executor, func, *args)
+
+    async def upload_part(self, key, upload_id, full_path, part_number, start, length, stats=None):
+        """
+        Reads one part of full_path and uploads it, retrying up to part_retries times with exponential backoff.
+        Returns: List [<part_number>, <etag>]
+        """
+        async with self.part_slots:
+            data = await self.io(read_bytes, full_path, start, length)
+            attempt = 0
+            while True:
+                try:
+                    return [part_number, await self.backend.upload_part(key, upload_id, part_number, data)]
+                except Exception:
+                    if attempt >= self.part_retries:
+                        raise
+                    if stats != None:
+                        stats['retries'] = stats.get('retries', 0) + 1
+                    await asyncio.sleep(retry_delay(attempt))
+                    attempt += 1
+
+    async def upload_file(self, full_path, key, stats=None):
+        """
+        Uploads the local file full_path to key, as a multipart upload if it is larger than threshold, which is
+        aborted if any part still fails after its retries. Parts are planned like transferEngine.upload_object.
+        Returns: type int, number of bytes uploaded
+        """
+        started_at = time.perf_counter()
+        size = await self.io(os.path.getsize, full_path)
+        if size <= self.threshold:
+            num_bytes, etag = await self.backend.put_bytes(await self.io(read_bytes, full_path), key)
+            first_response(stats, started_at)
+            return num_bytes
+        part_size = multipart_size(size, self.part_size, self.backend.min_part_size)
+        upload_id = await self.backend.create_multipart(key)
+        first_response(stats, started_at)
+        try:
+            parts = []
+            for part_number, start, length in plan_parts(size, part_size):
+                parts.append(self.upload_part(key, upload_id, full_path, part_number, start, length, stats))
+            await self.backend.complete_multipart(key, upload_id, await wait_all(parts))
+        except BaseException:
+            await self.backend.abort_multipart(key, upload_id)
+            raise
+        return size
+
+    async def download_part(self, key, full_path, start, end, etag):
+        async with self.part_slots:
+            data, total_size, etag = await self.backend.read_range(key, start, end, if_match=etag)
+            await self.io(write_bytes, full_path, data, start)
+
+    async def download_file(self, key, full_path, stats=None):
+        """
+        Downloads key to the local file full_path, creating its directory if needed. The first part doubles as
+        the size probe; the rest of a large object is fetched as concurrent ranged GETs conditional on its ETag,
+        planned like transferEngine.download_object. Like it, the object is written to full_path + partial_suffix
+        and renamed to full_path once complete, so a file at its real name is always whole.
+        Returns: type int, number of bytes downloaded
+        """
+        await self.io(make_parent, full_path)
+        tmp_path = full_path + partial_suffix
+        started_at = time.perf_counter()
+        data, total_size, etag = await self.backend.read_range(key, 0, self.part_size - 1)
+        if stats != None:
+            stats['ttfb'] = time.perf_counter() - started_at
+        try:
+            if total_size <= len(data):
+                await self.io(write_bytes, tmp_path, data)
+            else:
+                await self.io(write_bytes, tmp_path, data, None, total_size)
+                parts = []
+                for part_number, start, length in plan_parts(total_size, self.part_size, len(data)):
+                    parts.append(self.download_part(key, tmp_path, start, start + length - 1, etag))
+                await wait_all(parts)
+            await self.io(os.replace, tmp_path, full_path)
+        except BaseException:
+            await self.io(remove_file, tmp_path)
+            raise
+        return total_size
+
+    async def run_jobs(self, op, jobs, trace=None):
+        """
+        Runs the transfers in jobs on the event loop, starting a new one whenever fewer than max_requests are in
+        flight, so however long jobs is only max_requests coroutines exist at once.
+        op:      type str, "upload" or "download"
+        jobs:    type iter, of [<local path>, <key>]
+        trace:   type transferTrace, optional trace to record the timing of each transfer in
+        Returns: type list, the failed transfers as [[<local path>, <key>], <exception>, <traceback str>]
+        """
+        slots = asyncio.Semaphore(self.max_requests)
+        self.part_slots = asyncio.Semaphore(self.max_parts)
+        errors = []
+        tasks = set()
+        async def run_one(path, key, queued_at):
+            started_at = time.perf_counter()
+            stats = {'ttfb': None, 'retries': 0}
+            try:
+                if op == 'upload':
+                    num_bytes = await self.upload_file(path, key, stats)
+                else:
+                    num_bytes = await self.download_file(key, path, stats)
+                if trace != None:
+                    trace.record(op, key, "Async", queued_at, started_at, num_bytes, stats)
+            except Exception as e:
+                errors.append([[path, key], e, traceback.format_exc()])
+                if trace != None:
+                    trace.record(op, key, "Async", queued_at, started_at, 0, stats, e)
+            finally:
+                slots.release()
+        await self.backend.open()
+        try:
+            for path, key in jobs:
+                queued_at = trace.queued() if trace != None else time.perf_counter()
+                await slots.acquire()
+                task = asyncio.ensure_future(run_one(path, key, queued_at))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if len(tasks) > 0:
+                await asyncio.gather(*list(tasks))
+        finally:
+            await self.backend.close()
+        return errors
+
+    def run(self, op, jobs, trace=None):
+        """
+        Runs run_jobs on a new event loop and waits for it. Returns: type list, the failed transfers
+        """
+        return asyncio.run(self.run_jobs(op, jobs, trace))
+
+    def close(self):
+        self.io_executor.shutdown(wait=True)
@@ -0,0 +1,274 @@
+import os
+import argparse
+import csv
+import glob
+import json
+import shutil
+import subprocess
+import threading
+import time
+from datetime import datetime
+from os.path import basename
+from transfer_engine import transferEngine
+from worker_pool import workerPool
+from transfer_trace import percentile
+__author__ = 'MCE123'
+
+slice_sizes = {'orig': 512, 'npy': 512, 'png': 256}     #Default synthetic slice size in KB per format.
+slices_per_archive = 60                                   #Number of slices packed into each synthetic archive.
+archive_types = {'.rar': 'rar', '.7z': '7z', '.tar.gz': 'targz'}
+slice_types = {'.tiff': 'orig', '.tif': 'orig', '.npy': 'npy', '.png': 'png'}
+
+class latencyBackend:
+    """
+    This class defines a wrapper around a storage backend that sleeps for a fixed time before every request,
+    so the local backend can stand in for a remote bucket whose per-request latency dominates small transfers.
+    To Call: latencyBackend(backend, latency)
+    Whereas: backend: the localBackend or s3Backend to wrap
+             latency: type float, seconds to wait before each request
+    """
+    request_methods = ['put_file', 'put_bytes', 'copy_object', 'get_file', 'open_range', 'head_object', 'delete_object', 'delete_objects',
+                       'create_multipart', 'upload_part', 'complete_multipart', 'abort_multipart']
+    def __init__(self, backend, latency):
+        self.backend = backend
+        self.latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+        if name not in self.request_methods or self.latency <= 0:
+            return attr
+        def delayed(*args, **kwargs):
+            time.sleep(self.latency)
+            return attr(*args, **kwargs)
+        return delayed
+
+def classify(name):
+    """
+    This function works out the format and container of a file or key name from its extension and name.
+    name:    type str, a file name such as "pre_exp_scan_r1-FTC-x02-y02-z00.npy" or "x02-y02-FTC-png.7z"
+    Returns: List [<format>, <container>], e.g. ["npy", "loose"] or ["png", "7z"]
+    """
+    for ext, container in archive_types.items():
+        if name.endswith(ext):
+            for fmt in ['orig', 'npy', 'png']:
+                if ("-" + fmt + ext) in name:
+                    return [fmt, container]
+            return ['orig', container]
+    for ext, fmt in slice_types.items():
+        if name.endswith(ext):
+            return [fmt, 'loose']
+    return ['other', 'loose']
+
+def synthetic_size(name, scale):
+    """
+    Returns: type int, the size in bytes of the synthetic stand-in for name, scaled by scale.
+    """
+    fmt, container = classify(name)
+    size = slice_sizes.get(fmt, 512) * 1024
+    if container != 'loose':
+        size = size * slices_per_archive
+    return int(size * scale)
+
+def make_file(full_path, size):
+    """
+    This function writes size bytes of incompressible data to full_path, unless it already exists at that size.
+    Returns: None
+    """
+    if os.path.isfile(full_path) and os.path.getsize(full_path) == size:
+        return None
+    dest_dir = os.path.dirname(full_path)
+    if dest_dir != "" and not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir, exist_ok=True)
+    fout = open(full_path, 'wb')
+    remaining = size
+    while remaining > 0:
+        block = os.urandom(min(remaining, 1024 * 1024))
+        fout.write(block)
+        remaining -= len(block)
+    fout.close()
+    return None
+
+def read_test(test_file):
+    """
+    Returns: type list, the non-empty lines of test_file
+    """
+    names = []
+    fin = open(test_file, 'r')
+    for line in fin:
+        line = line.strip()
+        if line != "":
+            names.append(line)
+    fin.close()
+    return names
+
+def describe_test(names):
+    """
+    Returns: List [<format>, <container>] of a .test list, "all"/"mixed" when it spans several
+    """
+    kinds = set()
+    for name in names:
+        kinds.add(tuple(classify(basename(name))))
+    formats = set(kind[0] for kind in kinds)
+    containers = set(kind[1] for kind in kinds)
+    fmt = formats.pop() if len(formats) == 1 else 'all'
+    container = containers.pop() if len(containers) == 1 else 'mixed'
+    return [fmt, container]
+
+def code_version():
+    """
+    Returns: type str, the short git commit of the working tree, with "-dirty" if it has local changes
+    """
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=here, stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here, stderr=subprocess.DEVNULL).decode().strip()
+        if dirty != "":
+            commit = commit + "-dirty"
+        return commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run_case(engine, direction, names, workdir, outdir, max_threads):
+    """
+    This function runs one .test list in one direction on a fresh worker pool, timing every object.
+    engine:      type transferEngine, the engine for the stand-in bucket
+    direction:   type str, "upload" or "download"
+    names:       type list, the lines of the .test file
+    workdir:     type str, directory that upload paths are relative to
+    outdir:      type str, directory to download to
+    max_threads: type int, number of worker threads
+    Returns:     List [<elapsed seconds>, <total bytes>, <sorted per-object latencies in seconds>, <errors>]
+    """
+    latencies = []
+    totals = {'bytes': 0}
+    lock = threading.Lock()
+    def transfer(worker_name, name):
+        start = time.perf_counter()
+        if direction == 'upload':
+            num_bytes = engine.upload_file(os.path.join(workdir, name), basename(name))
+        else:
+            num_bytes = engine.download_file(name, os.path.join(outdir, name))
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            totals['bytes'] += num_bytes
+    start = time.perf_counter()
+    with workerPool(max_threads) as pool:
+        for name in names:
+            pool.submit(transfer, name)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return [elapsed, totals['bytes'], latencies, pool.errors]
+
+def run_benchmark(test_files, thread_counts, workdir, repeat, latency, scale, part_size, max_parts, threshold):
+    """
+    This function runs every .test file in test_files at every thread count against a local stand-in bucket.
+    Synthetic files and objects matching each list are generated under workdir first.
+    Returns: type list, of dict result rows, one per test file, thread count and repetition
+    """
+    version = code_version()
+    data_dir = os.path.join(workdir, "data")
+    seed_dir = os.path.join(workdir, "bucket-download")
+    upload_dir = os.path.join(workdir, "bucket-upload")
+    out_dir = os.path.join(workdir, "out")
+    results = []
+    download_engine = transferEngine("file://" + seed_dir + "/", max(thread_counts), part_size, max_parts, threshold)
+    download_engine.backend = latencyBackend(download_engine.backend, latency)
+    for test_file in test_files:
+        test_name = basename(test_file)
+        names = read_test(test_file)
+        direction = 'upload' if test_name.startswith('upload') else 'download'
+        fmt, container = describe_test(names)
+        for name in names:
+            if direction == 'upload':
+                make_file(os.path.join(data_dir, name), synthetic_size(basename(name), scale))
+            else:
+                make_file(os.path.join(seed_dir, name), synthetic_size(name, scale))
+        for max_threads in thread_counts:
+            for run in range(repeat):
+                if direction == 'upload':
+                    shutil.rmtree(upload_dir, ignore_errors=True)
+                    engine = transferEngine("file://" + upload_dir + "/", max_threads, part_size, max_parts, threshold)
+                    engine.backend = latencyBackend(engine.backend, latency)
+                else:
+                    shutil.rmtree(out_dir, ignore_errors=True)
+                    engine = download_engine
+                elapsed, num_bytes, latencies, errors = run_case(engine, direction, names, data_dir, out_dir, max_threads)
+                if engine != download_engine:
+                    engine.close()
+                row = {'test': test_name, 'direction': direction, 'format': fmt, 'container': container,
+                       'threads': max_threads, 'run': run + 1, 'objects': len(names), 'failed': len(errors),
+                       'bytes': num_bytes, 'seconds': round(elapsed, 6),
+                       'mb_per_s': round(num_bytes / 1048576.0 / elapsed, 3) if elapsed > 0 else 0,
+                       'objects_per_s': round(len(latencies) / elapsed, 3) if elapsed > 0 else 0,
+                       'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                       'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+                       'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+                       'latency_ms': latency * 1000, 'version': version, 'started': str(datetime.now())}
+                print(test_name.ljust(28) + " threads=" + str(max_threads).ljust(4) + " " + str(row['seconds']).rjust(10) + " s "
+                      + str(row['mb_per_s']).rjust(10) + " MB/s " + str(row['objects_per_s']).rjust(10) + " obj/s  p50/p95/p99 ms "
+                      + str(row['p50_ms']) + "/" + str(row['p95_ms']) + "/" + str(row['p99_ms']))
+                results.append(row)
+    download_engine.close()
+    return results
+
+def write_results(results, json_path, csv_path):
+    """
+    This function writes result rows as a JSON list to json_path and/or as CSV to csv_path, either may be None.
+    Returns: None
+    """
+    if json_path != None:
+        fout = open(json_path, 'w')
+        json.dump(results, fout, indent=1)
+        fout.close()
+    if csv_path != None and len(results) > 0:
+        fout = open(csv_path, 'w', newline='')
+        writer = csv.DictWriter(fout, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+        fout.close()
+    return None
+
+def main():
+    """
+    This function runs the transfer benchmark over the repo's upload#.test/download#.test matrix.
+    Returns: None
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Reproducible transfer benchmark over the .test matrix, run against a local stand-in bucket.')
+    parser.add_argument('-f','--tests', help='Comma-separated .test files or globs (default: every upload*test and download*test in the repo).', required=False)
+    parser.add_argument('-t','--threads', help='Comma-separated thread counts to sweep (default: 1,2,4,8,16).', default='1,2,4,8,16')
+    parser.add_argument('-w','--workdir', help='Scratch directory for synthetic data and the stand-in bucket (default: ./bench).', default='bench')
+    parser.add_argument('-r','--repeat', help='Number of runs per test file and thread count (default: 1).', default='1')
+    parser.add_argument('-lat','--latency', help='Simulated per-request latency in ms added by the stand-in bucket (default: 20).', default='20')
+    parser.add_argument('-s','--scale', help='Scale factor for the synthetic file sizes (default: 1.0).', default='1.0')
+    parser.add_argument('-ps','--partsize', help='Part size in MB (default: 8).', default='8')
+    parser.add_argument('-mp','--maxparts', help='Parts in flight (default: 8).', default='8')
+    parser.add_argument('-mt','--threshold', help='Multipart threshold in MB (default: 16).', default='16')
+    parser.add_argument('-j','--json', help='Path to write JSON results to.', required=False)
+    parser.add_argument('-csv','--csv', help='Path to write CSV results to.', required=False)
+    args = parser.parse_args()
+
+    if args.tests == None:
+        patterns = [os.path.join(here, 'upload*test'), os.path.join(here, 'download*test')]
+    else:
+        patterns = args.tests.split(',')
+    test_files = []
+    for pattern in patterns:
+        test_files.extend(sorted(glob.glob(pattern)))
+    if len(test_files) == 0:
+        print("Error: No .test files matched " + ",".join(patterns))
+        return None
+    thread_counts = [int(count) for count in args.threads.split(',')]
+    mb = 1024 * 1024
+    results = run_benchmark(test_files, thread_counts, args.workdir, int(args.repeat), float(args.latency) / 1000.0, float(args.scale),
+                            int(float(args.partsize) * mb), int(args.maxparts), int(float(args.threshold) * mb))
+    write_results(results, args.json, args.csv)
+    if args.json != None:
+        print('Wrote JSON results to ' + args.json)
+    if args.csv != None:
+        print('Wrote CSV results to ' + args.csv)
+    return None
+
+if __name__ == "__main__":
+    main()
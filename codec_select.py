@@ -0,0 +1,264 @@
+import os
+import io
+import argparse
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+from os.path import basename
+import archive_stream
+from transfer_engine import transferEngine
+__author__ = 'MCE123'
+
+candidate_codecs = ['none', 'gzip-1', 'gzip-6', 'gzip-9', 'zstd-1', 'zstd-3', 'zstd-9', 'lz4']   #Codecs tried by default, those whose module is missing are skipped.
+external_archivers = {'7z': [['7z', 'a', '-bd', '-y'], ['7z', 'x', '-bd', '-y']],
+                      'rar': [['rar', 'a', '-idq', '-y'], ['rar', 'x', '-idq', '-y']]}             #Archive formats measured with their command-line tools, when installed.
+default_sample_size = 32 * 1024 * 1024     #Default number of bytes of the dataset that are sampled.
+link_probe_size = 8 * 1024 * 1024          #Size of the object uploaded and downloaded to measure the link.
+
+def sample_files(files, sample_size=default_sample_size):
+    """
+    This function picks files spread evenly across the dataset until about sample_size bytes are chosen, so the
+    sample covers every tile and z range instead of just the first few slices.
+    files:       type list, of [<full_path>, <name>]
+    sample_size: type int, bytes to sample
+    Returns:     List [<sampled files>, <total bytes of the dataset>]
+    """
+    sizes = [os.path.getsize(full_path) for full_path, name in files]
+    total = sum(sizes)
+    if total <= sample_size:
+        return [list(files), total]
+    step = total / float(sample_size)
+    chosen = []
+    sampled = 0
+    position = 0.0
+    for index in range(len(files)):
+        if sampled >= sample_size:
+            break
+        if index >= position:
+            chosen.append(files[index])
+            sampled += sizes[index]
+            position += step
+    return [chosen, total]
+
+def measure_codec(codec, files, max_workers):
+    """
+    This function streams files through the same tar writer, compressor and extractor the transfers use, and
+    times compression and decompression separately.
+    codec:       type str, see archive_stream.parse_codec
+    files:       type list, of [<full_path>, <name in the archive>]
+    max_workers: type int, the number of compressing threads
+    Returns:     type dict, {'codec', 'ratio', 'compress_mb_s', 'decompress_mb_s'}, rates per uncompressed MB
+    """
+    raw_size = sum(os.path.getsize(full_path) for full_path, name in files)
+    start = time.perf_counter()
+    compressed = b"".join(archive_stream.tar_stream(files, codec, max_workers))
+    compress_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    reader = archive_stream.open_decompressor(codec, io.BytesIO(compressed))
+    data = reader.read(1024 * 1024)
+    while data:
+        data = reader.read(1024 * 1024)
+    decompress_seconds = time.perf_counter() - start
+    mb = raw_size / 1048576.0
+    return {'codec': codec, 'ratio': round(len(compressed) / float(max(raw_size, 1)), 4),
+            'compress_mb_s': round(mb / max(compress_seconds, 1e-6), 3),
+            'decompress_mb_s': round(mb / max(decompress_seconds, 1e-6), 3)}
+
+def measure_external(name, files):
+    """
+    This function times an archive format that is only available as a command-line tool, e.g. 7z or rar, on a
+    copy of files in a temporary directory. These can be compared but not streamed, so they are never chosen
+    automatically.
+    Returns: type dict, as measure_codec, or None if the tool isn't installed
+    """
+    create, extract = external_archivers[name]
+    if shutil.which(create[0]) == None:
+        return None
+    work = tempfile.mkdtemp(prefix="codec-")
+    try:
+        names = []
+        for full_path, arcname in files:
+            names.append(basename(arcname))
+            shutil.copyfile(full_path, os.path.join(work, names[-1]))
+        raw_size = sum(os.path.getsize(full_path) for full_path, arcname in files)
+        start = time.perf_counter()
+        subprocess.check_call(create + ["sample." + name] + names, cwd=work, stdout=subprocess.DEVNULL)
+        compress_seconds = time.perf_counter() - start
+        size = os.path.getsize(os.path.join(work, "sample." + name))
+        os.mkdir(os.path.join(work, "out"))
+        start = time.perf_counter()
+        subprocess.check_call(extract + [os.path.join("..", "sample." + name)], cwd=os.path.join(work, "out"), stdout=subprocess.DEVNULL)
+        decompress_seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    mb = raw_size / 1048576.0
+    return {'codec': name + ' (external)', 'ratio': round(size / float(max(raw_size, 1)), 4),
+            'compress_mb_s': round(mb / max(compress_seconds, 1e-6), 3),
+            'decompress_mb_s': round(mb / max(decompress_seconds, 1e-6), 3)}
+
+def measure_link(engine, probe_size=link_probe_size):
+    """
+    This function measures the bandwidth to the bucket of engine by uploading and downloading one probe object,
+    which is deleted afterwards. A single stream underestimates what many parallel transfers reach, so pass the
+    bandwidth explicitly when it is known.
+    Returns: List [<upload MB/s>, <download MB/s>]
+    """
+    key = ".codec-probe-" + uuid.uuid4().hex
+    data = os.urandom(probe_size)
+    mb = probe_size / 1048576.0
+    start = time.perf_counter()
+    engine.upload_data(data, key)
+    upload_seconds = time.perf_counter() - start
+    try:
+        start = time.perf_counter()
+        engine.read_range(key, 0)
+        download_seconds = time.perf_counter() - start
+    finally:
+        engine.delete_object(key)
+    return [mb / max(upload_seconds, 1e-6), mb / max(download_seconds, 1e-6)]
+
+def estimate(result, total_bytes, upload_mb_s, download_mb_s):
+    """
+    This function estimates the end-to-end time of the whole dataset with one codec. Compression, transfer and
+    decompression are streamed, so each direction takes as long as its slowest stage.
+    Returns: type dict, result with 'upload_s', 'download_s' and 'total_s' added
+    """
+    mb = total_bytes / 1048576.0
+    estimated = dict(result)
+    estimated['upload_s'] = round(max(mb / result['compress_mb_s'], mb * result['ratio'] / upload_mb_s), 3)
+    estimated['download_s'] = round(max(mb * result['ratio'] / download_mb_s, mb / result['decompress_mb_s']), 3)
+    estimated['total_s'] = round(estimated['upload_s'] + estimated['download_s'], 3)
+    return estimated
+
+def available_codecs(codecs=candidate_codecs):
+    """
+    Returns: type list, the codecs in codecs whose modules are installed
+    """
+    available = []
+    for codec in codecs:
+        try:
+            archive_stream.parse_codec(codec)
+            available.append(codec)
+        except ImportError:
+            continue
+    return available
+
+def compare_codecs(files, engine=None, bandwidth=None, sample_size=default_sample_size, codecs=candidate_codecs, max_workers=None):
+    """
+    This function samples files, measures every available codec on the sample and estimates the upload and download
+    time of the whole dataset with each, at the given bandwidth or, without one, the bandwidth measured to engine.
+    files:       type list, of [<full_path>, <name in the archive>]
+    engine:      type transferEngine, used to measure the link when bandwidth is None
+    bandwidth:   type list, [<upload MB/s>, <download MB/s>], or None to measure it
+    sample_size: type int, bytes of the dataset to sample
+    codecs:      type list, of codec names to try
+    max_workers: type int, the number of compressing threads, None for one per CPU
+    Returns:     type dict, {'total_bytes', 'sample_bytes', 'upload_mb_s', 'download_mb_s', 'results', 'upload',
+                 'download', 'both'}, where results are sorted by total time and upload, download and both name the
+                 fastest streamable codec for each
+    """
+    if max_workers == None:
+        max_workers = os.cpu_count() or 1
+    sample, total_bytes = sample_files(files, sample_size)
+    if bandwidth == None:
+        bandwidth = measure_link(engine)
+    upload_mb_s, download_mb_s = bandwidth
+    results = []
+    for codec in available_codecs(codecs):
+        results.append(estimate(measure_codec(codec, sample, max_workers), total_bytes, upload_mb_s, download_mb_s))
+    for name in external_archivers:
+        result = measure_external(name, sample)
+        if result != None:
+            results.append(estimate(result, total_bytes, upload_mb_s, download_mb_s))
+    results.sort(key=lambda result: result['total_s'])
+    streamable = [result for result in results if not result['codec'].endswith('(external)')]
+    return {'total_bytes': total_bytes, 'sample_bytes': sum(os.path.getsize(full_path) for full_path, name in sample),
+            'upload_mb_s': round(upload_mb_s, 3), 'download_mb_s': round(download_mb_s, 3), 'results': results,
+            'upload': min(streamable, key=lambda result: result['upload_s'])['codec'],
+            'download': min(streamable, key=lambda result: result['download_s'])['codec'],
+            'both': streamable[0]['codec']}
+
+def report(comparison):
+    """
+    Returns: type list, of str lines showing a comparison from compare_codecs as a table with the recommendations
+    """
+    lines = []
+    lines.append('Dataset: ' + str(comparison['total_bytes']) + ' bytes, sampled ' + str(comparison['sample_bytes'])
+                 + ' bytes, link ' + str(comparison['upload_mb_s']) + ' MB/s up, ' + str(comparison['download_mb_s']) + ' MB/s down')
+    lines.append('Codec'.ljust(18) + 'Ratio'.rjust(8) + 'Comp MB/s'.rjust(12) + 'Decomp MB/s'.rjust(13) + 'Upload s'.rjust(11) + 'Download s'.rjust(12) + 'Total s'.rjust(10))
+    for result in comparison['results']:
+        lines.append(result['codec'].ljust(18) + str(result['ratio']).rjust(8) + str(result['compress_mb_s']).rjust(12)
+                     + str(result['decompress_mb_s']).rjust(13) + str(result['upload_s']).rjust(11)
+                     + str(result['download_s']).rjust(12) + str(result['total_s']).rjust(10))
+    lines.append('Fastest Upload: ' + comparison['upload'] + ', Fastest Download: ' + comparison['download'] + ', Fastest Round Trip: ' + comparison['both'])
+    return lines
+
+def dataset_files(path):
+    """
+    This function lists a dataset given as a directory or as a .test file of paths.
+    Returns: type list, of [<full_path>, <name in the archive>]
+    """
+    files = []
+    if os.path.isdir(path):
+        for dirName, subdirList, fileList in os.walk(path):
+            subdirList.sort()
+            for fname in sorted(fileList):
+                full_path = os.path.join(dirName, fname)
+                files.append([full_path, os.path.relpath(full_path, path).replace(os.sep, "/")])
+        return files
+    fin = open(path, 'r')
+    for line in fin:
+        line = line.strip()
+        if line != "":
+            files.append([line, os.path.normpath(line).replace(os.sep, "/").lstrip("/")])
+    fin.close()
+    return files
+
+def main():
+    """
+    This function compares the codecs on a dataset and prints which one is fastest end to end.
+    Returns: None
+    """
+    parser = argparse.ArgumentParser(description='Measure compression codecs on a sample of a dataset and recommend the fastest end to end.')
+    parser.add_argument('-f','--dataset', help='Directory or upload#.test file of the dataset to sample.', required=True)
+    parser.add_argument('-b','--bucket', help='Bucket path to measure the link to, s3://bucket-name/ or file://local/dir/.', required=False)
+    parser.add_argument('-bw','--bandwidth', help='Link bandwidth in MB/s instead of measuring it, "up,down" or one number for both.', required=False)
+    parser.add_argument('-s','--sample', help='MB of the dataset to sample (default: 32).', default='32')
+    parser.add_argument('-cc','--codecs', help='Comma-separated codecs to try (default: ' + ",".join(candidate_codecs) + ').', required=False)
+    parser.add_argument('-j','--json', help='Path to write the comparison to as JSON.', required=False)
+    args = parser.parse_args()
+
+    files = dataset_files(args.dataset)
+    if len(files) == 0:
+        print("Error: No files found in " + args.dataset)
+        return None
+    bandwidth = None
+    engine = None
+    if args.bandwidth != None:
+        rates = [float(rate) for rate in args.bandwidth.split(',')]
+        bandwidth = [rates[0], rates[-1]]
+    elif args.bucket != None:
+        engine = transferEngine(args.bucket)
+    else:
+        print("Error: Give the bucket to measure the link to with -b, or the bandwidth with -bw.")
+        return None
+    codecs = candidate_codecs
+    if args.codecs != None:
+        codecs = args.codecs.split(',')
+    comparison = compare_codecs(files, engine, bandwidth, int(float(args.sample) * 1024 * 1024), codecs)
+    if engine != None:
+        engine.close()
+    for line in report(comparison):
+        print(line)
+    if args.json != None:
+        fout = open(args.json, 'w')
+        json.dump(comparison, fout, indent=1)
+        fout.close()
+        print('Wrote JSON results to ' + args.json)
+    return None
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import threading
+import time
+__author__ = 'MCE123'
+
+default_start_workers = 4         #Number of active workers an adaptive run starts with, the same as the default -t.
+default_max_workers = 128         #Number of worker threads started for an adaptive run, the most that can ever be active.
+default_interval = 2.0            #Seconds of transfers measured before each adjustment decision.
+goodput_tolerance = 0.1           #Relative change in goodput between intervals that is treated as noise.
+error_decrease = 0.5              #Factor the active workers are cut by after errors or retries.
+goodput_decrease = 0.75           #Factor the active workers are cut by when more workers gave less goodput.
+
+class aimdController:
+    """
+    This class defines the adaptive concurrency controller behind -t auto. Every interval seconds it measures the
+    goodput (bytes of successful transfers per second) and the failures and retries recorded in trace, and
+    changes how many of the workers of a workerPool may run jobs at once, by additive-increase /
+    multiplicative-decrease:
+      - failures or retries (e.g. S3 503 SlowDown) halve the active workers,
+      - goodput more than goodput_tolerance below the best seen with fewer workers cuts them by a quarter, but
+        not below that number of workers,
+      - otherwise one more worker is added, or twice as many while goodput still grows (slow start, as in TCP).
+    The best goodput is remeasured whenever the pool runs at its number of workers again, so it follows changes
+    in the network instead of holding on to one lucky interval.
+    No decision is made while the pool has no jobs waiting, since goodput then says nothing about concurrency.
+    Every decision is kept in decisions, to be printed and logged with the run.
+    To Call: aimdController(trace, start_workers, max_workers, interval)
+    Whereas: trace:         type transferTrace, the trace the transfers of the pool are recorded in
+             start_workers: type int, the number of active workers to start with
+             max_workers:   type int, the number of worker threads to start, the most that can be active
+             interval:      type float, seconds between decisions
+    """
+    def __init__(self, trace, start_workers=default_start_workers, max_workers=default_max_workers, interval=default_interval):
+        if start_workers < 1 or max_workers < start_workers:
+            raise ValueError("aimdController needs 1 <= start_workers <= max_workers, got " + str(start_workers) + " and " + str(max_workers))
+        self.trace = trace
+        self.workers = start_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.slow_start = True
+        self.last_goodput = None
+        self.best = None
+        self.decisions = []
+        self.pool = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def sample(self):
+        """
+        Returns: List [<bytes>, <completed>, <failed + retries>] recorded in trace so far
+        """
+        with self.trace.lock:
+            return [self.trace.num_bytes, self.trace.completed, self.trace.failed + self.trace.retries]
+
+    def decide(self, goodput, errors):
+        """
+        This function works out the next number of active workers from one interval's measurements.
+        goodput: type float, bytes per second of the transfers that succeeded in the interval
+        errors:  type int, failed transfers and retries in the interval
+        Returns: List [<new number of active workers>, <reason str>]
+        """
+        workers = self.workers
+        last_goodput = self.last_goodput
+        best = self.best
+        if errors > 0:
+            self.slow_start = False
+            new_workers = max(1, int(workers * error_decrease))
+            reason = str(errors) + " errors/retries"
+        elif best != None and workers > best[1] and goodput < best[0] * (1 - goodput_tolerance):
+            self.slow_start = False
+            new_workers = max(best[1], int(workers * goodput_decrease))
+            reason = "goodput " + str(round(100 - 100.0 * goodput / best[0])) + "% below " + str(best[1]) + " workers"
+        elif self.slow_start and (last_goodput == None or goodput >= last_goodput * (1 + goodput_tolerance)):
+            new_workers = min(self.max_workers, workers * 2)
+            reason = "slow start"
+        else:
+            self.slow_start = False
+            new_workers = min(self.max_workers, workers + 1)
+            reason = "additive increase"
+        self.last_goodput = goodput
+        if best == None or goodput > best[0] or workers == best[1]:
+            self.best = [goodput, workers]
+        return [new_workers, reason]
+
+    def start(self, pool):
+        """
+        Starts controlling how many workers of pool are active. pool must have max_workers workers.
+        Returns: None
+        """
+        self.pool = pool
+        self.last_goodput = None
+        self.best = None
+        pool.set_active(self.workers)
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="Controller", daemon=True)
+        self.thread.start()
+        return None
+
+    def run(self):
+        num_bytes, completed, errors = self.sample()
+        started_at = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            now = time.perf_counter()
+            new_bytes, new_completed, new_errors = self.sample()
+            if self.pool.backlog() == 0 or new_completed == completed:
+                #Not enough work to measure, so keep the interval open until there is
+                continue
+            goodput = (new_bytes - num_bytes) / (now - started_at)
+            workers = self.workers
+            self.workers, reason = self.decide(goodput, new_errors - errors)
+            self.pool.set_active(self.workers)
+            self.decisions.append('Concurrency at ' + str(round(now - self.trace.started_at, 1)) + 's: ' + str(workers) + ' -> ' + str(self.workers)
+                                  + ' workers, goodput ' + str(round(goodput / 1048576.0, 2)) + ' MB/s, '
+                                  + str(new_errors - errors) + ' errors/retries (' + reason + ')')
+            num_bytes, completed, errors = new_bytes, new_completed, new_errors
+            started_at = now
+
+    def stop(self):
+        """
+        Stops adjusting the pool. Returns: type list, of str decisions made so far, for printing and the log file
+        """
+        if self.thread != None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+        return self.decisions
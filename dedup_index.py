@@ -0,0 +1,216 @@
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import time
+from transfer_engine import file_md5, is_not_found, is_precondition_failed
+__author__ = 'MCE123'
+
+index_prefix = ".s3dedup-"        #Prefix of the local dedup index files.
+manifest_version = 1              #Version of the manifest object layout written by save_manifest.
+commit_rows = 256                 #Number of changed rows of the index committed together.
+
+def index_path(directory, bucket_path):
+    """
+    Returns: type str, the path of the dedup index of bucket_path inside directory, .s3dedup-<hash>.db
+    """
+    return os.path.join(directory, index_prefix + hashlib.md5(bucket_path.encode('utf-8')).hexdigest()[:16] + ".db")
+
+class dedupIndex:
+    """
+    This class defines the content-addressed deduplication layer of uploads. Every file is identified by the MD5
+    of its contents, and the index records which keys of the bucket hold which contents, so an upload of content
+    the bucket already holds becomes:
+      - a skip, if key itself already holds it (confirmed with a HEAD request, which transfers no body),
+      - a server-side copy from another key holding it, e.g. for the byte-identical blank slices of many tiles,
+    and only new content is actually sent. The MD5 of each local file is kept against its size and mtime, so
+    files that didn't change since an earlier run aren't even read again.
+    The index is a SQLite database shared by all worker threads, like the object cache. Changes are committed
+    commit_rows at a time and at close(), since the index is only a cache: rows lost to a crash just mean those
+    files are hashed or uploaded again. With manifest_key, it is also merged with a manifest object in the
+    bucket at the start of the run and written back at the end, so several machines uploading to the same
+    bucket share what each of them stored.
+    To Call: dedupIndex(path, manifest_key)
+    Whereas: path:         type str, relative or absolute path to the index file, see index_path
+             manifest_key: type str, the key of the manifest object in the bucket, or None for a local index only
+    """
+    def __init__(self, path, manifest_key=None):
+        self.path = path
+        self.manifest_key = manifest_key
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, md5 TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS objects (key TEXT PRIMARY KEY, md5 TEXT, size INTEGER, etag TEXT, stored_at REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS objects_md5 ON objects (md5, size)")
+        self.conn.commit()
+        self.pending = 0
+        self.stats = {'skipped': 0, 'copied': 0, 'uploaded': 0, 'bytes_avoided': 0, 'hashed_bytes': 0}
+
+    def changed(self):
+        """
+        Counts one changed row, committing once commit_rows have built up. Must be called holding lock.
+        Returns: None
+        """
+        self.pending += 1
+        if self.pending >= commit_rows:
+            self.conn.commit()
+            self.pending = 0
+        return None
+
+    def count(self, stat, value=1):
+        with self.lock:
+            self.stats[stat] += value
+
+    def file_md5(self, full_path, stat):
+        """
+        Returns: type str, the hex MD5 of the local file full_path, read only if it changed since it was last hashed
+        """
+        path = os.path.abspath(full_path)
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime_ns, md5 FROM files WHERE path = ?", [path]).fetchone()
+        if row != None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        md5 = file_md5(full_path)
+        self.count('hashed_bytes', stat.st_size)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", [path, stat.st_size, stat.st_mtime_ns, md5])
+            self.changed()
+        return md5
+
+    def lookup(self, key):
+        """
+        Returns: List [<md5>, <size>, <etag>] of the contents recorded for key, or None
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT md5, size, etag FROM objects WHERE key = ?", [key]).fetchone()
+        if row == None:
+            return None
+        return list(row)
+
+    def find(self, md5, size, exclude_key):
+        """
+        Returns: List [<key>, <etag>] of a key other than exclude_key recorded as holding the contents md5, or None
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT key, etag FROM objects WHERE md5 = ? AND size = ? AND key != ? LIMIT 1", [md5, size, exclude_key]).fetchone()
+        if row == None:
+            return None
+        return list(row)
+
+    def record(self, key, md5, size, etag):
+        """
+        Records that key holds the contents md5. Returns: None
+        """
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)", [key, md5, size, etag, time.time()])
+            self.changed()
+        return None
+
+    def forget(self, key):
+        """
+        Removes key from the index, e.g. once it turned out to be gone from the bucket. Returns: None
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM objects WHERE key = ?", [key])
+            self.changed()
+        return None
+
+    def upload(self, engine, full_path, key, stats=None, stat=None):
+        """
+        This function uploads the local file full_path to key unless the bucket already holds its contents. A copy
+        source that is gone or changed is forgotten; one that fails for another reason is kept and the file uploaded.
+        engine:    type transferEngine, the engine for the bucket
+        full_path: type str, the local file to upload
+        key:       type str, the key to upload to
+        stats:     type dict, optional timing details filled in by engine.upload_object
+        stat:      type os.stat_result, of full_path if already known, or None
+        Returns:   type int, the number of bytes actually sent, 0 for a skip or a server-side copy
+        """
+        if stat == None:
+            stat = os.stat(full_path)
+        size = stat.st_size
+        md5 = self.file_md5(full_path, stat)
+        entry = self.lookup(key)
+        if entry != None and entry[0] == md5 and entry[1] == size:
+            try:
+                head = engine.head_object(key)
+            except Exception:
+                head = None
+            if head != None and head['etag'] == entry[2] and head['size'] == size:
+                self.count('skipped')
+                self.count('bytes_avoided', size)
+                return 0
+        source = self.find(md5, size, key)
+        while source != None:
+            try:
+                #Conditional on the recorded ETag, so a source overwritten outside of -dd is never copied
+                etag = engine.copy_object(source[0], key, source[1], md5, stats)
+            except Exception as e:
+                if not is_not_found(e) and not is_precondition_failed(e):
+                    #Throttling, timeouts or a source too large to copy say nothing about the entry, so keep it
+                    break
+                #The source is gone or changed, so stop offering it and try the next one
+                self.forget(source[0])
+                source = self.find(md5, size, key)
+                continue
+            self.record(key, md5, size, etag)
+            self.count('copied')
+            self.count('bytes_avoided', size)
+            return 0
+        result = engine.upload_object(full_path, key, stats, stat)
+        self.record(key, md5, size, result['etag'])
+        self.count('uploaded')
+        return result['size']
+
+    def load_manifest(self, engine):
+        """
+        Merges the manifest object manifest_key of the bucket into the index, if it exists. The manifest is
+        authoritative for the keys it lists. Errors other than a missing manifest are raised.
+        Returns: type int, the number of keys merged
+        """
+        try:
+            data = engine.read_range(self.manifest_key, 0)[0]
+        except Exception as e:
+            if not is_not_found(e):
+                raise
+            return 0
+        manifest = json.loads(data.decode('utf-8'))
+        if manifest.get('version') != manifest_version:
+            raise ValueError(self.manifest_key + " is not a version " + str(manifest_version) + " dedup manifest")
+        rows = []
+        now = time.time()
+        for key, entry in manifest['objects'].items():
+            rows.append([key, entry[0], entry[1], entry[2], now])
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+        return len(rows)
+
+    def save_manifest(self, engine):
+        """
+        Writes every key of the index to the manifest object manifest_key of the bucket. Returns: None
+        """
+        objects = {}
+        with self.lock:
+            for key, md5, size, etag in self.conn.execute("SELECT key, md5, size, etag FROM objects"):
+                if key != self.manifest_key:
+                    objects[key] = [md5, size, etag]
+        data = json.dumps({'version': manifest_version, 'objects': objects}, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        engine.upload_data(data, self.manifest_key)
+        return None
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def report(self):
+        """
+        Returns: type list, of str lines summarizing the deduplication of this run, for printing and the log file
+        """
+        stats = self.stats
+        lines = []
+        lines.append('Dedup Skipped: ' + str(stats['skipped']) + ', Dedup Server-Side Copies: ' + str(stats['copied']) + ', Dedup Uploaded: ' + str(stats['uploaded']))
+        lines.append('Dedup Bytes Avoided: ' + str(stats['bytes_avoided']) + ', Dedup Bytes Hashed: ' + str(stats['hashed_bytes']))
+        return lines
@@ -0,0 +1,95 @@
+import os
+import queue
+import threading
+import collections
+__author__ = 'MCE123'
+
+default_scan_workers = 4          #Number of directories scanned at once, which hides the latency of network filesystems.
+scan_queue_files = 1024           #Number of found files buffered between the scanning threads and the consumer.
+
+def scan_files(indir, max_workers=default_scan_workers, onerror=None):
+    """
+    This function walks indir with os.scandir and yields every regular file in it as soon as it is found, so
+    uploads start while the rest of the tree is still being scanned. max_workers threads each scan one directory
+    at a time, and at most scan_queue_files found files wait for the consumer, so memory stays constant no
+    matter how many files the tree holds; only the paths of directories not yet scanned are kept. Files are
+    yielded in no particular order. Symbolic links to files are followed, symbolic links to directories are not,
+    the same as os.walk. A directory that can't be read (e.g. no permission) is skipped and the scan goes on, also
+    like os.walk; onerror, if given, is called with the OSError from a scanning thread.
+    indir:       type str, relative or absolute path to the directory
+    max_workers: type int, the number of scanning threads
+    onerror:     type function, called as onerror(<OSError>) for each skipped directory, or None to skip silently
+    Returns:     generator of [<full_path>, <file name>, <os.stat_result of the file>]
+    """
+    found = queue.Queue(maxsize=scan_queue_files)
+    pending = collections.deque([indir])
+    condition = threading.Condition()
+    busy = [0]
+    stopped = threading.Event()
+    def put_found(item):
+        #Gives up once the consumer has stopped, so an abandoned scan doesn't block its threads forever
+        while not stopped.is_set():
+            try:
+                found.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    def next_directory():
+        with condition:
+            while len(pending) == 0 and busy[0] > 0 and not stopped.is_set():
+                condition.wait()
+            if len(pending) == 0 or stopped.is_set():
+                condition.notify_all()
+                return None
+            busy[0] += 1
+            return pending.pop()
+    def scan_worker():
+        try:
+            path = next_directory()
+            while path != None:
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                with condition:
+                                    pending.append(entry.path)
+                                    condition.notify()
+                            elif entry.is_file():
+                                if not put_found([entry.path, entry.name, entry.stat()]):
+                                    return None
+                except OSError as e:
+                    #One unreadable directory doesn't abort the scan, the files already found stay found
+                    if onerror != None:
+                        onerror(e)
+                finally:
+                    with condition:
+                        busy[0] -= 1
+                        condition.notify_all()
+                path = next_directory()
+        except Exception as e:
+            put_found(e)
+            stopped.set()
+        finally:
+            put_found(None)
+    workers = []
+    for worker_id in range(max(1, max_workers)):
+        worker = threading.Thread(target=scan_worker, name="Scan-" + str(worker_id), daemon=True)
+        worker.start()
+        workers.append(worker)
+    try:
+        running = len(workers)
+        while running > 0:
+            item = found.get()
+            if item == None:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stopped.set()
+        with condition:
+            condition.notify_all()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,188 @@
+import os
+import hashlib
+import shutil
+import sqlite3
+import threading
+import time
+__author__ = 'MCE123'
+
+default_cache_size = 10 * 1024     #Default cache budget in MB if not specified.
+
+def place_file(src_path, dest_path):
+    """
+    This function puts a copy of src_path at dest_path, as a hardlink when both are on the same filesystem, or
+    as a copy otherwise. An existing dest_path is replaced.
+    src_path:  type str, path to the existing file
+    dest_path: type str, path to create
+    Returns:   None
+    """
+    dest_dir = os.path.dirname(dest_path)
+    if dest_dir != "" and not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir, exist_ok=True)
+    tmp_path = dest_path + ".cache-tmp"
+    try:
+        os.link(src_path, tmp_path)
+    except OSError:
+        shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+    return None
+
+class objectCache:
+    """
+    This class defines a size-bounded on-disk cache of downloaded objects, keyed by bucket path, key and ETag,
+    with least-recently-used eviction. Cache hits are placed in the output directory by hardlink (or copy across
+    filesystems), so files served from the cache should be treated as read-only.
+    A cached entry is revalidated with a conditional GET (If-None-Match), which costs one small request and
+    no body when the object hasn't changed. Entries validated less than ttl seconds ago are trusted without
+    contacting the bucket at all.
+    The index is a SQLite database, cache.db, inside cache_dir, shared by all worker threads.
+    To Call: objectCache(cache_dir, max_bytes, ttl)
+    Whereas: cache_dir: type str, relative or absolute path to the cache directory, created if needed
+             max_bytes: type int, the size budget of the cached objects in bytes
+             ttl:       type float, seconds an entry is trusted after it was last validated, 0 to always revalidate
+    """
+    def __init__(self, cache_dir, max_bytes=default_cache_size * 1024 * 1024, ttl=0):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(cache_dir, "cache.db"), check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS entries (bucket TEXT, key TEXT, etag TEXT, size INTEGER, validated_at REAL, last_access REAL, PRIMARY KEY (bucket, key))")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+        self.conn.commit()
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'bytes_saved': 0, 'evicted': 0}
+        #The budget may be smaller than on the previous run
+        self.evict()
+
+    def entry_path(self, bucket_path, key, etag):
+        name = hashlib.sha256((bucket_path + "\n" + key + "\n" + etag).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, name[:2], name)
+
+    def lookup(self, bucket_path, key):
+        """
+        Returns: List [<etag>, <size>, <validated_at>] of the cached entry for key, or None
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT etag, size, validated_at FROM entries WHERE bucket = ? AND key = ?", [bucket_path, key]).fetchone()
+        if row == None:
+            return None
+        return list(row)
+
+    def touch(self, bucket_path, key, validated):
+        """
+        Marks the entry for key as just used, and as just validated if validated is True. Returns: None
+        """
+        now = time.time()
+        with self.lock:
+            if validated:
+                self.conn.execute("UPDATE entries SET last_access = ?, validated_at = ? WHERE bucket = ? AND key = ?", [now, now, bucket_path, key])
+            else:
+                self.conn.execute("UPDATE entries SET last_access = ? WHERE bucket = ? AND key = ?", [now, bucket_path, key])
+            self.conn.commit()
+        return None
+
+    def store(self, bucket_path, key, etag, full_path):
+        """
+        Adds the downloaded file full_path to the cache as (bucket_path, key, etag), replacing any older version of
+        key, then evicts least recently used entries until the cache fits in max_bytes. Returns: None
+        """
+        size = os.path.getsize(full_path)
+        if size > self.max_bytes:
+            return None
+        old = self.lookup(bucket_path, key)
+        if old != None and old[0] != etag:
+            self.remove_file(bucket_path, key, old[0])
+        place_file(full_path, self.entry_path(bucket_path, key, etag))
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", [bucket_path, key, etag, size, now, now])
+            self.conn.commit()
+        self.evict()
+        return None
+
+    def remove_file(self, bucket_path, key, etag):
+        try:
+            os.remove(self.entry_path(bucket_path, key, etag))
+        except FileNotFoundError:
+            None
+        return None
+
+    def evict(self):
+        """
+        Removes least recently used entries until the total cached size is at most max_bytes. Returns: None
+        """
+        with self.lock:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return None
+            victims = []
+            for bucket_path, key, etag, size in self.conn.execute("SELECT bucket, key, etag, size FROM entries ORDER BY last_access"):
+                if total <= self.max_bytes:
+                    break
+                victims.append([bucket_path, key, etag])
+                total -= size
+            self.conn.executemany("DELETE FROM entries WHERE bucket = ? AND key = ?", [[victim[0], victim[1]] for victim in victims])
+            self.conn.commit()
+            self.stats['evicted'] += len(victims)
+        for bucket_path, key, etag in victims:
+            self.remove_file(bucket_path, key, etag)
+        return None
+
+    def count(self, stat, value=1):
+        with self.lock:
+            self.stats[stat] += value
+
+    def download(self, engine, key, full_path, stats=None):
+        """
+        This function downloads key through the cache. Hits are placed at full_path without transferring the body;
+        misses are downloaded with engine.download_object and then stored.
+        engine:    type transferEngine, the engine for the bucket
+        key:       type str, the key to download
+        full_path: type str, the local file to create
+        stats:     type dict, optional timing details filled in by engine.download_object
+        Returns:   type int, the size of the file
+        """
+        bucket_path = engine.bucket_path
+        entry = self.lookup(bucket_path, key)
+        if entry != None and not os.path.isfile(self.entry_path(bucket_path, key, entry[0])):
+            entry = None
+        #full_path may be a hardlink to a cached copy from an earlier run. It is kept until the new contents are
+        #complete: place_file and download_object both rename over it, which never writes through the link, and
+        #a failed transfer leaves it as it was
+        if entry != None:
+            etag, size, validated_at = entry
+            if time.time() - validated_at < self.ttl:
+                result = None
+                validated = False
+            else:
+                result = engine.download_object(key, full_path, if_none_match=etag, stats=stats)
+                validated = True
+            if result == None:
+                place_file(self.entry_path(bucket_path, key, etag), full_path)
+                self.touch(bucket_path, key, validated)
+                self.count('hits')
+                self.count('bytes_saved', size)
+                if validated:
+                    self.count('revalidated')
+                return size
+        else:
+            result = engine.download_object(key, full_path, stats=stats)
+        self.count('misses')
+        self.store(bucket_path, key, result['etag'], full_path)
+        return result['size']
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def report(self):
+        """
+        Returns: type list, of str lines summarizing the cache statistics of this run, for printing and the log file
+        """
+        stats = self.stats
+        lines = []
+        lines.append('Cache Hits: ' + str(stats['hits']) + ' (' + str(stats['revalidated']) + ' revalidated), Cache Misses: ' + str(stats['misses']))
+        lines.append('Cache Bytes Saved: ' + str(stats['bytes_saved']) + ', Cache Evictions: ' + str(stats['evicted']))
+        return lines
@@ -1,9 +1,23 @@
 import os
 from os.path import basename
 import argparse
+import time
 from datetime import datetime
-import threading
-import subprocess
+from transfer_engine import transferEngine
+from worker_pool import workerPool
+import sync_engine
+from object_cache import objectCache, default_cache_size
+from transfer_trace import transferTrace, progressView
+import slice_convert
+import zstack_volume
+import archive_stream
+import codec_select
+import async_engine
+import concurrency_control
+import transfer_journal
+import dir_scan
+import dedup_index
+import shard_bundle
 __author__ = 'MCE123'
 
 class bcolors:
@@ -27,13 +41,57 @@ class bcolors:
 
 def main():
     """
-    This function runs the main program code, and makes calls to subprocedures to process file commands.
+    This function runs the main program code, and closes everything the run opened, also when it stops early on
+    an error.
+    Returns: None
+    """
+    run = {}
+    try:
+        return run_main(run)
+    finally:
+        close_run(run)
+
+def close_run(run):
+    """
+    This function stops and closes what run_main opened: the progress line, the thread controller, the conversion
+    processes, the engine's part workers, journal and trace file, the dedup index and the object cache.
+    run:     type dict, of what run_main opened so far, by name
+    Returns: None
+    """
+    if run.get('progress') != None:
+        run['progress'].stop()
+    if run.get('controller') != None:
+        run['controller'].stop()
+    if run.get('converter') != None:
+        run['converter'].close()
+    engine = run.get('engine')
+    if engine != None:
+        engine.close()
+        if engine.journal != None:
+            engine.journal.close()
+        if engine.trace != None:
+            engine.trace.close()
+    if run.get('dedup') != None:
+        run['dedup'].close()
+    if run.get('cache') != None:
+        run['cache'].close()
+    return None
+
+def run_main(run):
+    """
+    This function parses the input arguments and runs the requested mode, adding everything it opens to run, so
+    main can close it.
+    run:     type dict, filled in with the engine, cache, dedup index, converter, controller and progress line
     Returns: None
     """
     bucket_path = "s3://comp821-m1.spring2018/"    #Default S3 bucket information, in the format "s3://bucket-name/".
     log_file = "tests.log"                         #Default .log file to write out results to.
     max_threads = 4                                #Default number of threads if not specified.
-    highest_threads = 8                            #Highest possible number of threads, in case number specified is greater than this number.
+    part_size = 8                                  #Default size in MB of each byte range when a large object is split into parts.
+    max_parts = 8                                  #Default number of parts of large objects that may be in flight at once.
+    threshold = 16                                 #Default size in MB above which files are uploaded as multipart uploads.
+    highest_threads = 512                          #Highest possible number of threads, in case number specified is greater than this number.
+    highest_requests = 4096                        #Highest possible number of requests in flight with -as, in case number specified is greater than this number.
     logging = False                                #Default - do not change this value. Logging will be enabled only if there is write access to the log_file.
     
     print('\b' + bcolors.BOLD + __file__ + ' by Patrick R. McElhiney, MCE123 (http://www.mce123.com/)' + bcolors.ENDC + '\b')
@@ -42,7 +100,7 @@ def main():
     parser = argparse.ArgumentParser(description='This is a build-terraform script by MCE123.')
     parser.add_argument('-i','--indir', help='Input directory, implies mode Upload',required=False)
     parser.add_argument('-o','--outdir', help='Output directory, implies mode Download',required=False)
-    parser.add_argument('-t','--threads', help='Number of Threads to Use', required=False)
+    parser.add_argument('-t','--threads', help='Number of Threads to Use, or auto to tune it during the run from the measured goodput (with -i, -o, -u or -d).', required=False)
     parser.add_argument('-d','--download', help='Path to download#.test file for list of files to download.', required=False)
     parser.add_argument('-u','--upload', help='Path to upload#.test file for list of files to upload.', required=False)
     parser.add_argument('-l','--log', help='Path to .log file to write out statistics to.', required=False)
@@ -50,12 +108,53 @@ def main():
     parser.add_argument('-su','--syncupload', help='Input Directory.', required=False)
     parser.add_argument('-pt','--purgetest', help='Path to .test file for list of files to delete from S3 bucket from test case.', required=False)
     parser.add_argument('-pa','--purgeall', help='Enter the name of the S3 bucket to confirm to purge all files in the S3 bucket path.', required=False)
+    parser.add_argument('-ps','--partsize', help='Size in MB of each part when large objects are split into concurrent byte ranges.', required=False)
+    parser.add_argument('-mp','--maxparts', help='Number of parts of large objects to transfer concurrently.', required=False)
+    parser.add_argument('-mt','--threshold', help='Size in MB above which files are uploaded as concurrent multipart uploads.', required=False)
+    parser.add_argument('-del','--delete', help='With -sd or -su, also delete files removed from the source since the last sync.', action='store_true', required=False)
+    parser.add_argument('-c','--cache', help='Directory of a local object cache used by downloads, keyed by bucket, key and ETag.', required=False)
+    parser.add_argument('-cs','--cachesize', help='Size budget in MB of the object cache, least recently used objects are evicted beyond it.', required=False)
+    parser.add_argument('-ct','--cachettl', help='Seconds a cached object is trusted before it is revalidated with a conditional request (default 0).', required=False)
+    parser.add_argument('-tr','--trace', help='Path to a JSON-lines file to append per-transfer timing records to.', required=False)
+    parser.add_argument('-pr','--progress', help='Show an aggregated progress line instead of per-file output.', action='store_true', required=False)
+    parser.add_argument('-cv','--convert', help='With -i or -u, upload each TIFF slice in these comma-separated formats, converted on the fly (orig,npy,png).', required=False)
+    parser.add_argument('-cp','--convertprocs', help='Number of processes converting slices with -cv (default: one per CPU).', required=False)
+    parser.add_argument('-zs','--zstack', help='With -i or -u, pack each tile\'s z-slices into one volume object; with -o or -d, unpack volume objects into per-slice files.', action='store_true', required=False)
+    parser.add_argument('-zr','--zrange', help='With -zs and -o or -d, only unpack slices in this z range, e.g. 10-19 or 7.', required=False)
+    parser.add_argument('-ar','--archive', help='With -i or -u, upload everything as one .tar.gz object with this key, compressed in parallel while it uploads.', required=False)
+    parser.add_argument('-cc','--codec', help='With -ar, the archive codec: none, gzip-<1-9>, zstd-<level>, lz4, or auto to measure them on the files and pick the fastest (default: gzip-6).', required=False)
+    parser.add_argument('-x','--extract', help='With -o or -d, unpack .tar, .tar.gz, .tgz, .tar.zst and .tar.lz4 objects into the output directory while they download. 7z and rar objects are downloaded whole, with a warning.', action='store_true', required=False)
+    parser.add_argument('-as','--async', dest='asyncio', help='With -u or -d, run the transfers as coroutines on one asyncio event loop; -t is then the number of requests in flight (default: ' + str(async_engine.default_requests) + ').', action='store_true', required=False)
+    parser.add_argument('-rs','--resume', help='With -u or -d, keep a checkpoint journal of the run, and skip the files an earlier -rs run of the same .test file finished and continue its partial large transfers from their last completed part. The journal is removed once a run has no failures.', action='store_true', required=False)
+    parser.add_argument('-vf','--verify', help='Compute the MD5 of every transfer as it streams and compare it with the object\'s ETag; mismatches fail the transfer.', action='store_true', required=False)
+    parser.add_argument('-dd','--dedup', help='With -i or -u, skip or server-side copy files whose contents the bucket already holds, using a local index of content hashes.', action='store_true', required=False)
+    parser.add_argument('-dm','--dedupmanifest', help='With -dd, also share the index through this manifest object in the bucket.', required=False)
+    parser.add_argument('-di','--dedupindex', help='With -dd, the directory to keep the local index in (default: the directory of the .test file with -u, or the one containing the input directory with -i).', required=False)
+    parser.add_argument('-sb','--shardbundle', help='With -i or -u, pack the files into shard objects under this key prefix plus an index of every member; with -o or -d, unpack that bundle into the output directory (with -d, only the members listed).', required=False)
+    parser.add_argument('-ss','--shardsize', help='With -sb, the target size in MB of each shard (default: ' + str(shard_bundle.default_shard_size // 1048576) + ').', required=False)
+    parser.add_argument('-b','--bucket', help='Bucket path, either s3://bucket-name/ or file://local/dir/ for the offline local backend.', required=False)
     args = parser.parse_args()
 
-    #Update max_threads if input is relevant
-    if args.threads != None:
-        if int(args.threads) != max_threads and args.threads > 0 and args.threads < (highest_threads + 1):
-            max_threads = int(args.threads)
+    #Update max_threads if input is relevant, with -as it is the number of requests in flight
+    if args.asyncio:
+        max_threads = async_engine.default_requests
+        highest_threads = highest_requests
+    auto_threads = args.threads != None and args.threads.lower() == "auto"
+    if auto_threads:
+        if args.asyncio or args.archive != None or args.syncdownload != None or args.syncupload != None or args.purgetest != None or args.purgeall != None:
+            print(bcolors.FAIL + "Error: -t auto works with -i, -o, -u or -d, and cannot be combined with -as or -ar." + bcolors.ENDC)
+            return None
+        max_threads = concurrency_control.default_start_workers
+    elif args.threads != None:
+        try:
+            num_threads = int(args.threads)
+        except ValueError:
+            print(bcolors.FAIL + "Error: Number of threads must be an integer, got " + args.threads + bcolors.ENDC)
+            return None
+        if num_threads > 0 and num_threads < (highest_threads + 1):
+            max_threads = num_threads
+        else:
+            print(bcolors.WARNING + "Number of threads must be between 1 and " + str(highest_threads) + ", using " + str(max_threads) + bcolors.ENDC)
 
     #Update log_file if input is relevant, and enable logging if there is write access to the log_file
     if args.log != None:
@@ -73,6 +172,164 @@ def main():
         else:
             logging = True
 
+    #Update part_size, max_parts and threshold if input is relevant
+    try:
+        if args.partsize != None and float(args.partsize) > 0:
+            part_size = float(args.partsize)
+        if args.maxparts != None and int(args.maxparts) > 0:
+            max_parts = int(args.maxparts)
+        if args.threshold != None and float(args.threshold) >= 0:
+            threshold = float(args.threshold)
+    except ValueError:
+        print(bcolors.FAIL + "Error: Part size, max parts and threshold must be numbers." + bcolors.ENDC)
+        return None
+
+    #Update bucket_path if input is relevant
+    if args.bucket != None:
+        bucket_path = args.bucket
+        if not bucket_path.endswith("/"):
+            bucket_path = bucket_path + "/"
+
+    #Initialize the in-process transfer engine, shared by every transfer in this run
+    try:
+        engine = transferEngine(bucket_path, concurrency_control.default_max_workers if auto_threads else max_threads, int(part_size * 1024 * 1024), max_parts, int(threshold * 1024 * 1024))
+    except (ImportError, ValueError) as e:
+        print(bcolors.FAIL + "Error: " + str(e) + bcolors.ENDC)
+        return None
+    run['engine'] = engine
+
+    engine.verify = args.verify
+
+    #Attach the object cache to the engine if input is relevant
+    cache = None
+    if args.cache != None:
+        try:
+            cache_size = default_cache_size
+            cache_ttl = 0
+            if args.cachesize != None:
+                cache_size = float(args.cachesize)
+            if args.cachettl != None:
+                cache_ttl = float(args.cachettl)
+        except ValueError:
+            print(bcolors.FAIL + "Error: Cache size and cache TTL must be numbers." + bcolors.ENDC)
+            return None
+        cache = objectCache(args.cache, int(cache_size * 1024 * 1024), cache_ttl)
+        run['cache'] = cache
+        engine.cache = cache
+
+    #Deduplicate uploads against the contents the bucket already holds if input is relevant
+    dedup = None
+    if args.dedup or args.dedupmanifest != None or args.dedupindex != None:
+        if (args.indir == None and args.upload == None) or args.archive != None or args.asyncio:
+            print(bcolors.FAIL + "Error: -dd works with -i or -u, and cannot be combined with -ar or -as." + bcolors.ENDC)
+            return None
+        index_dir = args.dedupindex
+        if index_dir == None and args.upload != None:
+            index_dir = os.path.dirname(os.path.abspath(args.upload))
+        elif index_dir == None:
+            index_dir = os.path.dirname(os.path.abspath(os.path.normpath(args.indir)))
+        if not os.path.isdir(index_dir):
+            print(bcolors.FAIL + "Error: Dedup index directory " + index_dir + " does not exist." + bcolors.ENDC)
+            return None
+        dedup = dedup_index.dedupIndex(dedup_index.index_path(index_dir, bucket_path), args.dedupmanifest)
+        run['dedup'] = dedup
+        if args.dedupmanifest != None:
+            try:
+                merged = dedup.load_manifest(engine)
+            except Exception as e:
+                #A missing manifest just merges nothing, so this is a bad manifest or a failed request
+                print(bcolors.FAIL + "Error: " + str(e) + bcolors.ENDC)
+                return None
+            print(bcolors.WARNING + "Dedup Manifest: " + bcolors.ENDC + args.dedupmanifest + " (" + str(merged) + " keys)")
+        engine.dedup = dedup
+
+    #Start the slice conversion processes if input is relevant
+    converter = None
+    convert_formats = None
+    if args.convert != None:
+        try:
+            convert_formats = slice_convert.parse_formats(args.convert)
+            convert_procs = None
+            if args.convertprocs != None:
+                convert_procs = int(args.convertprocs)
+                if convert_procs < 1:
+                    raise ValueError("Number of conversion processes must be at least 1")
+            if convert_formats != ['orig']:
+                converter = slice_convert.sliceConverter(convert_formats, convert_procs)
+                run['converter'] = converter
+        except (ImportError, ValueError) as e:
+            print(bcolors.FAIL + "Error: " + str(e) + bcolors.ENDC)
+            return None
+
+    #Parse the z range of volume downloads if input is relevant
+    z_range = None
+    if args.zstack:
+        if converter != None:
+            print(bcolors.FAIL + "Error: -zs cannot be combined with -cv." + bcolors.ENDC)
+            return None
+        z_range = [None, None]
+        if args.zrange != None:
+            try:
+                bounds = args.zrange.split("-")
+                z_range = [int(bounds[0]), int(bounds[-1])]
+            except ValueError:
+                print(bcolors.FAIL + "Error: Z range must be a number or two numbers separated by -, got " + args.zrange + bcolors.ENDC)
+                return None
+
+    #Validate the archive codec if input is relevant
+    codec = archive_stream.default_codec
+    if args.codec != None:
+        codec = args.codec
+        if codec != "auto":
+            try:
+                archive_stream.parse_codec(codec)
+            except (ImportError, ValueError) as e:
+                print(bcolors.FAIL + "Error: " + str(e) + bcolors.ENDC)
+                return None
+
+    #The asyncio engine only does plain transfers of .test files
+    if args.asyncio:
+        if (args.upload == None and args.download == None) or cache != None or converter != None or args.zstack or args.archive != None or args.extract or args.resume or args.verify:
+            print(bcolors.FAIL + "Error: -as works with -u or -d, and cannot be combined with -c, -cv, -zs, -ar, -x, -rs or -vf." + bcolors.ENDC)
+            return None
+    if args.resume and (args.upload == None and args.download == None or args.archive != None):
+        print(bcolors.FAIL + "Error: -rs works with -u or -d, and cannot be combined with -ar." + bcolors.ENDC)
+        return None
+
+    #Pack files into, or unpack them from, a shard bundle if input is relevant
+    shard_size = shard_bundle.default_shard_size
+    if args.shardbundle != None:
+        if (args.indir == None and args.outdir == None and args.upload == None) or auto_threads or converter != None or args.zstack or args.archive != None or args.extract or args.asyncio or args.resume or dedup != None:
+            print(bcolors.FAIL + "Error: -sb works with -i, -o, -u or -d, and cannot be combined with -t auto, -cv, -zs, -ar, -x, -as, -rs or -dd." + bcolors.ENDC)
+            return None
+        if args.shardsize != None:
+            try:
+                shard_size = int(float(args.shardsize) * 1024 * 1024)
+                if shard_size <= 0:
+                    raise ValueError("Shard size must be positive")
+            except ValueError:
+                print(bcolors.FAIL + "Error: Shard size must be a positive number, got " + args.shardsize + bcolors.ENDC)
+                return None
+
+    #Record structured timing for every transfer, and optionally show aggregated progress
+    try:
+        engine.trace = transferTrace(args.trace)
+    except OSError as e:
+        print(bcolors.FAIL + "Error: Cannot open trace file " + args.trace + ": " + str(e) + bcolors.ENDC)
+        return None
+    progress = None
+    if args.progress:
+        progress = progressView(engine.trace)
+        run['progress'] = progress
+
+    #Tune the number of active threads from the measured goodput if input is relevant
+    controller = None
+    threads_label = str(max_threads)
+    if auto_threads:
+        controller = concurrency_control.aimdController(engine.trace, max_threads, concurrency_control.default_max_workers)
+        run['controller'] = controller
+        threads_label = 'auto (' + str(max_threads) + ' to ' + str(controller.max_workers) + ')'
+
     #Initialize blank set of logging messages
     log_messages = []
 
@@ -94,8 +351,18 @@ def main():
             print(bcolors.WARNING + "Input Directory: " + bcolors.ENDC + args.indir)
             log_messages.append('Input Directory: ' + args.indir)
             log_messages.append('Bucket Path: ' + bucket_path)
-            log_messages.append('Max Threads: ' + str(max_threads))
-            count_files = upload(dir_path, bucket_path, max_threads)
+            log_messages.append('Max Threads: ' + threads_label)
+            log_messages.append('Part Size (MB): ' + str(part_size) + ', Max Parts: ' + str(max_parts) + ', Multipart Threshold (MB): ' + str(threshold))
+            if convert_formats != None:
+                log_messages.append('Slice Formats: ' + ",".join(convert_formats))
+            if args.archive != None:
+                log_messages.append('Archive Key: ' + args.archive)
+                count_files = upload_archive(archive_files(dir_path), args.archive, engine, codec, log_messages)
+            elif args.shardbundle != None:
+                log_messages.append('Bundle Key: ' + args.shardbundle)
+                count_files = upload_bundle(archive_files(dir_path), args.shardbundle, engine, max_threads, shard_size, log_messages)
+            else:
+                count_files = upload(dir_path, engine, max_threads, converter, args.zstack, controller)
             log_messages.append('Number of Files Processed: ' + str(count_files))
     elif args.outdir != None and args.indir == None and args.download == None and args.upload == None:
         print(bcolors.WARNING + "Mode: " + bcolors.ENDC + "Download")
@@ -107,8 +374,13 @@ def main():
             print(bcolors.WARNING + "Output Directory: " + bcolors.ENDC + dir_path)
             log_messages.append('Output Directory: ' + dir_path)
             log_messages.append('Bucket Path: ' + bucket_path)
-            log_messages.append('Max Threads: ' + str(max_threads))
-            count_files = download(dir_path, bucket_path, max_threads)
+            log_messages.append('Max Threads: ' + threads_label)
+            log_messages.append('Part Size (MB): ' + str(part_size) + ', Max Parts: ' + str(max_parts) + ', Multipart Threshold (MB): ' + str(threshold))
+            if args.shardbundle != None:
+                log_messages.append('Bundle Key: ' + args.shardbundle)
+                count_files = download_bundle(args.shardbundle, dir_path, engine, max_threads)
+            else:
+                count_files = download(dir_path, engine, max_threads, z_range, args.extract, controller)
             log_messages.append('Number of Files Processed: ' + str(count_files))
         else:
             try:
@@ -116,11 +388,16 @@ def main():
             except:
                 print(bcolors.FAIL + "Error: Invalid File Permissions While Trying to Create Directory " + args.outdir + bcolors.ENDC)
                 return None
-            print(bcolors.WARNING + "Output Directory: " + bcolors.ENDC + dir_path)
-            log_messages.append('Output Directory: ' + dir_path)
+            print(bcolors.WARNING + "Output Directory: " + bcolors.ENDC + args.outdir)
+            log_messages.append('Output Directory: ' + args.outdir)
             log_messages.append('Bucket Path: ' + bucket_path)
-            log_messages.append('Max Threads: ' + str(max_threads))
-            count_files = download(args.outdir, bucket_path, max_threads)
+            log_messages.append('Max Threads: ' + threads_label)
+            log_messages.append('Part Size (MB): ' + str(part_size) + ', Max Parts: ' + str(max_parts) + ', Multipart Threshold (MB): ' + str(threshold))
+            if args.shardbundle != None:
+                log_messages.append('Bundle Key: ' + args.shardbundle)
+                count_files = download_bundle(args.shardbundle, args.outdir, engine, max_threads)
+            else:
+                count_files = download(args.outdir, engine, max_threads, z_range, args.extract, controller)
             log_messages.append('Number of Files Processed: ' + str(count_files))
     #Verify input if -u or -d, since neither are required
     elif args.download != None and args.upload == None and args.indir == None and args.outdir != None:
@@ -135,8 +412,17 @@ def main():
                 print(bcolors.WARNING + "Input .test File: " + bcolors.ENDC + args.download)
                 log_messages.append('Input .test File: ' + args.download)
                 log_messages.append('Bucket Path: ' + bucket_path)
-                log_messages.append('Max Threads: ' + str(max_threads))
-                count_files = download_test(args.download, args.outdir, bucket_path, max_threads)
+                log_messages.append('Max Threads: ' + threads_label)
+                log_messages.append('Part Size (MB): ' + str(part_size) + ', Max Parts: ' + str(max_parts) + ', Multipart Threshold (MB): ' + str(threshold))
+                if args.shardbundle != None:
+                    log_messages.append('Bundle Key: ' + args.shardbundle)
+                    count_files = download_bundle(args.shardbundle, args.outdir, engine, max_threads, args.download)
+                elif args.asyncio:
+                    log_messages.append('Transfer Engine: asyncio')
+                    count_files = async_test('download', args.download, args.outdir, bucket_path, max_threads, part_size, max_parts, threshold, engine.trace)
+                else:
+                    engine.journal = open_journal(args.outdir, 'download', bucket_path, args.download, args.resume, log_messages)
+                    count_files = download_test(args.download, args.outdir, engine, max_threads, z_range, args.extract, controller)
                 log_messages.append('Number of Files Processed: ' + str(count_files))
             else:
                 print(bcolors.FAIL + "Input .test File: " + args.download + " is not valid.")
@@ -151,8 +437,17 @@ def main():
                 print(bcolors.WARNING + "Input .test File: " + bcolors.ENDC + args.download)
                 log_messages.append('Input .test File: ' + args.download)
                 log_messages.append('Bucket Path: ' + bucket_path)
-                log_messages.append('Max Threads: ' + str(max_threads))
-                count_files = download_test(args.download, args.outdir, bucket_path, max_threads)
+                log_messages.append('Max Threads: ' + threads_label)
+                log_messages.append('Part Size (MB): ' + str(part_size) + ', Max Parts: ' + str(max_parts) + ', Multipart Threshold (MB): ' + str(threshold))
+                if args.shardbundle != None:
+                    log_messages.append('Bundle Key: ' + args.shardbundle)
+                    count_files = download_bundle(args.shardbundle, args.outdir, engine, max_threads, args.download)
+                elif args.asyncio:
+                    log_messages.append('Transfer Engine: asyncio')
+                    count_files = async_test('download', args.download, args.outdir, bucket_path, max_threads, part_size, max_parts, threshold, engine.trace)
+                else:
+                    engine.journal = open_journal(args.outdir, 'download', bucket_path, args.download, args.resume, log_messages)
+                    count_files = download_test(args.download, args.outdir, engine, max_threads, z_range, args.extract, controller)
                 log_messages.append('Number of Files Processed: ' + str(count_files))
             else:
                 print(bcolors.FAIL + "Input .test File: " + args.download + " is not valid.")
@@ -168,8 +463,23 @@ def main():
             print(bcolors.WARNING + "Input .test File: " + bcolors.ENDC + args.upload)
             log_messages.append('Input .test File: ' + args.upload)
             log_messages.append('Bucket Path: ' + bucket_path)
-            log_messages.append('Max Threads: ' + str(max_threads))
-            count_files = upload_test(args.upload, bucket_path, max_threads)
+            log_messages.append('Max Threads: ' + threads_label)
+            log_messages.append('Part Size (MB): ' + str(part_size) + ', Max Parts: ' + str(max_parts) + ', Multipart Threshold (MB): ' + str(threshold))
+            if convert_formats != None:
+                log_messages.append('Slice Formats: ' + ",".join(convert_formats))
+            if args.archive != None:
+                log_messages.append('Archive Key: ' + args.archive)
+                count_files = upload_archive(archive_test_files(args.upload), args.archive, engine, codec, log_messages)
+            elif args.shardbundle != None:
+                log_messages.append('Bundle Key: ' + args.shardbundle)
+                count_files = upload_bundle(archive_test_files(args.upload), args.shardbundle, engine, max_threads, shard_size, log_messages)
+            else:
+                if args.asyncio:
+                    log_messages.append('Transfer Engine: asyncio')
+                    count_files = async_test('upload', args.upload, None, bucket_path, max_threads, part_size, max_parts, threshold, engine.trace)
+                else:
+                    engine.journal = open_journal(os.path.dirname(os.path.abspath(args.upload)), 'upload', bucket_path, args.upload, args.resume, log_messages)
+                    count_files = upload_test(args.upload, engine, max_threads, converter, args.zstack, controller)
             log_messages.append('Number of Files Processed: ' + str(count_files))
         else:
             print(bcolors.FAIL + "Input .test File: " + args.upload + " is not valid.")
@@ -190,10 +500,13 @@ def main():
         print(bcolors.WARNING + "Output Directory: " + bcolors.ENDC + args.syncdownload)
         log_messages.append('Output Directory: ' + args.syncdownload)
         log_messages.append('Bucket Path: ' + bucket_path)
-        sync_download(args.syncdownload, bucket_path)
-        num_files = num_of_files(args.syncdownload)
-        print(bcolors.WARNING + 'Number of Files Processed: ' + str(num_files) + bcolors.ENDC)
-        log_messages.append('Number of Files Processed: ' + str(num_files))
+        log_messages.append('Max Threads: ' + threads_label)
+        counts = sync_download(args.syncdownload, engine, max_threads, args.delete)
+        for line in ['Number of Files Transferred: ' + str(counts['transferred']), 'Number of Files Skipped: ' + str(counts['skipped']),
+                     'Number of Files Deleted: ' + str(counts['deleted']), 'Number of Files Failed: ' + str(counts['failed']),
+                     'Bytes Transferred: ' + str(counts['bytes'])]:
+            print(bcolors.WARNING + line + bcolors.ENDC)
+            log_messages.append(line)
     #Sync Upload
     elif args.download == None and args.upload == None and args.indir == None and args.outdir == None and args.syncdownload == None and args.syncupload != None:
         print(bcolors.WARNING + "Mode: " + bcolors.ENDC + "Sync Upload")
@@ -210,10 +523,13 @@ def main():
         print(bcolors.WARNING + "Input Directory: " + bcolors.ENDC + args.syncupload)
         log_messages.append('Input Directory: ' + args.syncupload)
         log_messages.append('Bucket Path: ' + bucket_path)
-        sync_upload(args.syncupload, bucket_path)
-        num_files = num_of_files(args.syncupload)
-        print(bcolors.WARNING + 'Number of Files Processed: ' + str(num_files) + bcolors.ENDC)
-        log_messages.append('Number of Files Processed: ' + str(num_files))
+        log_messages.append('Max Threads: ' + threads_label)
+        counts = sync_upload(args.syncupload, engine, max_threads, args.delete)
+        for line in ['Number of Files Transferred: ' + str(counts['transferred']), 'Number of Files Skipped: ' + str(counts['skipped']),
+                     'Number of Files Deleted: ' + str(counts['deleted']), 'Number of Files Failed: ' + str(counts['failed']),
+                     'Bytes Transferred: ' + str(counts['bytes'])]:
+            print(bcolors.WARNING + line + bcolors.ENDC)
+            log_messages.append(line)
     #Purge .test File
     elif args.purgetest != None:
         print(bcolors.WARNING + "Mode: " + bcolors.ENDC + "Purge .test Contents From S3 Bucket")
@@ -223,23 +539,25 @@ def main():
             print(bcolors.WARNING + "Input .test File: " + bcolors.ENDC + args.purgetest)
             log_messages.append('Input .test File: ' + args.purgetest)
             log_messages.append('Bucket Path: ' + bucket_path)
-            count_files = purge_test(args.purgetest, bucket_path)
-            log_messages.append('Number of Files Processed: ' + str(count_files))
+            log_messages.append('Max Threads: ' + threads_label)
+            result = purge_test(args.purgetest, engine, max_threads)
+            log_messages.append('Number of Files Deleted: ' + str(result['deleted']))
+            log_messages.append('Number of Files Failed: ' + str(len(result['failed'])))
         else:
-            print(bcolors.FAIL + "Input .test File: " + args.upload + " is not valid.")
+            print(bcolors.FAIL + "Input .test File: " + args.purgetest + " is not valid." + bcolors.ENDC)
             return None
-            #For a directory:
-            #num_files = num_of_files(args.syncupload)
-            #print(bcolors.WARNING + 'Number of Files Processed: ' + str(num_files) + bcolors.ENDC)
-            #log_messages.append('Number of Files Processed: ' + str(num_files))
     #Purge All Files on S3 Bucket
     elif args.purgeall != None:
         if args.purgeall == bucket_path:
             print(bcolors.WARNING + "Mode: " + bcolors.ENDC + "Purge All Contents From S3 Bucket")
             log_messages.append('Test Mode: Purge All Contents From S3 Bucket')
             log_messages.append('Bucket Path: ' + bucket_path)
-            purge_all(bucket_path)
-            log_messages.append('Purge Successful.')
+            log_messages.append('Max Threads: ' + threads_label)
+            result = purge_all(engine, max_threads)
+            log_messages.append('Number of Files Deleted: ' + str(result['deleted']))
+            log_messages.append('Number of Files Failed: ' + str(len(result['failed'])))
+            if len(result['failed']) == 0:
+                log_messages.append('Purge Successful.')
         else:
             print(bcolors.FAIL + "ERROR: You must specify the S3 bucket path to purge all files. The path is: " + bucket_path + bcolors.ENDC)
             return None
@@ -248,6 +566,42 @@ def main():
         print(bcolors.FAIL + "Error: You specified too many arguments. Read the README.md file for instructions of how to operate the program." + bcolors.ENDC)
         return None
     
+    if dedup != None:
+        log_messages.append('Dedup Index: ' + dedup.path)
+        if args.dedupmanifest != None:
+            dedup.save_manifest(engine)
+            log_messages.append('Dedup Manifest: ' + args.dedupmanifest)
+        for line in dedup.report():
+            print(bcolors.WARNING + line + bcolors.ENDC)
+            log_messages.append(line)
+    if engine.journal != None:
+        if engine.journal.skipped > 0:
+            print(bcolors.WARNING + "Skipped " + str(engine.journal.skipped) + " files finished by an earlier run." + bcolors.ENDC)
+            log_messages.append('Files Skipped: ' + str(engine.journal.skipped))
+        if engine.trace.failed == 0:
+            #Nothing is left to resume, so the journal's files aren't left behind
+            engine.journal.remove()
+        else:
+            print(bcolors.WARNING + "Rerun with -rs to resume the failed transfers." + bcolors.ENDC)
+    if controller != None:
+        for line in controller.stop():
+            print(bcolors.WARNING + line + bcolors.ENDC)
+            log_messages.append(line)
+        log_messages.append('Final Threads: ' + str(controller.workers))
+    if progress != None:
+        progress.stop()
+    if engine.trace.submitted > 0:
+        for line in engine.trace.report():
+            print(bcolors.WARNING + line + bcolors.ENDC)
+            log_messages.append(line)
+    if args.trace != None:
+        log_messages.append('Trace File: ' + args.trace)
+    if cache != None:
+        log_messages.append('Cache Directory: ' + args.cache)
+        for line in cache.report():
+            print(bcolors.WARNING + line + bcolors.ENDC)
+            log_messages.append(line)
+
     #Calculate Time Elapsed
     time_elapsed = datetime.now() - start_time 
     
@@ -315,36 +669,6 @@ def check_file(file_path, mode='r'):
     except OSError:
         return False
 
-def traverse_directory(indir, is_subdir=True, is_files=True, level=1, file_list=[]):
-    """
-    This function traverses a directory, indir, and has the following options that allow recursion:
-    is_subdir: type bool, True to process sub-directories, False to ignore
-    is_files:  type bool, True to process files, False to ignore
-    level:     type int, the level of directory that it is currently on, because of recursion.
-    file_list: type list of [<full_path>, <file_name>]
-    Returns:   file_list
-    """
-    for dirName, subdirList, fileList in os.walk(indir):
-        if is_files == True:
-            for fname in fileList:
-                file_list.append([dirName + "/" + fname, fname])
-        for nextdir in subdirList:
-            traverse_directory(nextdir, False, True, level=(level + 1), file_list=file_list)
-    return file_list
-
-def num_of_files(directory, num_files=0):
-    """
-    This function counts the number of files in a directory path.
-    directory:  type str, relative or absolute path to a directory path.
-    Returns: type int, number of files in directory
-    """
-    for dirName, subdirList, fileList in os.walk(directory):
-        for fname in fileList:
-            num_files+=1
-        for nextdir in subdirList:
-            num_of_files(nextdir, num_files)
-    return num_files
-
 def make_dirs(dir_path):
     """
     This function creates directories, as many levels deep as necessary, based on dir_path.
@@ -376,7 +700,7 @@ def make_dirs(dir_path):
                     num_created+=1
             else:
                 if short_path != ".":
-                    current_path = "." + short_path
+                    current_path = short_path
                     try:
                         if not os.path.isdir(current_path):
                             os.mkdir(current_path)
@@ -407,283 +731,774 @@ def make_dirs(dir_path):
         print(bcolors.WARNING + "Created " + str(num_created) + " levels of directories." + bcolors.ENDC)
     return None
 
-def upload(indir, bucket_path, max_threads):
+def report_errors(errors, count_files):
     """
-    This function uploads all subdirectories with files in indir to the S3 bucket.
+    This function prints the transfers that failed in a workerPool, as returned by workerPool.shutdown().
+    errors:      type list, of [<job args>, <exception>, <traceback str>]
+    count_files: type int, the number of transfers that were submitted
+    Returns:     type int, the number of failed transfers
+    """
+    for args, error, trace in errors:
+        print(bcolors.FAIL + "Transfer Failed: " + str(args[1]) + ": " + repr(error) + bcolors.ENDC)
+    if len(errors) > 0:
+        print(bcolors.FAIL + str(len(errors)) + " of " + str(count_files) + " transfers failed." + bcolors.ENDC)
+    return len(errors)
+
+def open_pool(max_threads, controller=None):
+    """
+    This function starts the workerPool of an upload or download.
+    max_threads: type int, the number of worker threads
+    controller:  type aimdController, or None. If given, the pool gets controller.max_workers threads instead, and the
+                 controller starts tuning how many of them are active.
+    Returns:     type workerPool
+    """
+    if controller == None:
+        return workerPool(max_threads)
+    pool = workerPool(controller.max_workers)
+    controller.start(pool)
+    return pool
+
+def upload(indir, engine, max_threads, converter=None, zstack=False, controller=None):
+    """
+    This function uploads all subdirectories with files in indir to the S3 bucket. Files are queued for upload as
+    the directory scan finds them (see dir_scan.py), so transfers start before the whole tree has been scanned.
     indir: string of relative or absolute path to input directory.
-    bucket_path: string of S3 bucket in format "s3://bucket-name/"
+    engine: transferEngine object for the S3 bucket
     max_threads: The maximum number of threads that should be used to download the files from the S3 bucket.
-    Returns: None
+    converter: sliceConverter object to upload TIFF slices in other formats with, or None to upload files as they are
+    zstack: True to upload the z-slices of each tile as one volume object
+    controller: aimdController object tuning the number of active threads, or None to use max_threads
+    Returns: type int, the number of files processed
     """
     count_files = 0
-    threads = []
-    for full_path, filename in traverse_directory(indir):
-        count_files += 1
-        threadID = (count_files - 1) % max_threads
-        name = "Thread-" + str(threadID)
-        this_thread = uploadThread(threadID, name, full_path, filename, bucket_path, count_files)
-        wait_timer = 0
-        while threading.activeCount() > max_threads:
-            wait_timer+=1
-        this_thread.start()
-        threads.append(this_thread)
+    def skip_directory(error):
+        print(bcolors.WARNING + "Skipped Directory: " + str(error.filename) + ": " + repr(error) + bcolors.ENDC)
+    with open_pool(max_threads, controller) as pool:
+        if zstack:
+            files = [[full_path, filename] for full_path, filename, stat in dir_scan.scan_files(indir, onerror=skip_directory)]
+            count_files = len(files)
+            submit_volumes(pool, files, engine)
+        else:
+            for full_path, filename, stat in dir_scan.scan_files(indir, onerror=skip_directory):
+                count_files += 1
+                submit_upload(pool, full_path, filename, engine, count_files, converter, stat)
+            drain_converter(pool, engine, count_files, converter)
+    report_errors(pool.errors + converter_errors(converter), count_files)
     print(bcolors.BOLD + "Processed " + str(count_files) + " files." + bcolors.ENDC)
-    bashCommand = "aws s3 ls " + bucket_path
-    print(bcolors.WARNING + "Processing AWS S3 Directory Listing: " + bashCommand + bcolors.ENDC)
-    os.system(bashCommand)
-    for t in threads:
-        t.join()
+    print(bcolors.WARNING + "Processing S3 Directory Listing: " + engine.bucket_path + bcolors.ENDC)
+    for item in engine.list_objects():
+        print(str(item['size']).rjust(12) + " " + item['key'])
     print("Exiting Main Thread...")
     return count_files
 
-def upload_test(filename, bucket_path, max_threads):
+def upload_test(filename, engine, max_threads, converter=None, zstack=False, controller=None):
     """
-    This function uploads all files, each specified in filename to the S3 bucket_path.
+    This function uploads all files, each specified in filename to the S3 bucket of engine.
     filename:    type str, the filename or file path to the upload#.test file that contains one file path or file name per line.
-    bucket_path: type string of S3 bucket in format "s3://bucket-name/"
+    engine:      type transferEngine, the in-process transfer engine for the S3 bucket
     max_threads: type int, the maximum number of threads that should be used to upload the files to the S3 bucket.
-    Returns:     None
+    converter:   type sliceConverter, converts TIFF slices to the other formats to upload, or None to upload files as they are
+    zstack:      type bool, True to upload the z-slices of each tile as one volume object
+    controller:  type aimdController, tunes the number of active threads, or None to use max_threads
+    Returns:     type int, the number of files listed in filename
     """
     fin = open(filename, 'r')
     count_files = 0
-    threads = []
-    for full_path in fin.readlines():
-        count_files+=1
-        full_path = full_path.rstrip()
-        filename = basename(full_path)
-        threadID = (count_files - 1) % max_threads
-        name = "Thread-" + str(threadID)
-        this_thread = uploadThread(threadID, name, full_path, filename, bucket_path, count_files)
-        wait_timer = 0
-        while threading.activeCount() > max_threads:
-            wait_timer+=1
-        this_thread.start()
-        threads.append(this_thread)
+    files = []
+    with open_pool(max_threads, controller) as pool:
+        for full_path in fin:
+            full_path = full_path.rstrip()
+            if full_path == "":
+                continue
+            count_files+=1
+            filename = basename(full_path)
+            if zstack:
+                files.append([full_path, filename])
+            elif converter == None and engine.journal != None and engine.journal.finished('upload', filename, full_path):
+                continue
+            else:
+                submit_upload(pool, full_path, filename, engine, count_files, converter)
+        drain_converter(pool, engine, count_files, converter)
+        submit_volumes(pool, files, engine)
     fin.close()
-    for t in threads:
-        t.join()
+    report_errors(pool.errors + converter_errors(converter), count_files)
     print("Exiting Main Thread...")
     return count_files
 
-class uploadThread(threading.Thread):
-    """
-    This class defines the uploadThread blueprint, of type threading.Thread, which calls do_upload
-    to upload one file per thread.
-    To Call: uploadThread(threadID, name, full_path, filename, bucket_path, count_files)
-    Whereas: threadId:    type int, is the ID of the thread assigned by the calling function
-             name:        type str, is the name of the thread assigned by the calling function
-             full_path:   type str, is the absolute or relative path to upload the file from
-             filename:    type str, is a valid filename, short for full_path
-             bucket_path: type str, is a valid S3 bucket path in the format "s3://bucket-name/"
-             count_files: type int, is the number of files that have been counted so far in the process
-    """
-    def __init__(self, threadID, name, full_path, filename, bucket_path, count_files):
-       threading.Thread.__init__(self)
-       self.threadID = threadID
-       self.name = name
-       self.full_path = full_path
-       self.filename = filename
-       self.bucket_path = bucket_path
-       self.count_files = count_files
-    def run(self):
-       print("Starting New Thread")
-       do_upload(self.name, self.full_path, self.filename, self.bucket_path, self.count_files)
-       print("Exiting " + self.name)
-
-
-def do_upload(threadName, full_path, filename, bucket_path, count_files):
-    """
-    This function is called by uploadThread to upload one filename from full_path to bucket_path.
-    threadName:  type str, the name of the thread assigned by the calling function
+def archive_files(indir):
+    """
+    This function lists the files of indir for an archive, named by their path inside the directory indir itself,
+    e.g. "x02-y02-FTC/pre_exp_scan_r1-FTC-x02-y02-z00.tiff".
+    Returns: type list, of [<full_path>, <name in the archive>]
+    """
+    top = basename(os.path.normpath(indir))
+    files = []
+    for dirName, subdirList, fileList in os.walk(indir):
+        subdirList.sort()
+        for fname in sorted(fileList):
+            full_path = os.path.join(dirName, fname)
+            files.append([full_path, os.path.join(top, os.path.relpath(full_path, indir)).replace(os.sep, "/")])
+    return files
+
+def archive_test_files(filename):
+    """
+    This function lists the files of an upload#.test file for an archive, named by the path given in the file
+    without any leading "./" or "/".
+    Returns: type list, of [<full_path>, <name in the archive>]
+    """
+    files = []
+    fin = open(filename, 'r')
+    for full_path in fin:
+        full_path = full_path.rstrip()
+        if full_path == "":
+            continue
+        files.append([full_path, os.path.normpath(full_path).replace(os.sep, "/").lstrip("/")])
+    fin.close()
+    return files
+
+def upload_archive(files, key, engine, codec=archive_stream.default_codec, log_messages=None):
+    """
+    This function uploads files as one tar archive object. The tar stream is built on the fly, compressed with
+    codec (gzip in blocks compressed in parallel on every core, see archive_stream.py), and fed straight into a
+    multipart upload, so no archive is ever written to disk. The extension of key is set to match the codec.
+    files:        type list, of [<full_path>, <name in the archive>]
+    key:          type str, the key of the archive object, e.g. "x02-y02-FTC-orig.tar.gz"
+    engine:       type transferEngine, the in-process transfer engine for the S3 bucket
+    codec:        type str, the codec, or "auto" to measure the codecs on a sample of files and use the fastest round trip
+    log_messages: type list, the log to add the codec comparison to, or None
+    Returns:      type int, the number of files archived, or 0 if the upload failed
+    """
+    if codec == "auto":
+        comparison = codec_select.compare_codecs(files, engine)
+        for line in codec_select.report(comparison):
+            print(bcolors.WARNING + line + bcolors.ENDC)
+            if log_messages != None:
+                log_messages.append(line)
+        codec = comparison['both']
+    if log_messages != None:
+        log_messages.append('Archive Codec: ' + codec)
+    key = archive_stream.archive_key(key, codec)
+    print(bcolors.OKBLUE + "Archiving " + str(len(files)) + " files to " + engine.bucket_path + key + " (" + codec + ")" + bcolors.ENDC)
+    queued_at = queued(engine)
+    started_at = time.perf_counter()
+    stats = {'ttfb': None, 'retries': 0}
+    try:
+        result = engine.upload_stream(archive_stream.tar_stream(files, codec), key, stats)
+    except Exception as e:
+        if engine.trace != None:
+            engine.trace.record('upload', key, "MainThread", queued_at, started_at, 0, stats, e)
+        print(bcolors.FAIL + "Transfer Failed: " + key + ": " + repr(e) + bcolors.ENDC)
+        return 0
+    if engine.trace != None:
+        engine.trace.record('upload', key, "MainThread", queued_at, started_at, result['size'], stats)
+    print(bcolors.WARNING + "Uploaded " + str(result['size']) + " bytes: " + key + bcolors.ENDC)
+    return len(files)
+
+def upload_bundle(files, bundle_key, engine, max_threads, shard_size=shard_bundle.default_shard_size, log_messages=None):
+    """
+    This function uploads files packed into shard objects of about shard_size bytes each, plus an index of where
+    every member lies (see shard_bundle.py), so many small files cost a few large requests instead of one each,
+    and can still be read back one at a time with ranged GETs. Each shard is streamed straight from the files
+    into a multipart upload, and max_threads shards upload at once. The index is only written once every shard
+    has been uploaded, so a bundle is never readable half-written.
+    files:        type list, of [<full_path>, <name in the bundle>]
+    bundle_key:   type str, the key prefix of the bundle, e.g. "x02-y02-FTC-bundle"
+    engine:       type transferEngine, the in-process transfer engine for the S3 bucket
+    max_threads:  type int, the number of shards uploaded at once
+    shard_size:   type int, the target size of each shard in bytes
+    log_messages: type list, the log to add the shard count to, or None
+    Returns:      type int, the number of files bundled, or 0 if the upload failed
+    """
+    shards = shard_bundle.plan_shards(files, shard_size)
+    print(bcolors.OKBLUE + "Bundling " + str(len(files)) + " files into " + str(len(shards)) + " shards at " + engine.bucket_path + bundle_key + bcolors.ENDC)
+    if log_messages != None:
+        log_messages.append('Bundle Shards: ' + str(len(shards)) + ', Shard Size (MB): ' + str(round(shard_size / 1048576.0, 2)))
+    results = [None] * len(shards)
+    count_files = 0
+    with workerPool(max_threads) as pool:
+        for shard, members in enumerate(shards):
+            count_files += len(members)
+            pool.submit(do_upload_shard, members, shard_bundle.shard_key(bundle_key, shard), engine, count_files, queued(engine), results, shard)
+    if report_errors(pool.errors, len(shards)) > 0:
+        print(bcolors.FAIL + "Bundle index not written: " + shard_bundle.index_key(bundle_key) + bcolors.ENDC)
+        return 0
+    key = shard_bundle.index_key(bundle_key)
+    queued_at = queued(engine)
+    started_at = time.perf_counter()
+    try:
+        num_bytes = engine.upload_data(shard_bundle.make_index(shards, results), key)
+    except Exception as e:
+        if engine.trace != None:
+            engine.trace.record('upload', key, "MainThread", queued_at, started_at, 0, None, e)
+        print(bcolors.FAIL + "Transfer Failed: " + key + ": " + repr(e) + bcolors.ENDC)
+        return 0
+    if engine.trace != None:
+        engine.trace.record('upload', key, "MainThread", queued_at, started_at, num_bytes)
+    print(bcolors.WARNING + "Uploaded " + str(len(shards)) + " shards and index: " + key + bcolors.ENDC)
+    return len(files)
+
+def do_upload_shard(threadName, members, key, engine, count_files, queued_at, results, shard):
+    """
+    This function is called by a workerPool worker to upload one shard of a bundle, streamed from its members' files.
+    threadName:  type str, the name of the worker thread running the transfer
+    members:     type list, of [<full_path>, <name>, <size>] packed in the shard, as planned by shard_bundle.plan_shards
+    key:         type str, the key of the shard object
+    engine:      type transferEngine, the shared in-process transfer engine
+    count_files: type int, the number of files that have been processed, including the members of this shard
+    queued_at:   type float, the perf_counter time the transfer was queued
+    results:     type list, where the {'key', 'size', 'etag'} of the upload is stored at index shard
+    shard:       type int, the number of the shard in the bundle
+    Returns:     None
+    """
+    started_at = time.perf_counter()
+    stats = {'ttfb': None, 'retries': 0}
+    try:
+        results[shard] = engine.upload_stream(shard_bundle.shard_chunks(members), key, stats)
+    except Exception as e:
+        if engine.trace != None:
+            engine.trace.record('upload', key, threadName, queued_at, started_at, 0, stats, e)
+        raise
+    if engine.trace != None:
+        engine.trace.record('upload', key, threadName, queued_at, started_at, results[shard]['size'], stats)
+
+def submit_upload(pool, full_path, filename, engine, count_files, converter=None, stat=None):
+    """
+    This function queues the upload of one file. TIFF slices are also queued for conversion if converter is given,
+    and the conversions that have finished meanwhile are queued for upload straight from memory.
+    pool:        type workerPool, the pool running the uploads
+    full_path:   type str, the relative or absolute path to the file to be uploaded
+    filename:    type str, the name of the file to be uploaded
+    engine:      type transferEngine, the shared in-process transfer engine
+    count_files: type int, the number of files that have been processed, including the current file
+    converter:   type sliceConverter, or None
+    stat:        type os.stat_result, of full_path if the directory scan already has it, or None
+    Returns:     None
+    """
+    if converter == None or not slice_convert.is_tiff(filename):
+        pool.submit(do_upload, full_path, filename, engine, count_files, queued(engine), stat)
+        return None
+    if converter.upload_original:
+        pool.submit(do_upload, full_path, filename, engine, count_files, queued(engine), stat)
+    for key, data in converter.submit(full_path, filename):
+        pool.submit(do_upload_data, data, key, engine, count_files, queued(engine))
+    return None
+
+def submit_volumes(pool, files, engine):
+    """
+    This function queues the upload of files with the z-slices of each tile packed into one volume object (see
+    zstack_volume.py), so a tile costs one request instead of one per slice. Other files are uploaded as they are.
+    pool:    type workerPool, the pool running the uploads
+    files:   type list, of [<full_path>, <filename>]
+    engine:  type transferEngine, the shared in-process transfer engine
+    Returns: None
+    """
+    volumes, others = zstack_volume.group_slices(files)
+    count_files = 0
+    for key in sorted(volumes):
+        count_files += len(volumes[key])
+        pool.submit(do_upload_volume, volumes[key], key, engine, count_files, queued(engine))
+    for full_path, filename in others:
+        count_files += 1
+        pool.submit(do_upload, full_path, filename, engine, count_files, queued(engine))
+    return None
+
+def drain_converter(pool, engine, count_files, converter=None):
+    """
+    This function queues the upload of every conversion still running in converter, as each one finishes.
+    Returns: None
+    """
+    if converter != None:
+        for key, data in converter.drain():
+            pool.submit(do_upload_data, data, key, engine, count_files, queued(engine))
+    return None
+
+def converter_errors(converter=None):
+    """
+    Returns: type list, the failed conversions of converter, cleared so they are only reported once
+    """
+    if converter == None:
+        return []
+    errors = converter.errors
+    converter.errors = []
+    return errors
+
+def queued(engine):
+    """
+    This function marks a transfer as queued in the trace of engine, if it has one.
+    engine:  type transferEngine, the shared in-process transfer engine
+    Returns: type float, the perf_counter time the transfer was queued
+    """
+    if engine.trace != None:
+        return engine.trace.queued()
+    return time.perf_counter()
+
+def do_upload(threadName, full_path, filename, engine, count_files, queued_at, stat=None):
+    """
+    This function is called by a workerPool worker to upload one filename from full_path to the S3 bucket of engine.
+    Its timing is recorded in engine.trace instead of being printed.
+    threadName:  type str, the name of the worker thread running the transfer
     full_path:   type str, the relative or absolute path to the file to be uploaded
     filename:    type str, the name of the file to be uploaded
-    bucket_path: type str, a valid S3 bucket path in the format "s3://bucket-name/"
+    engine:      type transferEngine, the shared in-process transfer engine
     count_files: type int, the number of files that have been processed, including the current file
+    queued_at:   type float, the perf_counter time the transfer was queued
+    stat:        type os.stat_result, of full_path if already known, or None
     Returns:     None
     """
-    bashCommand = "aws s3 cp " + full_path + " " + bucket_path + filename
-    print(bcolors.OKGREEN + "Processing File #" + str(count_files) + ": " + full_path + bcolors.ENDC)
-    print(bcolors.OKBLUE + "Running Bash Command: " + bashCommand + bcolors.ENDC)
-    sys_call = subprocess.check_output(bashCommand, shell=True)
-    print(bcolors.WARNING + "Bash Output: " + "..." + str(sys_call)[-75:-3]  + bcolors.ENDC)
-    #os.system(bashCommand)
+    started_at = time.perf_counter()
+    stats = {'ttfb': None, 'retries': 0}
+    try:
+        num_bytes = engine.upload_file(full_path, filename, stats, stat)
+    except Exception as e:
+        if engine.trace != None:
+            engine.trace.record('upload', filename, threadName, queued_at, started_at, 0, stats, e)
+        raise
+    if engine.journal != None:
+        engine.journal.finish('upload', filename, full_path)
+    if engine.trace != None:
+        engine.trace.record('upload', filename, threadName, queued_at, started_at, num_bytes, stats)
 
-def download(outdir, bucket_path, max_threads):
+def download(outdir, engine, max_threads, z_range=None, extract=False, controller=None):
     """
-    This function downloads all files in from S3 bucket_path to the outdir directory.
+    This function downloads all files in from the S3 bucket of engine to the outdir directory. The bucket listing
+    is streamed page by page straight into the worker pool, so downloads start while later pages are still being
+    listed, and the full listing is never held in memory.
     outdir: string of relative or absolute path to output directory.
-    bucket_path: string of S3 bucket in format "s3://bucket-name/"
+    engine: transferEngine object for the S3 bucket
     max_threads: The maximum number of threads that should be used to download the files from the S3 bucket.
-    Returns: None
+    z_range: [<z_first>, <z_last>] to unpack volume objects into per-slice files, or None to download them as they are
+    extract: True to unpack archive objects into outdir while they download
+    controller: aimdController object tuning the number of active threads, or None to use max_threads
+    Returns: type int, the number of files downloaded
     """
-    completed_files = 0
-    bashCommand = "aws s3 ls " + bucket_path
-    print(bcolors.WARNING + "Processing AWS S3 Directory Listing: " + bashCommand + bcolors.ENDC)
-    output = str(subprocess.check_output(bashCommand, shell=True))
-    output = output[2:-1]
-    output_list = []
-    last_char = ""
-    this_line = ""
-    for char in output.strip():
-        if char == 'n' and last_char == '\\':
-            output_list.append(this_line[0:-1])
-            this_line = ""
-            last_char = ""
-        else:
-            this_line = this_line + char
-            last_char = char
-    line_count = 0
+    print(bcolors.WARNING + "Processing S3 Directory Listing: " + engine.bucket_path + bcolors.ENDC)
     count_files = 0
-    for line in output_list:
-        line_count += 1
-        if line_count % 2 == 0:
-            print(bcolors.OKBLUE + line + bcolors.ENDC)
-        else:
-            print(bcolors.OKGREEN + line + bcolors.ENDC)
-        filename = line.split()[-1]
-        print("Found file: " + filename)
-        count_files += 1
-        bashCommand = "aws s3 cp " + bucket_path + filename + " " + outdir + filename
-        print(bcolors.OKGREEN + "Processing File #" + str(count_files) + ": " + bucket_path + filename + bcolors.ENDC)
-        print(bcolors.OKBLUE + "Running Bash Command: " + bashCommand + bcolors.ENDC)
-        os.system(bashCommand)
+    with open_pool(max_threads, controller) as pool:
+        for item in engine.list_objects():
+            filename = item['key']
+            if filename.endswith("/"):
+                continue
+            count_files += 1
+            submit_download(pool, outdir, filename, engine, count_files, z_range, extract)
+    report_errors(pool.errors, count_files)
+    print("Exiting Main Thread...")
+    return count_files
 
-def download_test(filename, outdir, bucket_path, max_threads):
+def download_test(filename, outdir, engine, max_threads, z_range=None, extract=False, controller=None):
     """
-    This function downloads all files, each specified in filename from S3 bucket_path to the outdir directory.
+    This function downloads all files, each specified in filename from the S3 bucket of engine to the outdir directory.
     filename:    type str, the filename or file path to the download#.test file that contains one file path or file name per line.
     outdir:      type string of relative or absolute path to output directory.
-    bucket_path: type string of S3 bucket in format "s3://bucket-name/"
+    engine:      type transferEngine, the in-process transfer engine for the S3 bucket
     max_threads: type int, the maximum number of threads that should be used to download the files from the S3 bucket.
-    Returns:     None
+    z_range:     type list, [<z_first>, <z_last>] to unpack volume objects into per-slice files, or None to download them as they are
+    extract:     type bool, True to unpack archive objects into outdir while they download
+    controller:  type aimdController, tunes the number of active threads, or None to use max_threads
+    Returns:     type int, the number of files listed in filename
     """
     fin = open(filename, 'r')
     count_files = 0
-    threads = []
-    for filename in fin.readlines():
-        count_files+=1
-        filename = filename.rstrip()
-        threadID = (count_files - 1) % max_threads
-        name = "Thread-" + str(threadID)
-        this_thread = downloadThread(threadID, name, outdir, filename, bucket_path, count_files)
-        wait_timer = 0
-        while threading.activeCount() > max_threads:
-            wait_timer+=1
-        this_thread.start()
-        threads.append(this_thread)
+    with open_pool(max_threads, controller) as pool:
+        for filename in fin:
+            filename = filename.rstrip()
+            if filename == "":
+                continue
+            count_files+=1
+            if engine.journal != None and engine.journal.finished('download', filename, os.path.join(outdir, filename)):
+                continue
+            submit_download(pool, outdir, filename, engine, count_files, z_range, extract)
     fin.close()
-    for t in threads:
-        t.join()
+    report_errors(pool.errors, count_files)
     print("Exiting Main Thread...")
     return count_files
 
-def purge_test(test_file, bucket_path):
+def do_download_volume(threadName, outdir, key, engine, count_files, queued_at, z_range):
     """
-    This function purges all of the filenames from test_file, whether it be an upload or a download .test file,
-    from the S3 bucket_path.
-    test_file:  type str, relative or absolute path to .test file
-    bucket_path: type string of S3 bucket in format "s3://bucket-name/"
+    This function is called by a workerPool worker to unpack the slices of the volume key into per-slice files in outdir.
+    threadName:  type str, the name of the worker thread running the transfer
+    outdir:      type str, the relative or absolute path to the output directory
+    key:         type str, the key of the volume object
+    engine:      type transferEngine, the shared in-process transfer engine
+    count_files: type int, the number of files that have been processed, including the current volume
+    queued_at:   type float, the perf_counter time the transfer was queued
+    z_range:     type list, [<z_first>, <z_last>] of the slices to unpack, either None for open-ended
+    Returns:     None
     """
-    fin = open(test_file, 'r')
-    count_files = 0
-    for filename in fin.readlines():
-        count_files+=1
-        filename = filename.rstrip()
+    started_at = time.perf_counter()
+    try:
+        slices = zstack_volume.read_volume(engine, key, z_range[0], z_range[1])
+        num_bytes = zstack_volume.write_slices(slices, archive_stream.member_path(outdir, os.path.dirname(key)))
+    except Exception as e:
+        if engine.trace != None:
+            engine.trace.record('download', key, threadName, queued_at, started_at, 0, None, e)
+        raise
+    if engine.trace != None:
+        engine.trace.record('download', key, threadName, queued_at, started_at, num_bytes)
+
+def do_download_archive(threadName, outdir, key, engine, count_files, queued_at):
+    """
+    This function is called by a workerPool worker to unpack the archive key into outdir while it downloads. Later
+    ranges of the archive are fetched concurrently while earlier members are being extracted (see extract_archive).
+    threadName:  type str, the name of the worker thread running the transfer
+    outdir:      type str, the relative or absolute path to the output directory
+    key:         type str, the key of the archive object
+    engine:      type transferEngine, the shared in-process transfer engine
+    count_files: type int, the number of files that have been processed, including the current archive
+    queued_at:   type float, the perf_counter time the transfer was queued
+    Returns:     None
+    """
+    started_at = time.perf_counter()
+    stats = {'ttfb': None, 'retries': 0}
+    try:
+        stream = engine.open_stream(key)
+        stats['ttfb'] = time.perf_counter() - started_at
         try:
-            if filename.index("/") > 0:
-                path_vars = []
-                for path_var in filename.split("/"):
-                    path_vars.append(path_var)
-                filename = path_vars[-1]
-        except:
-            None
-        bashCommand = "aws s3 rm " + bucket_path + filename
-        print(bcolors.OKGREEN + "Purging File #" + str(count_files) + ": " + filename + bcolors.ENDC)
-        print(bcolors.OKBLUE + "Running Bash Command: " + bashCommand + bcolors.ENDC)
-        sys_call = subprocess.check_output(bashCommand, shell=True)
-        print(bcolors.WARNING + "Bash Output: " + "..." + str(sys_call)[-75:-3] + bcolors.ENDC)
-    fin.close()
+            archive_stream.extract_archive(stream, outdir, archive_stream.archive_codec(key))
+        finally:
+            stream.close()
+    except Exception as e:
+        if engine.trace != None:
+            engine.trace.record('download', key, threadName, queued_at, started_at, 0, stats, e)
+        raise
+    if engine.trace != None:
+        engine.trace.record('download', key, threadName, queued_at, started_at, stream.size, stats)
+
+def download_bundle(bundle_key, outdir, engine, max_threads, filename=None):
+    """
+    This function unpacks the bundle bundle_key (see shard_bundle.py) into outdir. Without filename, every shard
+    is read whole as one prefetched stream and max_threads shards are unpacked at once. With filename, only the
+    members it lists are read, with ranged GETs of the shards that hold them, neighbouring members sharing one GET.
+    bundle_key:  type str, the key prefix of the bundle
+    outdir:      type str, relative or absolute path to the output directory
+    engine:      type transferEngine, the in-process transfer engine for the S3 bucket
+    max_threads: type int, the number of shards or ranges read at once
+    filename:    type str, the download#.test file listing one member name per line, or None for every member
+    Returns:     type int, the number of files unpacked
+    """
+    try:
+        index = shard_bundle.read_index(engine, bundle_key)
+    except Exception as e:
+        print(bcolors.FAIL + "Transfer Failed: " + shard_bundle.index_key(bundle_key) + ": " + repr(e) + bcolors.ENDC)
+        return 0
+    members = index['members']
+    if filename != None:
+        by_name = {}
+        for member in members:
+            by_name[member[0]] = member
+        members = []
+        fin = open(filename, 'r')
+        for name in fin:
+            name = name.rstrip()
+            if name == "":
+                continue
+            if name in by_name:
+                members.append(by_name[name])
+            else:
+                print(bcolors.FAIL + "Not In Bundle: " + name + bcolors.ENDC)
+        fin.close()
+    by_shard = {}
+    for member in members:
+        by_shard.setdefault(member[1], []).append(member)
+    print(bcolors.OKBLUE + "Unpacking " + str(len(members)) + " files from " + str(len(by_shard)) + " shards of " + engine.bucket_path + bundle_key + bcolors.ENDC)
+    count_files = 0
+    count_reads = 0
+    with workerPool(max_threads) as pool:
+        for shard in sorted(by_shard):
+            if filename == None:
+                count_files += len(by_shard[shard])
+                count_reads += 1
+                pool.submit(do_download_shard, outdir, index['shards'][shard][0], engine, count_files, queued(engine), index['shards'][shard], by_shard[shard])
+                continue
+            for group in shard_bundle.coalesce(by_shard[shard]):
+                count_files += len(group)
+                count_reads += 1
+                pool.submit(do_download_members, outdir, index['shards'][shard][0], engine, count_files, queued(engine), index['shards'][shard], group)
+    report_errors(pool.errors, count_reads)
+    print("Exiting Main Thread...")
     return count_files
 
-def purge_all(bucket_path):
+def do_download_shard(threadName, outdir, key, engine, count_files, queued_at, shard, members):
     """
-    This function purges all of the filenames from the S3 bucket_path.
-    bucket_path: type string of S3 bucket in format "s3://bucket-name/"
+    This function is called by a workerPool worker to read a whole shard of a bundle and unpack its members into outdir.
+    threadName:  type str, the name of the worker thread running the transfer
+    outdir:      type str, the relative or absolute path to the output directory
+    key:         type str, the key of the shard object
+    engine:      type transferEngine, the shared in-process transfer engine
+    count_files: type int, the number of files that have been processed, including the members of this shard
+    queued_at:   type float, the perf_counter time the transfer was queued
+    shard:       type list, [<key>, <size>, <etag>] of the shard, from the bundle index
+    members:     type list, of [<name>, <shard>, <offset>, <length>] of the members to unpack
+    Returns:     None
+    """
+    started_at = time.perf_counter()
+    try:
+        num_bytes = shard_bundle.unpack_shard(engine, shard, members, outdir)
+    except Exception as e:
+        if engine.trace != None:
+            engine.trace.record('download', key, threadName, queued_at, started_at, 0, None, e)
+        raise
+    if engine.trace != None:
+        engine.trace.record('download', key, threadName, queued_at, started_at, num_bytes)
+
+def do_download_members(threadName, outdir, key, engine, count_files, queued_at, shard, members):
+    """
+    This function is called by a workerPool worker to read neighbouring members of one shard of a bundle with a
+    single ranged GET and write them into outdir.
+    threadName:  type str, the name of the worker thread running the transfer
+    outdir:      type str, the relative or absolute path to the output directory
+    key:         type str, the key of the shard object
+    engine:      type transferEngine, the shared in-process transfer engine
+    count_files: type int, the number of files that have been processed, including these members
+    queued_at:   type float, the perf_counter time the transfer was queued
+    shard:       type list, [<key>, <size>, <etag>] of the shard, from the bundle index
+    members:     type list, of [<name>, <shard>, <offset>, <length>] sorted by offset, as grouped by shard_bundle.coalesce
+    Returns:     None
+    """
+    started_at = time.perf_counter()
+    try:
+        num_bytes = shard_bundle.read_members(engine, shard, members, outdir)
+    except Exception as e:
+        if engine.trace != None:
+            engine.trace.record('download', key, threadName, queued_at, started_at, 0, None, e)
+        raise
+    if engine.trace != None:
+        engine.trace.record('download', key, threadName, queued_at, started_at, num_bytes)
+
+def submit_download(pool, outdir, filename, engine, count_files, z_range=None, extract=False):
+    """
+    This function queues the download of one key, unpacking it into per-slice files if it is a volume object
+    and z_range is given, or extracting it into outdir if it is an archive and extract is True. 7z and rar
+    archives can't be extracted while they download, so with extract they are downloaded whole, with a warning.
+    Returns: None
     """
-    bashCommand = "aws s3 rm " + bucket_path + " --recursive"
-    print(bcolors.OKGREEN + "Purging All Files on " + bucket_path + bcolors.ENDC)
-    print(bcolors.OKBLUE + "Running Bash Command: " + bashCommand + bcolors.ENDC)
-    sys_call = subprocess.check_output(bashCommand, shell=True)
-    print(bcolors.WARNING + "Bash Output: " + "..." + str(sys_call)[-75:-3] + bcolors.ENDC)
+    if z_range != None and zstack_volume.is_volume(filename):
+        pool.submit(do_download_volume, outdir, filename, engine, count_files, queued(engine), z_range)
+    elif extract and archive_stream.is_archive(filename):
+        pool.submit(do_download_archive, outdir, filename, engine, count_files, queued(engine))
+    elif extract and archive_stream.is_unstreamable(filename):
+        print(bcolors.WARNING + "Not Extracted: " + bcolors.ENDC + filename + " can't be unpacked while it downloads, so it is downloaded whole")
+        pool.submit(do_download, outdir, filename, engine, count_files, queued(engine))
+    else:
+        pool.submit(do_download, outdir, filename, engine, count_files, queued(engine))
     return None
 
-class downloadThread(threading.Thread):
-    """
-    This class defines the downloadThread blueprint, of type threading.Thread, which calls do_download
-    to download one file per thread.
-    To Call: downloadThread(threadID, name, outdir, filename, bucket_path, count_files)
-    Whereas: threadId:    type int, is the ID of the thread assigned by the calling function
-             name:        type str, is the name of the thread assigned by the calling function
-             outdir:      type str, is the absolute or relative path to output the downloaded file to
-             filename:    type str, is a valid filename on the S3 bucket
-             bucket_path: type str, is a valid S3 bucket path in the format "s3://bucket-name/"
-             count_files: type int, is the number of files that have been counted so far in the process
-    """
-    def __init__(self, threadID, name, outdir, filename, bucket_path, count_files):
-       threading.Thread.__init__(self)
-       self.threadID = threadID
-       self.name = name
-       self.outdir = outdir
-       self.filename = filename
-       self.bucket_path = bucket_path
-       self.count_files = count_files
-    def run(self):
-       print("Starting New Thread")
-       do_download(self.name, self.outdir, self.filename, self.bucket_path, self.count_files)
-       print("Exiting " + self.name)
-
-def do_download(threadName, outdir, filename, bucket_path, count_files):
-    """
-    This function is called by downloadThread to download one filename from bucket_path to outdir.
-    threadName:  type str, the name of the thread assigned by the calling function
+def open_journal(directory, op, bucket_path, list_file, resume, log_messages):
+    """
+    This function opens the checkpoint journal of an upload or download run with -rs (see transfer_journal.py),
+    continuing the journal an earlier run of the same .test file left behind, if any. Runs without -rs keep no
+    journal at all.
+    directory:    type str, the output directory of a download, or the directory of the .test file of an upload
+    op:           type str, "upload" or "download"
+    bucket_path:  type str, the bucket path
+    list_file:    type str, the .test file listing the transfers
+    resume:       type bool, True for -rs
+    log_messages: type list, the log messages to add the journal path to
+    Returns:      type transferJournal, or None without resume
+    """
+    if not resume:
+        return None
+    path = transfer_journal.journal_path(directory, op, bucket_path, list_file)
+    if os.path.isfile(path):
+        print(bcolors.WARNING + "Resuming From Journal: " + bcolors.ENDC + path)
+        log_messages.append('Resumed From Journal: ' + path)
+    else:
+        log_messages.append('Journal: ' + path)
+    return transfer_journal.transferJournal(path, True)
+
+def async_test(op, filename, outdir, bucket_path, max_requests, part_size, max_parts, threshold, trace=None):
+    """
+    This function uploads or downloads all files listed in filename like upload_test and download_test, but with the
+    asyncio engine, so max_requests requests can be in flight at once on one event loop (see async_engine.py).
+    op:           type str, "upload" or "download"
+    filename:     type str, the filename or file path to the upload#.test or download#.test file
+    outdir:       type str, relative or absolute path to the output directory for downloads, None for uploads
+    bucket_path:  type str, the bucket path
+    max_requests: type int, the number of requests in flight at once
+    part_size:    type float, size in MB of each part of a large object
+    max_parts:    type int, number of parts in flight at once
+    threshold:    type float, size in MB above which files are uploaded as multipart uploads
+    trace:        type transferTrace, the trace to record each transfer in, or None
+    Returns:      type int, the number of files processed
+    """
+    try:
+        engine = async_engine.asyncEngine(bucket_path, max_requests, int(part_size * 1024 * 1024), max_parts, int(threshold * 1024 * 1024))
+    except (ImportError, ValueError) as e:
+        print(bcolors.FAIL + "Error: " + str(e) + bcolors.ENDC)
+        return 0
+    names = []
+    fin = open(filename, 'r')
+    for line in fin:
+        line = line.rstrip()
+        if line != "":
+            names.append(line)
+    fin.close()
+    if op == 'upload':
+        jobs = [[full_path, basename(full_path)] for full_path in names]
+    else:
+        jobs = [[os.path.join(outdir, key), key] for key in names]
+    try:
+        errors = engine.run(op, jobs, trace)
+    finally:
+        engine.close()
+    report_errors(errors, len(jobs))
+    print("Exiting Main Thread...")
+    return len(jobs)
+
+def purge_test(test_file, engine, max_threads):
+    """
+    This function purges all of the filenames from test_file, whether it be an upload or a download .test file,
+    from the S3 bucket of engine. Keys are deleted in batches of up to 1000 per request, sent concurrently.
+    test_file:   type str, relative or absolute path to .test file
+    engine:      type transferEngine, the in-process transfer engine for the S3 bucket
+    max_threads: type int, the maximum number of delete requests in flight at once
+    Returns:     type dict, {'deleted': <number of keys deleted>, 'failed': list of [<key>, <error message>]}
+    """
+    def read_keys():
+        fin = open(test_file, 'r')
+        try:
+            for filename in fin:
+                filename = filename.rstrip()
+                if filename != "":
+                    yield basename(filename)
+        finally:
+            fin.close()
+    print(bcolors.OKGREEN + "Purging Files Listed in " + test_file + " from " + engine.bucket_path + bcolors.ENDC)
+    result = engine.delete_keys(read_keys(), max_threads)
+    report_purge(result)
+    return result
+
+def purge_all(engine, max_threads):
+    """
+    This function purges all of the filenames from the S3 bucket of engine. The bucket listing is streamed into
+    batched delete requests of up to 1000 keys each, sent concurrently.
+    engine:      type transferEngine, the in-process transfer engine for the S3 bucket
+    max_threads: type int, the maximum number of delete requests in flight at once
+    Returns:     type dict, {'deleted': <number of keys deleted>, 'failed': list of [<key>, <error message>]}
+    """
+    def list_keys():
+        for item in engine.list_objects():
+            yield item['key']
+    print(bcolors.OKGREEN + "Purging All Files on " + engine.bucket_path + bcolors.ENDC)
+    result = engine.delete_keys(list_keys(), max_threads)
+    report_purge(result)
+    return result
+
+def report_purge(result):
+    """
+    This function prints the outcome of purge_test or purge_all.
+    result:  type dict, {'deleted': <number of keys deleted>, 'failed': list of [<key>, <error message>]}
+    Returns: None
+    """
+    for key, message in result['failed']:
+        print(bcolors.FAIL + "Delete Failed: " + key + ": " + message + bcolors.ENDC)
+    print(bcolors.WARNING + "Purged " + str(result['deleted']) + " files, " + str(len(result['failed'])) + " failed." + bcolors.ENDC)
+    return None
+
+def do_upload_data(threadName, data, key, engine, count_files, queued_at):
+    """
+    This function is called by a workerPool worker to upload one converted slice from memory to the S3 bucket of engine.
+    threadName:  type str, the name of the worker thread running the transfer
+    data:        type bytes, the encoded slice
+    key:         type str, the key to upload it to
+    engine:      type transferEngine, the shared in-process transfer engine
+    count_files: type int, the number of files that have been processed, including the source of this slice
+    queued_at:   type float, the perf_counter time the transfer was queued
+    Returns:     None
+    """
+    started_at = time.perf_counter()
+    try:
+        num_bytes = engine.upload_data(data, key)
+    except Exception as e:
+        if engine.trace != None:
+            engine.trace.record('upload', key, threadName, queued_at, started_at, 0, None, e)
+        raise
+    if engine.trace != None:
+        engine.trace.record('upload', key, threadName, queued_at, started_at, num_bytes)
+
+def do_upload_volume(threadName, slices, key, engine, count_files, queued_at):
+    """
+    This function is called by a workerPool worker to pack the z-slices of one tile and upload them as the volume key,
+    streamed from the slices' files into a multipart upload so the volume is never held in memory.
+    threadName:  type str, the name of the worker thread running the transfer
+    slices:      type list, of [<z>, <filename>, <full_path>] of the tile
+    key:         type str, the key of the volume object
+    engine:      type transferEngine, the shared in-process transfer engine
+    count_files: type int, the number of files that have been processed, including these slices
+    queued_at:   type float, the perf_counter time the transfer was queued
+    Returns:     None
+    """
+    started_at = time.perf_counter()
+    stats = {'ttfb': None, 'retries': 0}
+    try:
+        num_bytes = engine.upload_stream(zstack_volume.volume_chunks(slices), key, stats)['size']
+    except Exception as e:
+        if engine.trace != None:
+            engine.trace.record('upload', key, threadName, queued_at, started_at, 0, stats, e)
+        raise
+    if engine.trace != None:
+        engine.trace.record('upload', key, threadName, queued_at, started_at, num_bytes, stats)
+
+def do_download(threadName, outdir, filename, engine, count_files, queued_at):
+    """
+    This function is called by a workerPool worker to download one filename from the S3 bucket of engine to outdir.
+    Its timing is recorded in engine.trace instead of being printed. Keys come from the bucket, so a key that would
+    escape outdir (see archive_stream.member_path) fails instead of being written outside it.
+    threadName:  type str, the name of the worker thread running the transfer
     outdir:      type str, the relative or absolute path to the output directory, where the file should
                  be downloaded to
     filename:    type str, the name of the file to be downloaded
-    bucket_path: type str, a valid S3 bucket path in the format "s3://bucket-name/"
+    engine:      type transferEngine, the shared in-process transfer engine
     count_files: type int, the number of files that have been processed, including the current file
+    queued_at:   type float, the perf_counter time the transfer was queued
     Returns:     None
     """
-    bashCommand = "aws s3 cp " + bucket_path + filename + " " + outdir + filename
-    print(bcolors.OKGREEN + "Processing File #" + str(count_files) + ": " + filename + bcolors.ENDC)
-    print(bcolors.OKBLUE + "Running Bash Command: " + bashCommand + bcolors.ENDC)
-    sys_call = subprocess.check_output(bashCommand, shell=True)
-    print(bcolors.WARNING + "Bash Output: " + "..." + str(sys_call)[-75:-3] + bcolors.ENDC)
+    started_at = time.perf_counter()
+    stats = {'ttfb': None, 'retries': 0}
+    try:
+        full_path = archive_stream.member_path(outdir, filename)
+        num_bytes = engine.download_file(filename, full_path, stats)
+    except Exception as e:
+        if engine.trace != None:
+            engine.trace.record('download', filename, threadName, queued_at, started_at, 0, stats, e)
+        raise
+    if engine.journal != None:
+        engine.journal.finish('download', filename, full_path)
+    if engine.trace != None:
+        engine.trace.record('download', filename, threadName, queued_at, started_at, num_bytes, stats)
 
-def sync_download(outdir, bucket_path):
+def sync_download(outdir, engine, max_threads, delete=False):
     """
-    This function is called to download bucket_path to outdir.
+    This function is called to download the S3 bucket of engine to outdir, transferring only objects that are new or
+    changed since the last sync, according to the state database kept in outdir (see sync_engine.py).
     outdir:      type str, the relative or absolute path to the output directory, where the files should
                  be downloaded to
-    bucket_path: type str, a valid S3 bucket path in the format "s3://bucket-name/"
-    Returns:     None
+    engine:      type transferEngine, the in-process transfer engine for the S3 bucket
+    max_threads: type int, the maximum number of threads that should be used to download the files
+    delete:      type bool, True to also delete local files whose object was removed from the bucket
+    Returns:     type dict, {'transferred', 'skipped', 'deleted', 'failed', 'bytes'} counts
     """
-    bashCommand = "aws s3 sync " + bucket_path + " " + outdir
-    print(bcolors.OKBLUE + "Running Bash Command: " + bashCommand + bcolors.ENDC)
-    sys_call = subprocess.check_output(bashCommand, shell=True)
-    print(bcolors.WARNING + "Bash Output: " + "..." + str(sys_call)[-75:-3] + bcolors.ENDC)
+    print(bcolors.OKBLUE + "Synchronizing: " + engine.bucket_path + " to " + outdir + bcolors.ENDC)
+    counts = sync_engine.sync_download(outdir, engine, max_threads, delete, engine.trace)
+    for job_args, error, trace in counts['errors']:
+        print(bcolors.FAIL + "Transfer Failed: " + str(job_args[0]) + ": " + repr(error) + bcolors.ENDC)
+    return counts
 
-def sync_upload(indir, bucket_path):
+def sync_upload(indir, engine, max_threads, delete=False):
     """
-    This function is called to download bucket_path to outdir.
+    This function is called to upload indir to the S3 bucket of engine, transferring only files that are new or
+    changed since the last sync, according to the state database kept in indir (see sync_engine.py).
     indir:       type str, the relative or absolute path to the input directory, where the files should
                  be uploaded from
-    bucket_path: type str, a valid S3 bucket path in the format "s3://bucket-name/"
-    Returns:     None
+    engine:      type transferEngine, the in-process transfer engine for the S3 bucket
+    max_threads: type int, the maximum number of threads that should be used to upload the files
+    delete:      type bool, True to also delete objects whose local file was removed from indir
+    Returns:     type dict, {'transferred', 'skipped', 'deleted', 'failed', 'bytes'} counts
     """
-    bashCommand = "aws s3 sync " + indir + " " + bucket_path
-    print(bcolors.OKBLUE + "Running Bash Command: " + bashCommand + bcolors.ENDC)
-    sys_call = subprocess.check_output(bashCommand, shell=True)
-    print(bcolors.WARNING + "Bash Output: " + "..." + str(sys_call)[-75:-3] + bcolors.ENDC)
+    print(bcolors.OKBLUE + "Synchronizing: " + indir + " to " + engine.bucket_path + bcolors.ENDC)
+    counts = sync_engine.sync_upload(indir, engine, max_threads, delete, engine.trace)
+    for job_args, error, trace in counts['errors']:
+        print(bcolors.FAIL + "Transfer Failed: " + str(job_args[0]) + ": " + repr(error) + bcolors.ENDC)
+    return counts
 
 if __name__ == "__main__":
     main()
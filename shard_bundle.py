@@ -0,0 +1,177 @@
+import os
+import json
+from transfer_engine import partial_suffix
+__author__ = 'MCE123'
+
+default_shard_size = 128 * 1024 * 1024  #Default target size of each shard object.
+bundle_version = 1                      #Version of the bundle index written by make_index.
+index_name = "index.json"               #Name of the index object inside a bundle.
+max_gap = 1024 * 1024                   #Members of one shard less than this many bytes apart are read with one ranged GET.
+max_range = 16 * 1024 * 1024            #Largest ranged GET a member read is coalesced into, unless one member is larger.
+chunk_size = 1024 * 1024                #Size of each read while streaming members into or out of a shard.
+
+def index_key(bundle_key):
+    """
+    Returns: type str, the key of the index object of the bundle bundle_key, e.g. "run1/index.json"
+    """
+    return bundle_key.rstrip("/") + "/" + index_name
+
+def shard_key(bundle_key, shard):
+    """
+    Returns: type str, the key of shard number shard of the bundle bundle_key, e.g. "run1/shard-00003.bin"
+    """
+    return bundle_key.rstrip("/") + "/shard-" + str(shard).zfill(5) + ".bin"
+
+def plan_shards(files, shard_size=default_shard_size):
+    """
+    This function packs files, in order, into shards of at most shard_size bytes. A file larger than shard_size
+    gets a shard of its own, since members are never split between shards.
+    files:      type iter, of [<full_path>, <name in the bundle>]
+    shard_size: type int, the target size of each shard in bytes
+    Returns:    type list, of shards, each a list of [<full_path>, <name>, <size>]
+    """
+    shards = []
+    current = []
+    current_size = 0
+    for full_path, name in files:
+        size = os.path.getsize(full_path)
+        if len(current) > 0 and current_size + size > shard_size:
+            shards.append(current)
+            current = []
+            current_size = 0
+        current.append([full_path, name, size])
+        current_size += size
+    if len(current) > 0:
+        shards.append(current)
+    return shards
+
+def shard_chunks(members):
+    """
+    This function yields the contents of the members of one shard back to back, so the shard can be streamed
+    into an upload without ever being assembled in memory or on disk.
+    members: type list, of [<full_path>, <name>, <size>], as planned by plan_shards
+    Returns: generator of type bytes
+    """
+    for full_path, name, size in members:
+        num_bytes = 0
+        fin = open(full_path, 'rb')
+        try:
+            data = fin.read(chunk_size)
+            while data:
+                num_bytes += len(data)
+                yield data
+                data = fin.read(chunk_size)
+        finally:
+            fin.close()
+        if num_bytes != size:
+            raise OSError(full_path + " changed size while it was being bundled")
+
+def make_index(shards, results):
+    """
+    This function builds the index of a bundle: every shard's key, size and ETag, and every member's name, shard,
+    offset and length, the members as compact [<name>, <shard>, <offset>, <length>] lists.
+    shards:  type list, as returned by plan_shards
+    results: type list, of {'key', 'size', 'etag'} of each uploaded shard, in shard order
+    Returns: type bytes, the JSON index
+    """
+    members = []
+    for shard, shard_members in enumerate(shards):
+        offset = 0
+        for full_path, name, size in shard_members:
+            members.append([name, shard, offset, size])
+            offset += size
+    index = {'version': bundle_version, 'shards': [[result['key'], result['size'], result['etag']] for result in results], 'members': members}
+    return json.dumps(index, separators=(',', ':')).encode('utf-8')
+
+def read_index(engine, bundle_key):
+    """
+    This function reads the index of the bundle bundle_key.
+    engine:     type transferEngine, the engine for the bucket
+    bundle_key: type str, the key prefix of the bundle
+    Returns:    type dict, {'shards': list of [<key>, <size>, <etag>], 'members': list of [<name>, <shard>, <offset>, <length>]}
+    """
+    data = engine.read_range(index_key(bundle_key), 0)[0]
+    index = json.loads(data.decode('utf-8'))
+    if index.get('version') != bundle_version:
+        raise ValueError(index_key(bundle_key) + " is not a version " + str(bundle_version) + " bundle index")
+    return index
+
+def coalesce(members):
+    """
+    This function groups the members of one shard into ranges that are each read with one ranged GET: members
+    less than max_gap bytes apart share a range, up to max_range bytes per range.
+    members: type list, of [<name>, <shard>, <offset>, <length>]
+    Returns: type list, of ranges, each a list of members sorted by offset
+    """
+    ranges = []
+    for member in sorted(members, key=lambda member: member[2]):
+        if len(ranges) > 0:
+            first = ranges[-1][0]
+            last = ranges[-1][-1]
+            if member[2] - (last[2] + last[3]) < max_gap and member[2] + member[3] - first[2] <= max_range:
+                ranges[-1].append(member)
+                continue
+        ranges.append([member])
+    return ranges
+
+def write_member(outdir, name, data):
+    """
+    This function writes one member to its path inside outdir, through a temporary name so a file at its real
+    name is always whole. Names that would escape outdir are refused (see archive_stream.member_path).
+    Returns: type int, the number of bytes written
+    """
+    import archive_stream
+    full_path = archive_stream.member_path(outdir, name)
+    dest_dir = os.path.dirname(full_path)
+    if dest_dir != "" and not os.path.isdir(dest_dir):
+        os.makedirs(dest_dir, exist_ok=True)
+    tmp_path = full_path + partial_suffix
+    fout = open(tmp_path, 'wb')
+    try:
+        fout.write(data)
+    finally:
+        fout.close()
+    os.replace(tmp_path, full_path)
+    return len(data)
+
+def read_members(engine, shard, members, outdir):
+    """
+    This function reads members of one shard with a single ranged GET and writes them into outdir.
+    engine:  type transferEngine, the engine for the bucket
+    shard:   type list, [<key>, <size>, <etag>] of the shard, from the index
+    members: type list, of [<name>, <shard>, <offset>, <length>] sorted by offset, as grouped by coalesce
+    outdir:  type str, relative or absolute path to the output directory
+    Returns: type int, the number of bytes written
+    """
+    start = members[0][2]
+    end = members[-1][2] + members[-1][3]
+    data = engine.read_range(shard[0], start, end - 1, if_match=shard[2])[0]
+    num_bytes = 0
+    for name, number, offset, length in members:
+        num_bytes += write_member(outdir, name, data[offset - start:offset - start + length])
+    return num_bytes
+
+def unpack_shard(engine, shard, members, outdir):
+    """
+    This function reads a whole shard as one stream, prefetching its later parts concurrently, and writes every
+    member into outdir as soon as its bytes have arrived.
+    engine:  type transferEngine, the engine for the bucket
+    shard:   type list, [<key>, <size>, <etag>] of the shard, from the index
+    members: type list, of [<name>, <shard>, <offset>, <length>] of every member of the shard
+    outdir:  type str, relative or absolute path to the output directory
+    Returns: type int, the number of bytes written
+    """
+    stream = engine.open_stream(shard[0])
+    try:
+        if stream.etag != shard[2]:
+            raise OSError("Precondition failed: " + shard[0] + " changed since the bundle index was written")
+        pos = 0
+        num_bytes = 0
+        for name, number, offset, length in sorted(members, key=lambda member: member[2]):
+            if offset > pos:
+                stream.read(offset - pos)
+            num_bytes += write_member(outdir, name, stream.read(length))
+            pos = offset + length
+    finally:
+        stream.close()
+    return num_bytes
@@ -0,0 +1,141 @@
+import os
+import io
+import traceback
+import concurrent.futures
+__author__ = 'MCE123'
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+slice_formats = {'orig': None, 'npy': '.npy', 'png': '.png'}     #Formats each slice can be uploaded in, and the extension of the converted key.
+tiff_extensions = ['.tiff', '.tif']                                #Extensions of the original slices that can be converted.
+
+def parse_formats(text):
+    """
+    This function parses a comma-separated list of slice formats, such as "orig,npy,png".
+    text:    type str, the list given on the command line
+    Returns: type list, of format names in slice_formats
+    """
+    formats = []
+    for fmt in text.split(','):
+        fmt = fmt.strip().lower()
+        if fmt == "":
+            continue
+        if fmt not in slice_formats:
+            raise ValueError("Unknown slice format " + fmt + ", expected one of " + ", ".join(slice_formats.keys()))
+        if fmt not in formats:
+            formats.append(fmt)
+    if len(formats) == 0:
+        raise ValueError("No slice formats given")
+    return formats
+
+def is_tiff(filename):
+    """
+    Returns: True if filename is an original TIFF slice that can be converted
+    """
+    return os.path.splitext(filename)[1].lower() in tiff_extensions
+
+def converted_key(key, fmt):
+    """
+    This function returns the key of the fmt encoding of a slice, e.g. "pre_exp_scan_r1-FTC-x02-y02-z00.npy"
+    for "pre_exp_scan_r1-FTC-x02-y02-z00.tiff" and "npy".
+    """
+    return os.path.splitext(key)[0] + slice_formats[fmt]
+
+def convert_slice(full_path, formats):
+    """
+    This function decodes one TIFF slice and re-encodes it in memory. It runs in a worker process.
+    full_path: type str, path to the TIFF file
+    formats:   type list, of "npy" and/or "png"
+    Returns:   type list, of [<format>, <encoded bytes>]
+    """
+    image = Image.open(full_path)
+    try:
+        image.load()
+        results = []
+        for fmt in formats:
+            buffer = io.BytesIO()
+            if fmt == 'npy':
+                numpy.save(buffer, numpy.asarray(image))
+            elif fmt == 'png':
+                image.save(buffer, format='PNG')
+            results.append([fmt, buffer.getvalue()])
+    finally:
+        image.close()
+    return results
+
+class sliceConverter:
+    """
+    This class defines the conversion stage of the upload pipeline. Original TIFF slices are decoded and
+    re-encoded as NPY and/or PNG in a pool of worker processes, so the CPU-bound conversion runs in parallel
+    with the uploads instead of in a separate offline pass. Encoded slices are handed back in memory as soon
+    as each one finishes, and never written to disk.
+    At most two conversions per process are in flight, so a long input list doesn't pile up decoded slices
+    in memory while the uploads catch up.
+    Conversions that fail are collected in errors, in the same [<args>, <exception>, <traceback str>] form as
+    workerPool.errors, with args [<full_path>, <key>].
+    To Call: sliceConverter(formats, max_procs)
+    Whereas: formats:   type list, of slice_formats to upload, "orig" meaning the TIFF itself
+             max_procs: type int, the number of worker processes, None for one per CPU
+    """
+    def __init__(self, formats, max_procs=None):
+        if numpy == None or Image == None:
+            raise ImportError("Converting slices requires numpy and Pillow. Install them with: pip install numpy Pillow")
+        if max_procs == None:
+            max_procs = os.cpu_count() or 1
+        self.upload_original = 'orig' in formats
+        self.formats = [fmt for fmt in formats if fmt != 'orig']
+        self.max_procs = max_procs
+        self.max_pending = max_procs * 2
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_procs)
+        self.pending = {}
+        self.errors = []
+
+    def submit(self, full_path, key):
+        """
+        Queues full_path for conversion, first waiting until fewer than max_pending conversions are in flight.
+        Returns: type list, of [<converted key>, <encoded bytes>] for the conversions that finished meanwhile
+        """
+        if len(self.pending) >= self.max_pending:
+            ready = self.collect(concurrent.futures.FIRST_COMPLETED)
+        else:
+            ready = self.collect(None)
+        future = self.executor.submit(convert_slice, full_path, self.formats)
+        self.pending[future] = [full_path, key]
+        return ready
+
+    def collect(self, return_when):
+        """
+        Gathers finished conversions, waiting as return_when says (None to not wait at all).
+        Returns: type list, of [<converted key>, <encoded bytes>]
+        """
+        if return_when == None:
+            done = [future for future in self.pending if future.done()]
+        else:
+            done = concurrent.futures.wait(list(self.pending.keys()), return_when=return_when).done
+        ready = []
+        for future in done:
+            full_path, key = self.pending.pop(future)
+            try:
+                for fmt, data in future.result():
+                    ready.append([converted_key(key, fmt), data])
+            except Exception as e:
+                self.errors.append([[full_path, key], e, "".join(traceback.format_exception(type(e), e, e.__traceback__))])
+        return ready
+
+    def drain(self):
+        """
+        Yields every remaining conversion as it finishes. Returns: generator of [<converted key>, <encoded bytes>]
+        """
+        while len(self.pending) > 0:
+            for item in self.collect(concurrent.futures.FIRST_COMPLETED):
+                yield item
+
+    def close(self):
+        self.executor.shutdown(wait=True)
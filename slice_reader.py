@@ -0,0 +1,212 @@
+import collections
+import threading
+from transfer_engine import transferEngine
+from worker_pool import workerPool
+import slice_convert
+import zstack_volume
+__author__ = 'MCE123'
+
+default_read_ahead = 8            #Number of upcoming slices downloading or decoded ahead of the consumer.
+
+def tile_stems(tile):
+    """
+    This function returns the slice name stems a tile can go by. Tiles are named like their directory,
+    "x02-y02-FTC", while their slices are named "pre_exp_scan_r1-FTC-x02-y02-z00.tiff", so the channel moves to the front.
+    tile:    type str, the tile, e.g. "x02-y02-FTC", "FTC-x02-y02" or a whole stem such as "pre_exp_scan_r1-FTC-x02-y02"
+    Returns: type list, of str stem endings to match
+    """
+    parts = tile.split("-")
+    stems = [tile]
+    if len(parts) > 1:
+        stems.append("-".join(parts[-1:] + parts[:-1]))
+    return stems
+
+def matches_tile(stem, tile):
+    """
+    Returns: True if the slice name stem belongs to tile, see tile_stems
+    """
+    for ending in tile_stems(tile):
+        if stem == ending or stem.endswith("-" + ending):
+            return True
+    return False
+
+def matches_format(extension, fmt):
+    """
+    Returns: True if a slice with extension (e.g. ".npy") is in the slice format fmt of slice_convert.slice_formats
+    """
+    if fmt == 'orig':
+        return extension.lower() in slice_convert.tiff_extensions
+    return extension == slice_convert.slice_formats[fmt]
+
+def slice_keys(engine, prefix=""):
+    """
+    This function lists the keys of engine's bucket under prefix that can hold slices: one slice per key, or
+    a volume object per tile.
+    Returns: type list, of [<file name>, <key>]
+    """
+    keys = []
+    for item in engine.list_objects(prefix):
+        key = item['key']
+        name = key.split("/")[-1]
+        if zstack_volume.is_volume(name) or zstack_volume.slice_pattern.match(name) != None:
+            keys.append([name, key])
+    return keys
+
+def find_slices(engine, tile, fmt, keys=None):
+    """
+    This function finds where every slice of tile in format fmt is kept in the bucket: one key per slice, as
+    uploaded by default or with -cv, or else one volume object per tile, as uploaded with -zs.
+    engine:  type transferEngine, the engine for the bucket
+    tile:    type str, the tile, see tile_stems
+    fmt:     type str, "orig", "npy" or "png"
+    keys:    type list, of [<file name>, <key>] from slice_keys, or None to list the whole bucket
+    Returns: type dict, z -> [<filename>, <key>, <start>, <end>, <etag>], the byte range start..end (inclusive) of
+             key holding slice z, end None for the whole object
+    """
+    if keys == None:
+        keys = slice_keys(engine)
+    slices = {}
+    volume = None
+    for name, key in keys:
+        if zstack_volume.is_volume(name):
+            stem_and_ext = name[:-len(zstack_volume.volume_extension)].rsplit("-", 1)
+            if len(stem_and_ext) == 2 and matches_tile(stem_and_ext[0], tile) and matches_format("." + stem_and_ext[1], fmt):
+                volume = key
+            continue
+        match = zstack_volume.slice_pattern.match(name)
+        if match != None and matches_tile(match.group(1), tile) and matches_format(match.group(3), fmt):
+            slices[int(match.group(2))] = [name, key, 0, None, None]
+    if len(slices) > 0 or volume == None:
+        return slices
+    index = zstack_volume.read_index(engine, volume)
+    for entry in index['slices']:
+        start = index['data_start'] + entry['offset']
+        slices[entry['z']] = [entry['name'], volume, start, start + entry['length'] - 1, index['etag']]
+    return slices
+
+def fetch_slice(worker_name, engine, location, holder):
+    """
+    This function is run by a workerPool worker to download and decode one slice into holder.
+    Returns: None
+    """
+    try:
+        filename, key, start, end, etag = location
+        data = engine.read_range(key, start, end, if_match=etag)[0]
+        holder['array'] = zstack_volume.decode_slice(filename, data)
+    except Exception as e:
+        holder['error'] = e
+    finally:
+        holder['event'].set()
+
+class sliceReader:
+    """
+    This class defines a reader of the slices of any number of tiles in one bucket. The bucket is listed once, on
+    first use, and only the keys that can hold slices are kept, so reading many tiles costs one listing instead of
+    a listing of the whole bucket per tile. A reader made before a new upload won't see it.
+    To Call: sliceReader(bucket_path, prefix, engine)
+    Whereas: bucket_path: type str, "s3://bucket-name/" or "file://directory/"
+             prefix:      type str, only keys starting with prefix are listed, e.g. "run1/" or the stem of a tile's
+                          slices, "pre_exp_scan_r1-FTC-x02-y02"
+             engine:      type transferEngine, an engine for bucket_path to share, or None to open one until close()
+    """
+    def __init__(self, bucket_path, prefix="", engine=None):
+        self.bucket_path = bucket_path
+        self.prefix = prefix
+        self.own_engine = engine == None
+        if self.own_engine:
+            engine = transferEngine(bucket_path)
+        self.engine = engine
+        self.keys = None
+        self.lock = threading.Lock()
+
+    def find_slices(self, tile, fmt):
+        """
+        Returns: type dict, z -> location of slice z of tile in format fmt, see find_slices
+        """
+        with self.lock:
+            if self.keys == None:
+                self.keys = slice_keys(self.engine, self.prefix)
+        return find_slices(self.engine, tile, fmt, self.keys)
+
+    def iter_slices(self, tile, fmt="npy", z=None, read_ahead=default_read_ahead):
+        """
+        This function yields the slices of one tile as NumPy arrays in z order, straight from the bucket, so
+        analysis code never has to write them to disk. Up to read_ahead upcoming slices are downloaded and decoded
+        by background threads while the consumer works on the current one, so computation and transfer overlap,
+        and at most read_ahead slices are held in memory at once.
+        Slices are read from one key per slice, or from the tile's volume object (see zstack_volume.py) with one
+        ranged GET per slice, conditional on the volume's ETag.
+        tile:       type str, the tile, e.g. "x02-y02-FTC"
+        fmt:        type str, the slice format to read, "orig" (TIFF), "npy" or "png"
+        z:          type iter, of the z values to read, or None for every slice of the tile
+        read_ahead: type int, the number of slices downloading or buffered ahead of the consumer
+        Returns:    generator of type numpy.ndarray
+        """
+        if zstack_volume.numpy == None:
+            raise ImportError("iter_slices requires numpy. Install it with: pip install numpy")
+        if fmt not in slice_convert.slice_formats:
+            raise ValueError("Unknown slice format " + fmt + ", expected one of " + ", ".join(slice_convert.slice_formats.keys()))
+        if read_ahead < 1:
+            raise ValueError("read_ahead must be at least 1, got " + str(read_ahead))
+        pool = None
+        holders = collections.deque()
+        try:
+            slices = self.find_slices(tile, fmt)
+            if z == None:
+                z_values = sorted(slices)
+            else:
+                z_values = sorted(set(z))
+                missing = [str(value) for value in z_values if value not in slices]
+                if len(missing) > 0:
+                    raise ValueError("Tile " + tile + " has no " + fmt + " slices at z " + ", ".join(missing) + " in " + self.bucket_path + self.prefix)
+            pool = workerPool(min(read_ahead, max(1, len(z_values))), name="Slice")
+            pending = collections.deque(z_values)
+            while len(pending) > 0 or len(holders) > 0:
+                while len(pending) > 0 and len(holders) < read_ahead:
+                    holder = {'event': threading.Event(), 'array': None, 'error': None}
+                    holders.append(holder)
+                    pool.submit(fetch_slice, self.engine, slices[pending.popleft()], holder)
+                holder = holders.popleft()
+                holder['event'].wait()
+                if holder['error'] != None:
+                    raise holder['error']
+                array = holder['array']
+                holder['array'] = None
+                yield array
+        finally:
+            #Waits for the slices still in flight, so no worker outlives an abandoned iteration
+            if pool != None:
+                pool.shutdown()
+            holders.clear()
+
+    def close(self):
+        if self.own_engine:
+            self.engine.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+        return False
+
+def iter_slices(bucket_path, tile, fmt="npy", z=None, read_ahead=default_read_ahead, engine=None, prefix=""):
+    """
+    This function yields the slices of one tile as NumPy arrays in z order, see sliceReader.iter_slices. To read
+    several tiles of a bucket, a sliceReader lists the bucket only once.
+    Example:     for plane in iter_slices("s3://comp821-m1.spring2018/", "x02-y02-FTC", "npy", range(0, 40)):
+    bucket_path: type str, "s3://bucket-name/" or "file://directory/"
+    tile:        type str, the tile, e.g. "x02-y02-FTC"
+    fmt:         type str, the slice format to read, "orig" (TIFF), "npy" or "png"
+    z:           type iter, of the z values to read, or None for every slice of the tile
+    read_ahead:  type int, the number of slices downloading or buffered ahead of the consumer
+    engine:      type transferEngine, an engine for bucket_path to share, or None to open one for this iteration
+    prefix:      type str, only keys starting with prefix are listed, see sliceReader
+    Returns:     generator of type numpy.ndarray
+    """
+    reader = sliceReader(bucket_path, prefix, engine)
+    try:
+        for array in reader.iter_slices(tile, fmt, z, read_ahead):
+            yield array
+    finally:
+        reader.close()
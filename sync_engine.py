@@ -0,0 +1,290 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+from worker_pool import workerPool, jobGroup
+from transfer_engine import file_md5, partial_suffix, multipart_dir, etag_dir
+from transfer_journal import journal_prefix
+from dedup_index import index_prefix
+import archive_stream
+__author__ = 'MCE123'
+
+state_prefix = ".s3sync-"         #Prefix of the state database files kept inside each synchronized directory.
+commit_rows = 256                 #Number of completed transfers recorded in the state database together.
+artifact_prefixes = (state_prefix, journal_prefix, index_prefix)   #Prefixes of the tool's own files, with their -wal/-shm files.
+artifact_dirs = (multipart_dir, etag_dir)                          #Directories a localBackend keeps at the top of its root.
+
+class syncState:
+    """
+    This class defines the local state database of one directory/bucket pair. It records, for every key that
+    was last synchronized, the size and mtime of the local file and the ETag of the remote object, so later
+    runs can tell which files changed without re-reading them or asking the bucket.
+    The database is a SQLite file named .s3sync-<hash of bucket_path>.db inside directory. It may be written
+    from several threads, each call holding lock.
+    To Call: syncState(directory, bucket_path)
+    Whereas: directory:   type str, relative or absolute path to the synchronized directory
+             bucket_path: type str, the bucket path it is synchronized with
+    """
+    def __init__(self, directory, bucket_path):
+        name = state_prefix + hashlib.md5(bucket_path.encode('utf-8')).hexdigest()[:16] + ".db"
+        self.path = os.path.join(directory, name)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS objects (key TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, etag TEXT, synced_at REAL)")
+        self.conn.commit()
+
+    def load(self):
+        """
+        Returns: type dict, key -> [<size>, <mtime_ns>, <etag>, <synced_at>]
+        """
+        rows = {}
+        for key, size, mtime_ns, etag, synced_at in self.conn.execute("SELECT key, size, mtime_ns, etag, synced_at FROM objects"):
+            rows[key] = [size, mtime_ns, etag, synced_at]
+        return rows
+
+    def record(self, rows):
+        """
+        Saves rows, a list of [<key>, <size>, <mtime_ns>, <etag>], stamped with the current time. Returns: None
+        """
+        if len(rows) == 0:
+            return None
+        now = time.time()
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)", [row + [now] for row in rows])
+            self.conn.commit()
+        return None
+
+    def forget(self, keys):
+        """
+        Removes keys from the database. Returns: None
+        """
+        with self.lock:
+            self.conn.executemany("DELETE FROM objects WHERE key = ?", [[key] for key in keys])
+            self.conn.commit()
+        return None
+
+    def close(self):
+        self.conn.close()
+
+def is_artifact(fname):
+    """
+    Returns: True if fname is one of the tool's own files rather than data: a sync state database, journal or
+             dedup index (with their SQLite -wal/-shm files), or a download still being written
+    """
+    return fname.startswith(artifact_prefixes) or fname.endswith(partial_suffix)
+
+def scan_directory(directory):
+    """
+    This function walks directory and yields every regular file in it, except the tool's own files (see
+    is_artifact) and the directories a localBackend keeps at the top of its root.
+    directory: type str, relative or absolute path to the directory
+    Returns:   generator of [<key>, <full_path>, <size>, <mtime_ns>], where key is the path relative to directory
+               with "/" separators
+    """
+    for dirName, subdirList, fileList in os.walk(directory):
+        if dirName == directory:
+            subdirList[:] = [subdir for subdir in subdirList if subdir not in artifact_dirs]
+        subdirList.sort()
+        for fname in sorted(fileList):
+            if is_artifact(fname):
+                continue
+            full_path = os.path.join(dirName, fname)
+            stat = os.stat(full_path)
+            key = os.path.relpath(full_path, directory).replace(os.sep, "/")
+            yield [key, full_path, stat.st_size, stat.st_mtime_ns]
+
+def matches_remote(full_path, size, remote):
+    """
+    This function checks whether a local file already has the same contents as a remote object, for the first run
+    of a pair that has no state yet. Only single-part ETags are plain MD5s, so multipart objects never match.
+    full_path: type str, path to the local file
+    size:      type int, size of the local file
+    remote:    type dict, {'key', 'size', 'etag'} of the remote object, or None
+    Returns:   True if the contents are known to be identical, False otherwise
+    """
+    if remote == None or remote['size'] != size or "-" in remote['etag']:
+        return False
+    return file_md5(full_path) == remote['etag']
+
+def run_sync(jobs, max_threads, state, op, trace=None, pool=None):
+    """
+    This function runs the transfer jobs of a sync on a workerPool and records the completed transfers in state
+    commit_rows at a time as they finish, so an interrupted sync keeps what it already transferred.
+    jobs:        type iter, of [<key>, <func>, <args>], where func(*args, stats) returns the
+                 [<key>, <size>, <mtime_ns>, <etag>] row to record
+    max_threads: type int, the number of worker threads
+    state:       type syncState, the database to record completed transfers in
+    op:          type str, "upload" or "download", for the trace
+    trace:       type transferTrace, optional trace to record the timing of each transfer in
+    pool:        type workerPool, a running pool to share instead of starting max_threads threads, or None
+    Returns:     List [<num_transferred>, <num_bytes>, <errors>]
+    """
+    rows = []
+    counts = [0, 0]
+    lock = threading.Lock()
+    def run_job(worker_name, key, func, args, queued_at):
+        started_at = time.perf_counter()
+        stats = {'ttfb': None, 'retries': 0}
+        try:
+            row = func(*args, stats)
+        except Exception as e:
+            if trace != None:
+                trace.record(op, key, worker_name, queued_at, started_at, 0, stats, e)
+            raise
+        if trace != None:
+            trace.record(op, key, worker_name, queued_at, started_at, row[1], stats)
+        with lock:
+            rows.append(row)
+            counts[0] += 1
+            counts[1] += row[1]
+            if len(rows) < commit_rows:
+                return
+            batch = rows[:]
+            del rows[:]
+        state.record(batch)
+    if pool == None:
+        group = workerPool(max_threads)
+    else:
+        group = jobGroup(pool, stop_on_error=False)
+    try:
+        for key, func, args in jobs:
+            queued_at = trace.queued() if trace != None else time.perf_counter()
+            group.submit(run_job, key, func, args, queued_at)
+    finally:
+        if pool == None:
+            errors = group.shutdown()
+        else:
+            errors = group.wait()
+        state.record(rows)
+    return [counts[0], counts[1], errors]
+
+def sync_upload(indir, engine, max_threads, delete=False, trace=None, pool=None):
+    """
+    This function uploads every file in indir that is new or changed since the last sync to the bucket of engine.
+    A file is unchanged if its size and mtime match the state database, in which case the bucket isn't contacted
+    at all. On the first run of a pair the bucket is listed once, and files already stored with an identical
+    MD5 are recorded instead of uploaded. With delete, the objects of removed files are deleted in batches (see
+    transferEngine.delete_keys), and keys that fail to delete are counted as failed.
+    indir:       type str, relative or absolute path to the input directory
+    engine:      type transferEngine, the transfer engine for the bucket
+    max_threads: type int, the number of worker threads
+    delete:      type bool, True to delete remote objects whose local file was removed since the last sync
+    trace:       type transferTrace, optional trace to record the timing of each transfer in
+    pool:        type workerPool, a running pool to share instead of starting max_threads threads, or None
+    Returns:     type dict, {'transferred', 'skipped', 'deleted', 'failed', 'bytes'} counts, plus 'errors', the
+                 failed transfers as returned by workerPool.shutdown()
+    """
+    state = syncState(indir, engine.bucket_path)
+    try:
+        known = state.load()
+        remote = {}
+        if len(known) == 0:
+            for item in engine.list_objects():
+                remote[item['key']] = item
+        seen = set()
+        counts = {'transferred': 0, 'skipped': 0, 'deleted': 0, 'failed': 0, 'bytes': 0}
+        bootstrapped = []
+        def upload_one(key, full_path, stats):
+            stat = os.stat(full_path)
+            result = engine.upload_object(full_path, key, stats)
+            return [key, result['size'], stat.st_mtime_ns, result['etag']]
+        def jobs():
+            for key, full_path, size, mtime_ns in scan_directory(indir):
+                seen.add(key)
+                row = known.get(key)
+                if row != None and row[0] == size and row[1] == mtime_ns:
+                    counts['skipped'] += 1
+                elif row == None and matches_remote(full_path, size, remote.get(key)):
+                    bootstrapped.append([key, size, mtime_ns, remote[key]['etag']])
+                    counts['skipped'] += 1
+                else:
+                    yield [key, upload_one, [key, full_path]]
+        counts['transferred'], counts['bytes'], errors = run_sync(jobs(), max_threads, state, 'upload', trace, pool)
+        state.record(bootstrapped)
+        if delete:
+            removed = [key for key in known if key not in seen]
+            result = engine.delete_keys(removed, max_threads, pool)
+            failed = set()
+            for key, message in result['failed']:
+                failed.add(key)
+                errors.append([[key], OSError("Delete failed: " + message), None])
+            #A key whose delete failed stays known, so the next sync tries it again
+            state.forget([key for key in removed if key not in failed])
+            counts['deleted'] = result['deleted']
+        counts['failed'] = len(errors)
+        counts['errors'] = errors
+    finally:
+        state.close()
+    return counts
+
+def sync_download(outdir, engine, max_threads, delete=False, trace=None, pool=None):
+    """
+    This function downloads every object in the bucket of engine that is new or changed since the last sync to
+    outdir. The bucket is listed once; an object is unchanged if its ETag and size match the state database and
+    the local copy still has the recorded size and mtime. On the first run of a pair, local files that already
+    have an identical MD5 are recorded instead of downloaded. Keys that would escape outdir (see
+    archive_stream.member_path) are counted as failed instead of being downloaded.
+    outdir:      type str, relative or absolute path to the output directory
+    engine:      type transferEngine, the transfer engine for the bucket
+    max_threads: type int, the number of worker threads
+    delete:      type bool, True to delete local files whose remote object was removed since the last sync
+    trace:       type transferTrace, optional trace to record the timing of each transfer in
+    pool:        type workerPool, a running pool to share instead of starting max_threads threads, or None
+    Returns:     type dict, {'transferred', 'skipped', 'deleted', 'failed', 'bytes'} counts, plus 'errors', the
+                 failed transfers as returned by workerPool.shutdown()
+    """
+    state = syncState(outdir, engine.bucket_path)
+    try:
+        known = state.load()
+        seen = set()
+        counts = {'transferred': 0, 'skipped': 0, 'deleted': 0, 'failed': 0, 'bytes': 0}
+        bootstrapped = []
+        def download_one(key, full_path, stats):
+            #Records the ETag of the version actually downloaded, which may be newer than the listing's
+            result = engine.download_object(key, full_path, stats=stats)
+            stat = os.stat(full_path)
+            return [key, result['size'], stat.st_mtime_ns, result['etag']]
+        def refuse(error, stats):
+            raise error
+        def jobs():
+            for item in engine.list_objects():
+                key = item['key']
+                if key.endswith("/"):
+                    continue
+                seen.add(key)
+                try:
+                    full_path = archive_stream.member_path(outdir, key)
+                except ValueError as e:
+                    yield [key, refuse, [e]]
+                    continue
+                try:
+                    stat = os.stat(full_path)
+                except FileNotFoundError:
+                    stat = None
+                row = known.get(key)
+                if stat != None and row != None and row[2] == item['etag'] and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                    counts['skipped'] += 1
+                elif stat != None and row == None and matches_remote(full_path, stat.st_size, item):
+                    bootstrapped.append([key, stat.st_size, stat.st_mtime_ns, item['etag']])
+                    counts['skipped'] += 1
+                else:
+                    yield [key, download_one, [key, full_path]]
+        counts['transferred'], counts['bytes'], errors = run_sync(jobs(), max_threads, state, 'download', trace, pool)
+        counts['failed'] = len(errors)
+        state.record(bootstrapped)
+        if delete:
+            removed = []
+            for key in known:
+                if key not in seen:
+                    try:
+                        os.remove(archive_stream.member_path(outdir, key))
+                    except (FileNotFoundError, ValueError):
+                        None
+                    removed.append(key)
+            state.forget(removed)
+            counts['deleted'] = len(removed)
+        counts['errors'] = errors
+    finally:
+        state.close()
+    return counts
@@ -0,0 +1,19 @@
+import os
+import sys
+import importlib.util
+import pytest
+__author__ = 'MCE123'
+
+#The modules of the tool live flat at the top of the repository
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+@pytest.fixture(scope="session")
+def processimage():
+    """
+    Returns: the main script processimage-s3-v8.py as a module, which its hyphenated name keeps from being imported
+    """
+    spec = importlib.util.spec_from_file_location("processimage", os.path.join(repo_dir, "processimage-s3-v8.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
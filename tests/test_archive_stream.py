@@ -0,0 +1,53 @@
+import io
+import os
+import pytest
+import archive_stream
+from transfer_engine import partial_suffix
+__author__ = 'MCE123'
+
+def make_files(directory, sizes):
+    files = []
+    for number, size in enumerate(sizes):
+        full_path = os.path.join(directory, "slice-z" + str(number).zfill(2) + ".bin")
+        with open(full_path, 'wb') as fout:
+            fout.write(os.urandom(size))
+        files.append([full_path, "tile/" + os.path.basename(full_path)])
+    return files
+
+def list_files(directory):
+    names = []
+    for dirName, subdirList, fileList in os.walk(directory):
+        for fname in fileList:
+            names.append(os.path.relpath(os.path.join(dirName, fname), directory))
+    return sorted(names)
+
+@pytest.mark.parametrize("codec", ["none", "gzip-1"])
+def test_extract_round_trip_in_chunks(tmp_path, monkeypatch, codec):
+    #Members several chunks long, so every member goes through its writer's queue in pieces
+    monkeypatch.setattr(archive_stream, 'extract_chunk_size', 4096)
+    files = make_files(str(tmp_path), [0, 100, 50000, 3 * 4096])
+    data = b"".join(archive_stream.tar_stream(files, codec, 2))
+    outdir = str(tmp_path / "out")
+    count_files, num_bytes = archive_stream.extract_archive(io.BytesIO(data), outdir, codec.split("-")[0])
+    assert [count_files, num_bytes] == [4, 100 + 50000 + 3 * 4096]
+    assert list_files(outdir) == sorted(os.path.join("tile", os.path.basename(path)) for path, name in files)
+    for full_path, name in files:
+        with open(full_path, 'rb') as fin, open(os.path.join(outdir, name), 'rb') as fout:
+            assert fin.read() == fout.read()
+
+def test_interrupted_extraction_leaves_no_truncated_member(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive_stream, 'extract_chunk_size', 4096)
+    files = make_files(str(tmp_path), [1000, 200000])
+    data = b"".join(archive_stream.tar_stream(files, "none", 2))
+    outdir = str(tmp_path / "out")
+    #Cut the archive in the middle of the second member
+    with pytest.raises(Exception):
+        archive_stream.extract_archive(io.BytesIO(data[:100000]), outdir, "none")
+    assert list_files(outdir) == [os.path.join("tile", "slice-z00.bin")]
+    assert not any(name.endswith(partial_suffix) for name in list_files(outdir))
+
+def test_unstreamable_archives():
+    assert archive_stream.is_unstreamable("download/orig.7z")
+    assert archive_stream.is_unstreamable("download/npy.RAR")
+    assert not archive_stream.is_unstreamable("download/orig.tar.gz")
+    assert not archive_stream.is_archive("download/orig.7z")
@@ -0,0 +1,104 @@
+import os
+import pytest
+import dedup_index
+from transfer_engine import transferEngine
+__author__ = 'MCE123'
+
+@pytest.fixture
+def engine(tmp_path):
+    bucket = tmp_path / "bucket"
+    bucket.mkdir()
+    engine = transferEngine("file://" + str(bucket) + "/", 2)
+    yield engine
+    engine.close()
+
+def write_file(path, data):
+    with open(path, 'wb') as fout:
+        fout.write(data)
+    return str(path)
+
+def test_unchanged_file_is_skipped_without_hashing(engine, tmp_path):
+    path = write_file(tmp_path / "a.bin", b"A" * 1000)
+    index = dedup_index.dedupIndex(str(tmp_path / "index.db"))
+    try:
+        assert index.upload(engine, path, "a.bin") == 1000
+        assert index.upload(engine, path, "a.bin") == 0
+        assert [index.stats['uploaded'], index.stats['skipped'], index.stats['hashed_bytes']] == [1, 1, 1000]
+    finally:
+        index.close()
+
+def test_duplicate_contents_become_a_server_side_copy(engine, tmp_path):
+    first = write_file(tmp_path / "a.bin", b"B" * 1000)
+    second = write_file(tmp_path / "b.bin", b"B" * 1000)
+    uploads = []
+    real_upload = engine.upload_object
+    def upload_object(full_path, key, stats=None, stat=None):
+        uploads.append(key)
+        return real_upload(full_path, key, stats, stat)
+    engine.upload_object = upload_object
+    index = dedup_index.dedupIndex(str(tmp_path / "index.db"))
+    try:
+        index.upload(engine, first, "a.bin")
+        assert index.upload(engine, second, "b.bin") == 0
+    finally:
+        index.close()
+    assert uploads == ["a.bin"]
+    assert index.stats['copied'] == 1
+    assert (tmp_path / "bucket" / "b.bin").read_bytes() == b"B" * 1000
+
+def test_changed_source_is_forgotten(engine, tmp_path):
+    first = write_file(tmp_path / "a.bin", b"C" * 1000)
+    second = write_file(tmp_path / "b.bin", b"C" * 1000)
+    index = dedup_index.dedupIndex(str(tmp_path / "index.db"))
+    try:
+        index.upload(engine, first, "a.bin")
+        #a.bin is overwritten outside of the index, so the conditional copy fails with a precondition error
+        engine.upload_data(b"D" * 1000, "a.bin")
+        assert index.upload(engine, second, "b.bin") == 1000
+        assert index.lookup("a.bin") == None
+    finally:
+        index.close()
+    assert (tmp_path / "bucket" / "b.bin").read_bytes() == b"C" * 1000
+
+def test_transient_copy_error_keeps_the_source(engine, tmp_path):
+    first = write_file(tmp_path / "a.bin", b"E" * 1000)
+    second = write_file(tmp_path / "b.bin", b"E" * 1000)
+    index = dedup_index.dedupIndex(str(tmp_path / "index.db"))
+    try:
+        index.upload(engine, first, "a.bin")
+        def copy_object(src_key, key, if_match=None):
+            raise OSError("SlowDown: please reduce your request rate")
+        engine.backend.copy_object = copy_object
+        assert index.upload(engine, second, "b.bin") == 1000
+        assert index.lookup("a.bin") != None
+    finally:
+        index.close()
+
+def test_manifest_is_shared_between_indexes(engine, tmp_path):
+    first = write_file(tmp_path / "a.bin", b"F" * 1000)
+    second = write_file(tmp_path / "b.bin", b"F" * 1000)
+    machine1 = dedup_index.dedupIndex(str(tmp_path / "index1.db"), "dedup-manifest.json")
+    try:
+        assert machine1.load_manifest(engine) == 0
+        machine1.upload(engine, first, "a.bin")
+        machine1.save_manifest(engine)
+    finally:
+        machine1.close()
+    machine2 = dedup_index.dedupIndex(str(tmp_path / "index2.db"), "dedup-manifest.json")
+    try:
+        assert machine2.load_manifest(engine) == 1
+        assert machine2.upload(engine, second, "b.bin") == 0
+        assert machine2.stats['copied'] == 1
+    finally:
+        machine2.close()
+
+def test_manifest_read_errors_are_raised(engine, tmp_path):
+    index = dedup_index.dedupIndex(str(tmp_path / "index.db"), "dedup-manifest.json")
+    def read_range(key, start, end=None, if_match=None):
+        raise PermissionError("AccessDenied")
+    engine.read_range = read_range
+    try:
+        with pytest.raises(PermissionError):
+            index.load_manifest(engine)
+    finally:
+        index.close()
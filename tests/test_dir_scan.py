@@ -0,0 +1,45 @@
+import os
+import dir_scan
+__author__ = 'MCE123'
+
+def make_file(path, data=b"x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fout:
+        fout.write(data)
+
+def scan(indir, max_workers=4, onerror=None):
+    return sorted([full_path, filename] for full_path, filename, stat in dir_scan.scan_files(indir, max_workers, onerror))
+
+def test_unreadable_directory_is_skipped(tmp_path, monkeypatch):
+    indir = str(tmp_path / "in")
+    for name in ["a/one.bin", "a/locked/hidden.bin", "b/two.bin", "three.bin"]:
+        make_file(os.path.join(indir, name))
+    locked = os.path.join(indir, "a", "locked")
+    real_scandir = os.scandir
+    def scandir(path):
+        #Tests run as root, where chmod 000 doesn't stop a read, so the permission error is raised here instead
+        if path == locked:
+            raise PermissionError(13, "Permission denied", path)
+        return real_scandir(path)
+    monkeypatch.setattr(os, 'scandir', scandir)
+    skipped = []
+    found = scan(indir, onerror=skipped.append)
+    assert sorted(filename for full_path, filename in found) == ["one.bin", "three.bin", "two.bin"]
+    assert [error.filename for error in skipped] == [locked]
+
+def test_nested_directories_are_found_once_under_their_full_path(tmp_path, monkeypatch):
+    #Same-named subdirectories at different depths, and a decoy "sub" in the working directory: walking a
+    #subdirectory by its bare name would pick up the decoy and yield the nested files twice
+    monkeypatch.chdir(tmp_path)
+    make_file(os.path.join("sub", "decoy.bin"))
+    expected = []
+    for name in ["in/x.bin", "in/a/sub/x.bin", "in/b/sub/x.bin", "in/b/sub/sub/y.bin"]:
+        make_file(name)
+        expected.append([name, os.path.basename(name)])
+    for max_workers in [1, 4]:
+        found = scan("in", max_workers)
+        assert found == sorted(expected)
+        for full_path, filename in found:
+            assert os.path.isfile(full_path)
+    #A second scan starts from nothing, instead of adding to the files of the first
+    assert len(scan("in")) == len(expected)
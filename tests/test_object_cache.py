@@ -0,0 +1,93 @@
+import os
+import pytest
+from object_cache import objectCache
+from transfer_engine import transferEngine
+__author__ = 'MCE123'
+
+@pytest.fixture
+def engine(tmp_path):
+    bucket = tmp_path / "bucket"
+    bucket.mkdir()
+    engine = transferEngine("file://" + str(bucket) + "/", 2)
+    yield engine
+    engine.close()
+
+def attach_cache(engine, tmp_path, max_bytes=1024 * 1024, ttl=0):
+    engine.cache = objectCache(str(tmp_path / "cache"), max_bytes, ttl)
+    return engine.cache
+
+def record_requests(engine):
+    requests = []
+    real_open_range = engine.backend.open_range
+    def open_range(key, start, end, if_match=None, if_none_match=None):
+        requests.append([key, if_none_match])
+        return real_open_range(key, start, end, if_match, if_none_match)
+    engine.backend.open_range = open_range
+    return requests
+
+def test_hit_within_ttl_skips_the_bucket(engine, tmp_path):
+    cache = attach_cache(engine, tmp_path, ttl=3600)
+    engine.upload_data(b"A" * 1000, "a.bin")
+    outdir = tmp_path / "out"
+    try:
+        assert engine.download_file("a.bin", str(outdir / "first.bin")) == 1000
+        requests = record_requests(engine)
+        assert engine.download_file("a.bin", str(outdir / "second.bin")) == 1000
+        assert requests == []
+        assert [cache.stats['hits'], cache.stats['misses'], cache.stats['bytes_saved']] == [1, 1, 1000]
+        assert (outdir / "second.bin").read_bytes() == b"A" * 1000
+    finally:
+        cache.close()
+
+def test_stale_entry_is_revalidated_with_if_none_match(engine, tmp_path):
+    cache = attach_cache(engine, tmp_path, ttl=0)
+    engine.upload_data(b"B" * 1000, "b.bin")
+    full_path = str(tmp_path / "out" / "b.bin")
+    try:
+        engine.download_file("b.bin", full_path)
+        etag = cache.lookup(engine.bucket_path, "b.bin")[0]
+        requests = record_requests(engine)
+        engine.download_file("b.bin", full_path)
+        assert requests == [["b.bin", etag]]
+        assert [cache.stats['hits'], cache.stats['revalidated']] == [1, 1]
+        #A changed object is downloaded again, replacing the local file without writing through its hardlink
+        engine.upload_data(b"C" * 1000, "b.bin")
+        engine.download_file("b.bin", full_path)
+        assert cache.stats['misses'] == 2
+        assert open(full_path, 'rb').read() == b"C" * 1000
+        assert not os.path.exists(cache.entry_path(engine.bucket_path, "b.bin", etag))
+    finally:
+        cache.close()
+
+def test_failed_revalidation_keeps_the_local_copy(engine, tmp_path):
+    cache = attach_cache(engine, tmp_path, ttl=0)
+    engine.upload_data(b"D" * 1000, "d.bin")
+    full_path = str(tmp_path / "out" / "d.bin")
+    try:
+        engine.download_file("d.bin", full_path)
+        def open_range(key, start, end, if_match=None, if_none_match=None):
+            raise OSError("connection reset")
+        engine.backend.open_range = open_range
+        with pytest.raises(OSError):
+            engine.download_file("d.bin", full_path)
+        assert open(full_path, 'rb').read() == b"D" * 1000
+    finally:
+        cache.close()
+
+def test_least_recently_used_entry_is_evicted(engine, tmp_path):
+    cache = attach_cache(engine, tmp_path, max_bytes=2500, ttl=3600)
+    outdir = tmp_path / "out"
+    try:
+        for name in ["e1.bin", "e2.bin", "e3.bin"]:
+            engine.upload_data(name.encode('ascii') * 200, name)
+        engine.download_file("e1.bin", str(outdir / "e1.bin"))
+        engine.download_file("e2.bin", str(outdir / "e2.bin"))
+        #Using e1.bin again makes e2.bin the least recently used entry
+        engine.download_file("e1.bin", str(outdir / "e1-again.bin"))
+        engine.download_file("e3.bin", str(outdir / "e3.bin"))
+        assert cache.stats['evicted'] == 1
+        assert cache.lookup(engine.bucket_path, "e2.bin") == None
+        assert cache.lookup(engine.bucket_path, "e1.bin") != None
+        assert cache.lookup(engine.bucket_path, "e3.bin") != None
+    finally:
+        cache.close()
@@ -0,0 +1,59 @@
+import os
+import sys
+import dedup_index
+import transfer_engine
+import transfer_trace
+from transfer_engine import transferEngine
+__author__ = 'MCE123'
+
+def test_download_refuses_keys_outside_outdir(processimage, tmp_path):
+    bucket = tmp_path / "bucket"
+    bucket.mkdir()
+    (bucket / "good.bin").write_bytes(b"good")
+    outdir = tmp_path / "out" / "nested"
+    outdir.mkdir(parents=True)
+    engine = transferEngine("file://" + str(bucket) + "/", 2)
+    listed = list(engine.list_objects())
+    evil_keys = ["../evil.bin", "../../evil2.bin", str(tmp_path) + "-evil3.bin"]
+    engine.list_objects = lambda prefix="": iter(listed + [{'key': key, 'size': 1, 'etag': "x"} for key in evil_keys])
+    written = []
+    real_download = engine.download_file
+    def download_file(key, full_path, stats=None):
+        #Would happily write anywhere, so only the containment check keeps the evil keys inside outdir
+        written.append(full_path)
+        if key == "good.bin":
+            return real_download(key, full_path, stats)
+        open(full_path, 'wb').close()
+        return 0
+    engine.download_file = download_file
+    try:
+        assert processimage.download(str(outdir), engine, 2) == 4
+    finally:
+        engine.close()
+    assert (outdir / "good.bin").read_bytes() == b"good"
+    assert written == [str(outdir / "good.bin")]
+    assert not (tmp_path / "out" / "evil.bin").exists()
+    assert not (tmp_path / "evil2.bin").exists()
+    assert not os.path.exists(str(tmp_path) + "-evil3.bin")
+
+def test_early_errors_close_what_main_opened(processimage, tmp_path, monkeypatch):
+    bucket = tmp_path / "bucket"
+    bucket.mkdir()
+    (bucket / "manifest.json").write_bytes(b"{not json")
+    (tmp_path / "in").mkdir()
+    monkeypatch.chdir(tmp_path)
+    closed = []
+    for cls, name in [[transfer_engine.transferEngine, 'close'], [dedup_index.dedupIndex, 'close'], [transfer_trace.progressView, 'stop']]:
+        def wrapper(self, real=getattr(cls, name), label=cls.__name__):
+            closed.append(label)
+            return real(self)
+        monkeypatch.setattr(cls, name, wrapper)
+    #A manifest that can't be merged stops main after the engine and the dedup index were opened
+    monkeypatch.setattr(sys, 'argv', ["processimage", "-b", "file://" + str(bucket) + "/", "-i", "in", "-dd", "-dm", "manifest.json"])
+    assert processimage.main() == None
+    assert sorted(closed) == ["dedupIndex", "transferEngine"]
+    #Too many arguments stops main after the progress line was started
+    del closed[:]
+    monkeypatch.setattr(sys, 'argv', ["processimage", "-b", "file://" + str(bucket) + "/", "-i", "in", "-o", "out", "-pr"])
+    assert processimage.main() == None
+    assert sorted(closed) == ["progressView", "transferEngine"]
@@ -0,0 +1,90 @@
+import os
+import pytest
+import shard_bundle
+from transfer_engine import transferEngine, partial_suffix
+__author__ = 'MCE123'
+
+@pytest.fixture
+def engine(tmp_path):
+    bucket = tmp_path / "bucket"
+    bucket.mkdir()
+    engine = transferEngine("file://" + str(bucket) + "/", 2)
+    yield engine
+    engine.close()
+
+def make_files(directory, sizes):
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for number, size in enumerate(sizes):
+        name = "sub/file" + str(number) + ".bin"
+        full_path = os.path.join(directory, "file" + str(number) + ".bin")
+        with open(full_path, 'wb') as fout:
+            fout.write(os.urandom(size))
+        files.append([full_path, name])
+    return files
+
+def upload_bundle(engine, files, shard_size):
+    shards = shard_bundle.plan_shards(files, shard_size)
+    results = []
+    for shard, members in enumerate(shards):
+        results.append(engine.upload_stream(shard_bundle.shard_chunks(members), shard_bundle.shard_key("run1", shard)))
+    engine.upload_data(shard_bundle.make_index(shards, results), shard_bundle.index_key("run1"))
+    return shards
+
+def read_file(full_path):
+    with open(full_path, 'rb') as fin:
+        return fin.read()
+
+def list_files(directory):
+    names = []
+    for dirName, subdirList, fileList in os.walk(directory):
+        for fname in fileList:
+            names.append(os.path.relpath(os.path.join(dirName, fname), directory))
+    return sorted(names)
+
+def test_bundle_round_trip(engine, tmp_path):
+    #The 5000-byte member is larger than a shard, so it gets a shard of its own
+    files = make_files(str(tmp_path / "in"), [1000, 1500, 5000, 700, 300, 1200])
+    shards = upload_bundle(engine, files, 3000)
+    assert [[name for full_path, name, size in members] for members in shards] == [
+        ["sub/file0.bin", "sub/file1.bin"], ["sub/file2.bin"], ["sub/file3.bin", "sub/file4.bin", "sub/file5.bin"]]
+    index = shard_bundle.read_index(engine, "run1")
+    assert len(index['shards']) == 3
+    outdir = str(tmp_path / "out")
+    num_bytes = 0
+    for number, shard in enumerate(index['shards']):
+        members = [member for member in index['members'] if member[1] == number]
+        num_bytes += shard_bundle.unpack_shard(engine, shard, members, outdir)
+    assert num_bytes == 9700
+    assert list_files(outdir) == sorted(os.path.join("sub", "file" + str(number) + ".bin") for number in range(6))
+    for full_path, name in files:
+        assert read_file(os.path.join(outdir, name)) == read_file(full_path)
+
+def test_coalesced_members_are_read_with_one_range(engine, tmp_path, monkeypatch):
+    files = make_files(str(tmp_path / "in"), [1000, 1500, 700, 300])
+    upload_bundle(engine, files, 10000)
+    index = shard_bundle.read_index(engine, "run1")
+    #Members 1 and 3 are close enough to share one ranged GET, which skips member 2
+    monkeypatch.setattr(shard_bundle, 'max_gap', 1024)
+    wanted = [index['members'][3], index['members'][1]]
+    groups = shard_bundle.coalesce(wanted)
+    assert groups == [[index['members'][1], index['members'][3]]]
+    ranges = []
+    real_read_range = engine.read_range
+    def read_range(key, start, end=None, if_match=None):
+        ranges.append([key, start, end, if_match])
+        return real_read_range(key, start, end, if_match)
+    engine.read_range = read_range
+    outdir = str(tmp_path / "out")
+    assert shard_bundle.read_members(engine, index['shards'][0], groups[0], outdir) == 1800
+    assert ranges == [[shard_bundle.shard_key("run1", 0), 1000, 3499, index['shards'][0][2]]]
+    assert list_files(outdir) == [os.path.join("sub", "file1.bin"), os.path.join("sub", "file3.bin")]
+    assert read_file(os.path.join(outdir, "sub", "file3.bin")) == read_file(files[3][0])
+
+def test_member_is_never_left_partial(tmp_path):
+    outdir = str(tmp_path / "out")
+    assert shard_bundle.write_member(outdir, "sub/a.bin", b"contents") == 8
+    assert list_files(outdir) == [os.path.join("sub", "a.bin")]
+    with pytest.raises(ValueError):
+        shard_bundle.write_member(outdir, "../escape.bin", b"contents")
+    assert not os.path.exists(os.path.join(outdir, "sub", "a.bin" + partial_suffix))
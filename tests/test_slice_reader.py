@@ -0,0 +1,68 @@
+import io
+import time
+import threading
+import pytest
+import slice_reader
+from transfer_engine import transferEngine
+__author__ = 'MCE123'
+
+@pytest.fixture
+def engine(tmp_path):
+    bucket = tmp_path / "bucket"
+    bucket.mkdir()
+    engine = transferEngine("file://" + str(bucket) + "/", 2)
+    yield engine
+    engine.close()
+
+def upload_npy_slices(engine, numpy, stem, z_values):
+    for z in z_values:
+        data = io.BytesIO()
+        numpy.save(data, numpy.full((4, 4), z, dtype=numpy.uint16))
+        engine.upload_data(data.getvalue(), stem + "-z" + str(z).zfill(2) + ".npy")
+
+def test_bucket_is_listed_once_per_reader(engine):
+    for key in ["run1/scan-FTC-x02-y02-z00.npy", "run1/scan-FTC-x02-y02-z01.npy", "run1/scan-FTC-x03-y02-z00.npy", "run1/notes.txt", "run2/scan-FTC-x02-y02-z05.npy"]:
+        engine.upload_data(b"slice", key)
+    listed = []
+    real_list_objects = engine.list_objects
+    def list_objects(prefix=""):
+        listed.append(prefix)
+        return real_list_objects(prefix)
+    engine.list_objects = list_objects
+    with slice_reader.sliceReader(engine.bucket_path, "run1/", engine) as reader:
+        assert sorted(reader.find_slices("x02-y02-FTC", "npy")) == [0, 1]
+        assert sorted(reader.find_slices("x03-y02-FTC", "npy")) == [0]
+        assert reader.find_slices("x02-y02-FTC", "png") == {}
+    assert listed == ["run1/"]
+
+def test_slices_are_yielded_in_z_order(engine):
+    numpy = pytest.importorskip("numpy")
+    upload_npy_slices(engine, numpy, "scan-FTC-x02-y02", [3, 0, 2, 1, 4])
+    planes = slice_reader.iter_slices(engine.bucket_path, "x02-y02-FTC", "npy", [4, 1, 2], read_ahead=2, engine=engine)
+    assert [int(plane[0, 0]) for plane in planes] == [1, 2, 4]
+    planes = slice_reader.iter_slices(engine.bucket_path, "x02-y02-FTC", "npy", engine=engine)
+    assert [int(plane[0, 0]) for plane in planes] == [0, 1, 2, 3, 4]
+    with pytest.raises(ValueError, match="no npy slices at z 7"):
+        list(slice_reader.iter_slices(engine.bucket_path, "x02-y02-FTC", "npy", [1, 7], engine=engine))
+
+def test_read_ahead_window(engine):
+    numpy = pytest.importorskip("numpy")
+    upload_npy_slices(engine, numpy, "scan-FTC-x02-y02", range(10))
+    started = []
+    lock = threading.Lock()
+    real_read_range = engine.read_range
+    def read_range(key, start, end=None, if_match=None):
+        with lock:
+            started.append(key)
+        return real_read_range(key, start, end, if_match)
+    engine.read_range = read_range
+    read_ahead = 3
+    received = 0
+    for plane in slice_reader.iter_slices(engine.bucket_path, "x02-y02-FTC", "npy", read_ahead=read_ahead, engine=engine):
+        received += 1
+        #While the consumer holds a slice, the next read_ahead - 1 are fetched in the background, and no more
+        deadline = time.time() + 5
+        while len(started) < min(10, received + read_ahead - 1) and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(started) == min(10, received + read_ahead - 1)
+    assert received == 10
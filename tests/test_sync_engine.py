@@ -0,0 +1,116 @@
+import os
+import sync_engine
+from transfer_engine import transferEngine
+__author__ = 'MCE123'
+
+def make_tree(indir, count):
+    os.makedirs(os.path.join(indir, "sub"), exist_ok=True)
+    for number in range(count):
+        with open(os.path.join(indir, "sub", "f" + str(number)), 'wb') as fout:
+            fout.write(b"contents of file " + str(number).encode('ascii'))
+
+def open_engine(tmp_path):
+    bucket = tmp_path / "bucket"
+    bucket.mkdir(exist_ok=True)
+    return transferEngine("file://" + str(bucket) + "/", 4)
+
+def count_calls(engine, name):
+    calls = []
+    real = getattr(engine, name)
+    def wrapper(*args, **kwargs):
+        calls.append(args[1] if len(args) > 1 else args[0])
+        return real(*args, **kwargs)
+    setattr(engine, name, wrapper)
+    return calls
+
+def test_unchanged_files_are_skipped(tmp_path):
+    indir = str(tmp_path / "in")
+    make_tree(indir, 5)
+    engine = open_engine(tmp_path)
+    try:
+        counts = sync_engine.sync_upload(indir, engine, 4)
+        assert [counts['transferred'], counts['skipped'], counts['failed']] == [5, 0, 0]
+        uploads = count_calls(engine, 'upload_object')
+        counts = sync_engine.sync_upload(indir, engine, 4)
+        assert [counts['transferred'], counts['skipped']] == [0, 5]
+        assert uploads == []
+        with open(os.path.join(indir, "sub", "f3"), 'ab') as fout:
+            fout.write(b" changed")
+        counts = sync_engine.sync_upload(indir, engine, 4)
+        assert [counts['transferred'], counts['skipped']] == [1, 4]
+        assert uploads == ["sub/f3"]
+    finally:
+        engine.close()
+    assert (tmp_path / "bucket" / "sub" / "f3").read_bytes() == b"contents of file 3 changed"
+
+def test_first_sync_records_identical_remote_files(tmp_path):
+    indir = str(tmp_path / "in")
+    make_tree(indir, 4)
+    engine = open_engine(tmp_path)
+    try:
+        for key in ["sub/f0", "sub/f1"]:
+            engine.upload_object(os.path.join(indir, key), key)
+        engine.upload_data(b"other contents", "sub/f2")
+        uploads = count_calls(engine, 'upload_object')
+        counts = sync_engine.sync_upload(indir, engine, 4)
+        assert [counts['transferred'], counts['skipped']] == [2, 2]
+        assert sorted(uploads) == ["sub/f2", "sub/f3"]
+        state = sync_engine.syncState(indir, engine.bucket_path)
+        try:
+            assert sorted(state.load()) == ["sub/f0", "sub/f1", "sub/f2", "sub/f3"]
+        finally:
+            state.close()
+    finally:
+        engine.close()
+
+def test_delete_forgets_only_deleted_keys(tmp_path):
+    indir = str(tmp_path / "in")
+    make_tree(indir, 4)
+    engine = open_engine(tmp_path)
+    try:
+        sync_engine.sync_upload(indir, engine, 4)
+        for number in [1, 2]:
+            os.remove(os.path.join(indir, "sub", "f" + str(number)))
+        real_delete = engine.backend.delete_objects
+        def delete_objects(keys):
+            #sub/f2 can't be deleted this time
+            return real_delete([key for key in keys if key != "sub/f2"]) + [[key, "AccessDenied"] for key in keys if key == "sub/f2"]
+        engine.backend.delete_objects = delete_objects
+        counts = sync_engine.sync_upload(indir, engine, 4, delete=True)
+        assert [counts['deleted'], counts['failed']] == [1, 1]
+        assert str(counts['errors'][0][0][0]) == "sub/f2"
+        assert not (tmp_path / "bucket" / "sub" / "f1").exists()
+        assert (tmp_path / "bucket" / "sub" / "f2").exists()
+        engine.backend.delete_objects = real_delete
+        #The failed key is still known, so the next sync deletes it
+        counts = sync_engine.sync_upload(indir, engine, 4, delete=True)
+        assert [counts['deleted'], counts['failed']] == [1, 0]
+        assert not (tmp_path / "bucket" / "sub" / "f2").exists()
+    finally:
+        engine.close()
+
+def test_completed_transfers_are_committed_during_the_run(tmp_path, monkeypatch):
+    indir = str(tmp_path / "in")
+    make_tree(indir, 7)
+    monkeypatch.setattr(sync_engine, 'commit_rows', 2)
+    engine = open_engine(tmp_path)
+    committed = []
+    real_upload = engine.upload_object
+    def upload_object(full_path, key, stats=None, stat=None):
+        #Reads the state database through a connection of its own, like a rerun after a crash would
+        state = sync_engine.syncState(indir, engine.bucket_path)
+        try:
+            committed.append(len(state.load()))
+        finally:
+            state.close()
+        if key == "sub/f6":
+            raise OSError("interrupted")
+        return real_upload(full_path, key, stats, stat)
+    engine.upload_object = upload_object
+    try:
+        counts = sync_engine.sync_upload(indir, engine, 1)
+    finally:
+        engine.close()
+    assert [counts['transferred'], counts['failed']] == [6, 1]
+    #With one worker, the uploads before the last one were committed in pairs while the run went on
+    assert committed == [0, 0, 2, 2, 4, 4, 6]
@@ -0,0 +1,188 @@
+import os
+import hashlib
+import threading
+import pytest
+import transfer_engine
+from transfer_engine import transferEngine, multipart_dir, partial_suffix
+__author__ = 'MCE123'
+
+part_size = 64 * 1024             #Small parts, so a file of a few hundred KB is a multipart upload and a ranged download.
+
+class flakyBackend:
+    """
+    This class defines a wrapper around a localBackend that fails chosen calls, to inject transfer failures.
+    To Call: flakyBackend(backend, fail_part, failures)
+    Whereas: backend:   the localBackend to wrap
+             fail_part: type int, the part number whose upload_part calls fail
+             failures:  type int, how many times it fails before it succeeds, or -1 for always
+    """
+    def __init__(self, backend, fail_part, failures):
+        self.backend = backend
+        self.fail_part = fail_part
+        self.failures = failures
+        self.calls = []
+        self.aborted = []
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def upload_part(self, key, upload_id, part_number, data):
+        with self.lock:
+            self.calls.append(part_number)
+            if part_number == self.fail_part and self.failures != 0:
+                self.failures -= 1
+                raise OSError("Injected failure of part " + str(part_number))
+        return self.backend.upload_part(key, upload_id, part_number, data)
+
+    def abort_multipart(self, key, upload_id):
+        self.aborted.append(upload_id)
+        return self.backend.abort_multipart(key, upload_id)
+
+class rangeCounter:
+    """
+    This class defines a wrapper around a localBackend that records every ranged GET, calling before_range(start)
+    first if it is set.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.ranges = []
+        self.before_range = None
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def open_range(self, key, start, end, if_match=None, if_none_match=None):
+        with self.lock:
+            self.ranges.append([start, end, if_match])
+        if self.before_range != None:
+            self.before_range(start)
+        return self.backend.open_range(key, start, end, if_match, if_none_match)
+
+def make_engine(tmp_path):
+    engine = transferEngine("file://" + str(tmp_path / "bucket") + "/", 4, part_size, 4, part_size)
+    engine.part_retries = 2
+    return engine
+
+def make_file(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+def composite_etag(data):
+    digests = b"".join(hashlib.md5(data[start:start + part_size]).digest() for start in range(0, len(data), part_size))
+    return hashlib.md5(digests).hexdigest() + "-" + str(-(-len(data) // part_size))
+
+def test_multipart_round_trip(tmp_path):
+    engine = make_engine(tmp_path)
+    engine.verify = True
+    full_path = make_file(tmp_path, "big.bin", 5 * part_size + 123)
+    data = open(full_path, 'rb').read()
+    try:
+        result = engine.upload_object(full_path, "dir/big.bin")
+        assert result['size'] == len(data)
+        assert result['etag'] == composite_etag(data)
+        assert engine.head_object("dir/big.bin")['etag'] == result['etag']
+        stats = {'ttfb': None, 'retries': 0}
+        out_path = str(tmp_path / "out" / "big.bin")
+        assert engine.download_file("dir/big.bin", out_path, stats) == len(data)
+        assert open(out_path, 'rb').read() == data
+        assert stats['verified'] == True
+    finally:
+        engine.close()
+    assert os.listdir(str(tmp_path / "bucket" / multipart_dir)) == []
+
+def test_part_retry_after_failure(tmp_path):
+    engine = make_engine(tmp_path)
+    engine.backend = flakyBackend(engine.backend, 3, 1)
+    full_path = make_file(tmp_path, "big.bin", 4 * part_size)
+    stats = {'ttfb': None, 'retries': 0}
+    try:
+        result = engine.upload_object(full_path, "big.bin", stats)
+    finally:
+        engine.close()
+    assert stats['retries'] == 1
+    assert engine.backend.calls.count(3) == 2
+    assert engine.backend.aborted == []
+    assert result['etag'] == composite_etag(open(full_path, 'rb').read())
+    assert open(str(tmp_path / "bucket" / "big.bin"), 'rb').read() == open(full_path, 'rb').read()
+
+def test_abort_on_failure(tmp_path):
+    engine = make_engine(tmp_path)
+    engine.backend = flakyBackend(engine.backend, 2, -1)
+    full_path = make_file(tmp_path, "big.bin", 4 * part_size)
+    stats = {'ttfb': None, 'retries': 0}
+    try:
+        with pytest.raises(OSError, match="Injected failure"):
+            engine.upload_object(full_path, "big.bin", stats)
+    finally:
+        engine.close()
+    assert engine.backend.calls.count(2) == engine.part_retries + 1
+    assert len(engine.backend.aborted) == 1
+    assert not os.path.exists(str(tmp_path / "bucket" / "big.bin"))
+    assert os.listdir(str(tmp_path / "bucket" / multipart_dir)) == []
+
+def test_map_closed_when_submit_fails(tmp_path, monkeypatch):
+    engine = make_engine(tmp_path)
+    full_path = make_file(tmp_path, "big.bin", 4 * part_size)
+    closed = []
+    real_close_map = transfer_engine.close_map
+    def close_map(source):
+        closed.append(source)
+        return real_close_map(source)
+    monkeypatch.setattr(transfer_engine, 'close_map', close_map)
+    real_submit = transfer_engine.jobGroup.submit
+    def submit(group, func, *args):
+        #The third part is interrupted while it is queued, like a KeyboardInterrupt would
+        if args[3] == 3:
+            raise KeyboardInterrupt()
+        return real_submit(group, func, *args)
+    monkeypatch.setattr(transfer_engine.jobGroup, 'submit', submit)
+    try:
+        with pytest.raises(KeyboardInterrupt):
+            engine.upload_object(full_path, "big.bin")
+    finally:
+        engine.close()
+    assert len(closed) == 1
+    assert closed[0].closed
+
+def test_ranged_download_reassembly(tmp_path):
+    data = os.urandom(6 * part_size + 7)
+    bucket = tmp_path / "bucket"
+    bucket.mkdir()
+    (bucket / "big.bin").write_bytes(data)
+    engine = make_engine(tmp_path)
+    engine.backend = rangeCounter(engine.backend)
+    out_path = str(tmp_path / "out.bin")
+    try:
+        result = engine.download_object("big.bin", out_path)
+    finally:
+        engine.close()
+    assert result['size'] == len(data)
+    assert open(out_path, 'rb').read() == data
+    assert not os.path.exists(out_path + partial_suffix)
+    ranges = sorted(engine.backend.ranges)
+    assert [start for start, end, if_match in ranges] == list(range(0, len(data), part_size))
+    #Every range after the first is conditional on the ETag of the first response
+    assert all(if_match == hashlib.md5(data).hexdigest() for start, end, if_match in ranges[1:])
+
+def test_ranged_download_fails_if_object_changes(tmp_path):
+    data = os.urandom(3 * part_size)
+    bucket = tmp_path / "bucket"
+    bucket.mkdir()
+    (bucket / "big.bin").write_bytes(data)
+    engine = make_engine(tmp_path)
+    engine.backend = rangeCounter(engine.backend)
+    def replace_object(start):
+        if start > 0:
+            (bucket / "big.bin").write_bytes(os.urandom(3 * part_size))
+    engine.backend.before_range = replace_object
+    out_path = str(tmp_path / "out.bin")
+    try:
+        with pytest.raises(OSError, match="Precondition failed"):
+            engine.download_object("big.bin", out_path)
+    finally:
+        engine.close()
+    assert not os.path.exists(out_path)
+    assert not os.path.exists(out_path + partial_suffix)
@@ -0,0 +1,65 @@
+import os
+import sys
+import subprocess
+from transfer_engine import transferEngine, multipart_dir
+from transfer_journal import transferJournal
+__author__ = 'MCE123'
+
+part_size = 64 * 1024             #Small parts, so a file of a few hundred KB is a multipart upload.
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#Uploads with one part at a time, and kills the whole process without any cleanup when part kill_part starts
+killed_upload = """
+import os
+import sys
+sys.path.insert(0, sys.argv[1])
+from transfer_engine import transferEngine
+from transfer_journal import transferJournal
+bucket_path, journal_file, full_path, part_size, kill_part = sys.argv[2:7]
+engine = transferEngine(bucket_path, 2, int(part_size), 1, int(part_size))
+engine.journal = transferJournal(journal_file)
+real_upload_part = engine.backend.upload_part
+def upload_part(key, upload_id, part_number, data):
+    if part_number == int(kill_part):
+        os._exit(9)
+    return real_upload_part(key, upload_id, part_number, data)
+engine.backend.upload_part = upload_part
+engine.upload_object(full_path, "big.bin")
+"""
+
+def test_resumed_upload_sends_only_missing_parts(tmp_path):
+    bucket_path = "file://" + str(tmp_path / "bucket") + "/"
+    journal_file = str(tmp_path / "journal.db")
+    full_path = str(tmp_path / "big.bin")
+    with open(full_path, 'wb') as fout:
+        fout.write(os.urandom(6 * part_size + 100))
+    run = subprocess.run([sys.executable, "-c", killed_upload, repo_dir, bucket_path, journal_file, full_path, str(part_size), "4"])
+    assert run.returncode == 9
+    assert not os.path.exists(str(tmp_path / "bucket" / "big.bin"))
+    engine = transferEngine(bucket_path, 2, part_size, 1, part_size)
+    engine.journal = transferJournal(journal_file, resume=True)
+    sent = []
+    real_upload_part = engine.backend.upload_part
+    def upload_part(key, upload_id, part_number, data):
+        sent.append(part_number)
+        return real_upload_part(key, upload_id, part_number, data)
+    engine.backend.upload_part = upload_part
+    def create_multipart(key):
+        raise AssertionError("The interrupted multipart upload should have been continued")
+    engine.backend.create_multipart = create_multipart
+    try:
+        result = engine.upload_object(full_path, "big.bin")
+    finally:
+        engine.journal.close()
+        engine.close()
+    assert sorted(sent) == [4, 5, 6, 7]
+    assert result['size'] == 6 * part_size + 100
+    with open(full_path, 'rb') as fin:
+        assert (tmp_path / "bucket" / "big.bin").read_bytes() == fin.read()
+    assert os.listdir(str(tmp_path / "bucket" / multipart_dir)) == []
+    #The completed upload is forgotten, so nothing is left to resume
+    journal = transferJournal(journal_file, resume=True)
+    try:
+        assert journal.find_upload("big.bin", result['size'], os.stat(full_path).st_mtime_ns, part_size) == None
+    finally:
+        journal.close()
@@ -0,0 +1,69 @@
+import os
+import pytest
+import zstack_volume
+from transfer_engine import transferEngine
+__author__ = 'MCE123'
+
+slice_size = 100 * 1024           #Larger than zstack_volume.index_probe_size, so reading a slice takes a second ranged GET.
+
+@pytest.fixture
+def engine(tmp_path):
+    bucket = tmp_path / "bucket"
+    bucket.mkdir()
+    engine = transferEngine("file://" + str(bucket) + "/", 2)
+    yield engine
+    engine.close()
+
+def make_slices(directory, stem, z_values):
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for z in z_values:
+        filename = stem + "-z" + str(z).zfill(2) + ".tiff"
+        full_path = os.path.join(directory, filename)
+        with open(full_path, 'wb') as fout:
+            fout.write(os.urandom(slice_size))
+        files.append([full_path, filename])
+    return files
+
+def read_file(full_path):
+    with open(full_path, 'rb') as fin:
+        return fin.read()
+
+def upload_volume(engine, files):
+    volumes, others = zstack_volume.group_slices(files)
+    assert others == []
+    [[key, slices]] = volumes.items()
+    engine.upload_stream(zstack_volume.volume_chunks(slices), key)
+    return key
+
+def test_volume_round_trip(engine, tmp_path):
+    #Slices are packed in z order whatever order they are found in
+    files = make_slices(str(tmp_path / "in"), "scan-FTC-x02-y02", [2, 0, 3, 1])
+    key = upload_volume(engine, files)
+    assert key == "scan-FTC-x02-y02-tiff" + zstack_volume.volume_extension
+    slices = zstack_volume.read_volume(engine, key)
+    assert [[filename, z] for filename, z, data in slices] == [["scan-FTC-x02-y02-z0" + str(z) + ".tiff", z] for z in range(4)]
+    outdir = str(tmp_path / "out")
+    assert zstack_volume.write_slices(slices, outdir) == 4 * slice_size
+    for full_path, filename in files:
+        assert read_file(os.path.join(outdir, filename)) == read_file(full_path)
+
+def test_ranged_read_of_one_slice(engine, tmp_path):
+    files = make_slices(str(tmp_path / "in"), "scan-FTC-x02-y02", range(5))
+    key = upload_volume(engine, files)
+    ranges = []
+    real_read_range = engine.read_range
+    def read_range(key, start, end=None, if_match=None):
+        ranges.append([start, end, if_match])
+        return real_read_range(key, start, end, if_match)
+    engine.read_range = read_range
+    slices = zstack_volume.read_volume(engine, key, 3, 3)
+    assert [[filename, z] for filename, z, data in slices] == [["scan-FTC-x02-y02-z03.tiff", 3]]
+    assert slices[0][2] == read_file(files[3][0])
+    #One probe for the index, then only slice 3's bytes, conditional on the volume's ETag
+    assert len(ranges) == 2
+    assert ranges[1][1] - ranges[1][0] + 1 == slice_size
+    assert ranges[1][2] == engine.head_object(key)['etag']
+    slices = zstack_volume.read_volume(engine, key, 1, 2)
+    assert [z for filename, z, data in slices] == [1, 2]
+    assert zstack_volume.read_volume(engine, key, 7, 9) == []
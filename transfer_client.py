@@ -0,0 +1,192 @@
+import os
+import threading
+import time
+from transfer_engine import transferEngine, default_connections, default_part_size, default_max_parts, default_threshold
+from worker_pool import workerPool, jobGroup
+import sync_engine
+import dir_scan
+import archive_stream
+__author__ = 'MCE123'
+
+class transferClient:
+    """
+    This class defines the importable interface of the transfer tool, for pipelines that drive it from a
+    long-running Python process instead of starting the script once per batch. The client owns one transferEngine
+    (and with it one connection pool and one pool of part workers) and one workerPool for the whole life of the
+    process, so every batch reuses the same threads and open connections. Batches may be run from several
+    threads at once, they then share the workers.
+    Nothing is printed. Every method returns a dict:
+      - upload, upload_files and download: {'transferred', 'bytes', 'failed'}
+      - sync_upload and sync_download:     {'transferred', 'skipped', 'deleted', 'bytes', 'failed'}
+      - purge and purge_all:               {'deleted', 'failed'}
+    where failed is a list of [<key>, <error message>] and the others are counts. A failed transfer never stops
+    the rest of its batch.
+    Example: with transferClient("s3://comp821-m1.spring2018/", 16) as client:
+                 result = client.upload_files(["./x02-y02-FTC/pre_exp_scan_r1-FTC-x02-y02-z00.tiff"])
+    To Call: transferClient(bucket_path, max_threads, part_size, max_parts, threshold, trace)
+    Whereas: bucket_path: type str, "s3://bucket-name/" or "file://directory/"
+             max_threads: type int, the number of objects transferred at once
+             part_size:   type int, size in bytes of each part of a large object
+             max_parts:   type int, number of parts of large objects in flight at once
+             threshold:   type int, size in bytes above which uploads are split into parts
+             trace:       type transferTrace, to record the timing of every transfer in, or None
+    """
+    def __init__(self, bucket_path, max_threads=default_connections, part_size=default_part_size, max_parts=default_max_parts,
+                 threshold=default_threshold, trace=None):
+        if not bucket_path.endswith("/"):
+            bucket_path = bucket_path + "/"
+        self.engine = transferEngine(bucket_path, max_threads, part_size, max_parts, threshold)
+        self.engine.trace = trace
+        self.max_threads = max_threads
+        self.pool = workerPool(max_threads, name="Client")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+        return False
+
+    def close(self):
+        """
+        Stops the workers and the part workers of the engine. Returns: None
+        """
+        self.pool.shutdown()
+        self.engine.close()
+        return None
+
+    def run_batch(self, op, jobs):
+        """
+        This function runs one batch of transfers on the shared workerPool and waits for all of them.
+        op:      type str, "upload" or "download", for the trace
+        jobs:    type iter, of [<key>, <func>, <args>], where func(*args, stats) returns the bytes transferred
+        Returns: type dict, {'transferred', 'bytes', 'failed'}
+        """
+        trace = self.engine.trace
+        result = {'transferred': 0, 'bytes': 0, 'failed': []}
+        lock = threading.Lock()
+        def run_job(worker_name, key, func, args, queued_at):
+            started_at = time.perf_counter()
+            stats = {'ttfb': None, 'retries': 0}
+            try:
+                num_bytes = func(*args, stats)
+            except Exception as e:
+                if trace != None:
+                    trace.record(op, key, worker_name, queued_at, started_at, 0, stats, e)
+                raise
+            if trace != None:
+                trace.record(op, key, worker_name, queued_at, started_at, num_bytes, stats)
+            with lock:
+                result['transferred'] += 1
+                result['bytes'] += num_bytes
+        group = jobGroup(self.pool, stop_on_error=False)
+        try:
+            for key, func, args in jobs:
+                queued_at = trace.queued() if trace != None else time.perf_counter()
+                group.submit(run_job, key, func, args, queued_at)
+        finally:
+            errors = group.wait()
+        for job_args, error, traceback in errors:
+            result['failed'].append([job_args[0], repr(error)])
+        return result
+
+    def upload_one(self, full_path, key, stat, stats):
+        return self.engine.upload_file(full_path, key, stats, stat)
+
+    def download_one(self, key, outdir, stats):
+        #Keys come from the bucket, so one that would escape outdir fails instead of being written outside it
+        return self.engine.download_file(key, archive_stream.member_path(outdir, key), stats)
+
+    def upload(self, indir):
+        """
+        Uploads every file in indir and its subdirectories, each to the key of its file name, while the directory
+        is still being scanned (see dir_scan.py). Subdirectories that can't be read are skipped and listed in 'failed'.
+        Returns: type dict, {'transferred', 'bytes', 'failed'}
+        """
+        if not os.path.isdir(indir):
+            raise ValueError(indir + " is not a directory")
+        skipped = []
+        def jobs():
+            for full_path, filename, stat in dir_scan.scan_files(indir, onerror=skipped.append):
+                yield [filename, self.upload_one, [full_path, filename, stat]]
+        result = self.run_batch('upload', jobs())
+        #Directories the scan couldn't read are reported as failures under their path
+        for error in skipped:
+            result['failed'].append([error.filename, repr(error)])
+        return result
+
+    def upload_files(self, paths, keys=None):
+        """
+        Uploads each local file of paths, to the key of its file name like an upload#.test file, or to the key
+        at the same position in keys.
+        Returns: type dict, {'transferred', 'bytes', 'failed'}
+        """
+        if keys == None:
+            keys = [os.path.basename(full_path) for full_path in paths]
+        def jobs():
+            for full_path, key in zip(paths, keys):
+                yield [key, self.upload_one, [full_path, key, None]]
+        return self.run_batch('upload', jobs())
+
+    def download(self, outdir, keys=None):
+        """
+        Downloads each key of keys to the same relative path in outdir, or every object of the bucket, listed page
+        by page while the downloads run, if keys is None. Keys that would escape outdir (see
+        archive_stream.member_path) fail instead of being downloaded.
+        Returns: type dict, {'transferred', 'bytes', 'failed'}
+        """
+        def jobs():
+            if keys == None:
+                listing = (item['key'] for item in self.engine.list_objects() if not item['key'].endswith("/"))
+            else:
+                listing = keys
+            for key in listing:
+                yield [key, self.download_one, [key, outdir]]
+        return self.run_batch('download', jobs())
+
+    def sync_upload(self, indir, delete=False):
+        """
+        Uploads the files of indir that are new or changed since the last sync (see sync_engine.py), deleting the
+        objects of files removed since if delete is True.
+        Returns: type dict, {'transferred', 'skipped', 'deleted', 'bytes', 'failed'}
+        """
+        counts = sync_engine.sync_upload(indir, self.engine, self.max_threads, delete, self.engine.trace, self.pool)
+        return self.sync_result(counts)
+
+    def sync_download(self, outdir, delete=False):
+        """
+        Downloads the objects that are new or changed since the last sync to outdir (see sync_engine.py), deleting
+        the local files of objects removed since if delete is True.
+        Returns: type dict, {'transferred', 'skipped', 'deleted', 'bytes', 'failed'}
+        """
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir, exist_ok=True)
+        counts = sync_engine.sync_download(outdir, self.engine, self.max_threads, delete, self.engine.trace, self.pool)
+        return self.sync_result(counts)
+
+    def sync_result(self, counts):
+        failed = []
+        for job_args, error, traceback in counts['errors']:
+            failed.append([job_args[0], repr(error)])
+        return {'transferred': counts['transferred'], 'skipped': counts['skipped'], 'deleted': counts['deleted'],
+                'bytes': counts['bytes'], 'failed': failed}
+
+    def purge(self, keys):
+        """
+        Deletes every key of keys from the bucket, in batched delete requests.
+        Returns: type dict, {'deleted', 'failed'}
+        """
+        return self.engine.delete_keys(keys, self.max_threads, self.pool)
+
+    def purge_all(self, confirm_bucket_path):
+        """
+        Deletes every object of the bucket. Like -pa, the bucket path must be given again as confirm_bucket_path,
+        so a client for the wrong bucket can't be purged by mistake.
+        Returns: type dict, {'deleted', 'failed'}
+        """
+        if confirm_bucket_path != self.engine.bucket_path:
+            raise ValueError("To purge all files, confirm with the bucket path " + self.engine.bucket_path + ", got " + str(confirm_bucket_path))
+        def list_keys():
+            for item in self.engine.list_objects():
+                yield item['key']
+        return self.engine.delete_keys(list_keys(), self.max_threads, self.pool)
@@ -0,0 +1,1366 @@
+import os
+import mmap
+import shutil
+import hashlib
+import threading
+import time
+import uuid
+import queue
+import collections
+from worker_pool import workerPool, jobGroup
+__author__ = 'MCE123'
+
+try:
+    import boto3
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+    Config = None
+    ClientError = None
+
+chunk_size = 1024 * 1024          #Size of each read/write while streaming an object to or from a backend.
+default_connections = 10          #Default size of the shared connection pool if not specified.
+default_part_size = 8 * 1024 * 1024   #Default size of each byte range when a large object is split into parts.
+default_max_parts = 8             #Default number of parts of large objects that may be in flight at once.
+default_threshold = 16 * 1024 * 1024  #Default size above which files are uploaded as multipart uploads.
+default_part_retries = 3          #Default number of times a failed part is retried before the whole upload is aborted.
+list_page_size = 1000             #Number of keys per listing page, the maximum S3 returns per request.
+list_prefetch_pages = 2           #Number of listing pages fetched ahead of the consumer.
+delete_batch_size = 1000          #Number of keys per multi-object delete request, the maximum S3 accepts.
+multipart_dir = ".multipart"      #Directory inside a localBackend root where in-progress multipart uploads are staged.
+etag_dir = ".etags"               #Directory inside a localBackend root keeping the ETags of objects assembled from parts.
+partial_suffix = ".partial"       #Suffix of the temporary name a download is written to until it is complete.
+
+def parse_bucket_path(bucket_path):
+    """
+    This function splits a bucket path into its scheme, location and key prefix.
+    bucket_path: type str, either an S3 bucket path in the format "s3://bucket-name/optional/prefix/",
+                 or a local directory in the format "file://relative/or/absolute/path/"
+    Returns:     List [<scheme>, <location>, <prefix>]
+                 <scheme>:   "s3" or "file"
+                 <location>: the bucket name for "s3", or the directory path for "file"
+                 <prefix>:   the key prefix inside an S3 bucket (always "" for "file")
+    """
+    if bucket_path.startswith("s3://"):
+        path = bucket_path[len("s3://"):]
+        bucket_name, _, prefix = path.partition("/")
+        if prefix != "" and not prefix.endswith("/"):
+            prefix = prefix + "/"
+        return ["s3", bucket_name, prefix]
+    elif bucket_path.startswith("file://"):
+        return ["file", bucket_path[len("file://"):], ""]
+    else:
+        raise ValueError("Unsupported bucket path: " + bucket_path + " (expected s3://bucket-name/ or file://directory/)")
+
+def get_backend(bucket_path, max_connections=default_connections):
+    """
+    This function creates the storage backend that matches bucket_path.
+    bucket_path:     type str, see parse_bucket_path
+    max_connections: type int, the size of the shared connection pool (ignored by the local backend)
+    Returns:         a localBackend or s3Backend object
+    """
+    scheme, location, prefix = parse_bucket_path(bucket_path)
+    if scheme == "s3":
+        return s3Backend(location, prefix, max_connections)
+    return localBackend(location)
+
+def file_md5(full_path):
+    """
+    This function computes the hex MD5 digest of the file at full_path, reading it chunk_size bytes at a time.
+    full_path: type str, relative or absolute path to the file
+    Returns:   type str, hex digest
+    """
+    md5 = hashlib.md5()
+    fin = open(full_path, 'rb')
+    try:
+        data = fin.read(chunk_size)
+        while data:
+            md5.update(data)
+            data = fin.read(chunk_size)
+    finally:
+        fin.close()
+    return md5.hexdigest()
+
+def close_map(source):
+    """
+    This function closes the memory map source, unless a backend still holds a view of it, in which case it is
+    closed when the last view is released. Returns: None
+    """
+    try:
+        source.close()
+    except BufferError:
+        pass
+    return None
+
+def copy_stream(fin, fout, digest=None):
+    """
+    This function copies fin to fout, chunk_size bytes at a time.
+    fin:     a readable binary file-like object
+    fout:    a writable binary file-like object
+    digest:  optional hashlib object, updated with every chunk as it is copied
+    Returns: type int, number of bytes copied
+    """
+    num_bytes = 0
+    data = fin.read(chunk_size)
+    while data:
+        fout.write(data)
+        if digest != None:
+            digest.update(data)
+        num_bytes += len(data)
+        data = fin.read(chunk_size)
+    return num_bytes
+
+class rangeReader:
+    """
+    This class defines a read-only file-like object over bytes [start, start + length) of an open file,
+    so local byte ranges can be streamed exactly like the body of a ranged S3 GET.
+    To Call: rangeReader(fin, start, length)
+    Whereas: fin:    a readable binary file object, which rangeReader takes ownership of and closes
+             start:  type int, offset of the first byte
+             length: type int, number of bytes to expose
+    """
+    def __init__(self, fin, start, length):
+        self.fin = fin
+        self.remaining = length
+        self.fin.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fin.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fin.close()
+
+class streamChecksum:
+    """
+    This class defines the MD5 of the bytes of a stream as it is sent, which starts over when the stream is rewound
+    to its start, e.g. when botocore reads a request body once to size it and again to send it.
+    To Call: streamChecksum()
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.md5 = hashlib.md5()
+        self.num_bytes = 0
+
+    def update(self, data):
+        self.md5.update(data)
+        self.num_bytes += len(data)
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+class hashingReader:
+    """
+    This class defines a file-like object that passes reads through to fin and feeds every byte read in order from
+    the start into checksum, so a request body is hashed on the same buffers that are sent.
+    To Call: hashingReader(fin, checksum)
+    Whereas: fin:      a readable, seekable binary file object
+             checksum: type streamChecksum, the checksum to feed
+    """
+    def __init__(self, fin, checksum):
+        self.fin = fin
+        self.checksum = checksum
+        self.pos = fin.tell()
+
+    def read(self, size=-1):
+        data = self.fin.read(size)
+        if self.pos == self.checksum.num_bytes:
+            self.checksum.update(data)
+        self.pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        self.pos = self.fin.seek(offset, whence)
+        if self.pos == 0:
+            self.checksum.reset()
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def __getattr__(self, name):
+        return getattr(self.fin, name)
+
+class preconditionFailed(OSError):
+    """
+    This class defines the error of a conditional request whose object no longer has the expected ETag, the
+    local equivalent of an HTTP 412 from S3.
+    """
+
+def error_code(error):
+    """
+    Returns: type str, the S3 error code of a ClientError, e.g. "NoSuchKey", or None for other exceptions
+    """
+    if ClientError == None or not isinstance(error, ClientError):
+        return None
+    return str(error.response.get('Error', {}).get('Code'))
+
+def is_not_found(error):
+    """
+    Returns: True if error means the object doesn't exist (a 404 from S3, a missing file locally)
+    """
+    return isinstance(error, FileNotFoundError) or error_code(error) in ['404', 'NoSuchKey', 'NotFound']
+
+def is_precondition_failed(error):
+    """
+    Returns: True if error means a conditional request failed because the object changed (a 412)
+    """
+    return isinstance(error, preconditionFailed) or error_code(error) in ['412', 'PreconditionFailed']
+
+def is_md5_etag(etag):
+    """
+    Returns: True if etag is the plain MD5 of the object's contents, as for objects uploaded with a single PUT
+    """
+    return len(etag) == 32 and "-" not in etag
+
+def first_response(stats, started_at):
+    """
+    Stores the time since started_at in stats['ttfb'], if stats is a dict and no earlier response of the same
+    transfer was timed. Returns: None
+    """
+    if stats != None and stats.get('ttfb') == None:
+        stats['ttfb'] = time.perf_counter() - started_at
+    return None
+
+def multipart_size(size, part_size, min_part_size):
+    """
+    Returns: type int, the size of each part of a multipart upload of size bytes. S3 allows at most 10000 parts,
+             and every part but the last must be at least min_part_size
+    """
+    return max(part_size, min_part_size, -(-size // 10000))
+
+def plan_parts(size, part_size, first=0):
+    """
+    This function splits bytes first..size-1 of an object into parts of part_size bytes, the last one shorter.
+    Returns: type list, of [<part_number>, <start>, <length>], numbered from 1 for the part starting at byte 0
+    """
+    return [[start // part_size + 1, start, min(part_size, size - start)] for start in range(first, size, part_size)]
+
+def retry_delay(attempt):
+    """
+    Returns: type float, the seconds to wait before retry number attempt + 1 of a failed part, doubling each time
+    """
+    return 0.25 * (2 ** attempt)
+
+def range_md5(full_path, start, length):
+    """
+    Returns: type str, hex MD5 of bytes start..start+length of the local file full_path
+    """
+    md5 = hashlib.md5()
+    fin = rangeReader(open(full_path, 'rb'), start, length)
+    try:
+        data = fin.read(chunk_size)
+        while data:
+            md5.update(data)
+            data = fin.read(chunk_size)
+    finally:
+        fin.close()
+    return md5.hexdigest()
+
+class viewReader:
+    """
+    This class defines a read-only, seekable file-like object over a buffer, such as a slice of a memory-mapped
+    file. read() returns memoryview slices of the buffer instead of copies, so the HTTP layer sends and checksums
+    the part straight from the page cache. boto3 accepts it as a request Body, which a bare memoryview isn't.
+    To Call: viewReader(view)
+    Whereas: view: type memoryview, the bytes to expose
+    """
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+
+    def read(self, size=-1):
+        remaining = len(self.view) - self.pos
+        if size < 0 or size > remaining:
+            size = remaining
+        data = self.view[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += len(self.view)
+        self.pos = max(0, min(offset, len(self.view)))
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        return None
+
+class rangeStream:
+    """
+    This class defines a read-only file-like object over a whole object that is fetched as consecutive ranged
+    GETs, run concurrently on the engine's part pool up to max_ahead parts ahead of the reader. The reader gets
+    the bytes in order as soon as each part arrives, so e.g. an archive can be unpacked while its later ranges
+    are still in flight. Every part after the first is conditional on the first part's ETag.
+    Must not be read from one of the part pool's own workers.
+    To Call: rangeStream(engine, key, max_ahead)
+    Whereas: engine:    type transferEngine, the engine for the bucket
+             key:       type str, the key to read
+             max_ahead: type int, the number of parts that may be in flight or buffered at once
+    """
+    def __init__(self, engine, key, max_ahead):
+        self.engine = engine
+        self.key = key
+        self.max_ahead = max_ahead
+        self.current, self.size, self.etag = engine.read_range(key, 0, engine.part_size - 1)
+        self.pos = 0
+        self.next_start = len(self.current)
+        self.parts = collections.deque()
+        self.fill()
+
+    def fetch(self, worker_name, start, end, holder):
+        try:
+            holder['data'] = self.engine.read_range(self.key, start, end, if_match=self.etag)[0]
+        except Exception as e:
+            holder['error'] = e
+        finally:
+            holder['event'].set()
+
+    def fill(self):
+        while len(self.parts) < self.max_ahead and self.next_start < self.size:
+            end = min(self.next_start + self.engine.part_size, self.size) - 1
+            holder = {'event': threading.Event(), 'data': None, 'error': None}
+            self.parts.append(holder)
+            self.engine.get_part_pool().submit(self.fetch, self.next_start, end, holder)
+            self.next_start = end + 1
+
+    def advance(self):
+        if len(self.parts) == 0:
+            return False
+        holder = self.parts.popleft()
+        holder['event'].wait()
+        if holder['error'] != None:
+            raise holder['error']
+        self.current = holder['data']
+        self.pos = 0
+        self.fill()
+        return True
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0:
+            if self.pos >= len(self.current) and not self.advance():
+                break
+            take = len(self.current) - self.pos
+            if size > 0:
+                take = min(take, size)
+                size -= take
+            chunks.append(self.current[self.pos:self.pos + take])
+            self.pos += take
+        return b"".join(chunks)
+
+    def close(self):
+        """
+        Waits for the parts still in flight, so no worker writes into an abandoned stream. Returns: None
+        """
+        while len(self.parts) > 0:
+            self.parts.popleft()['event'].wait()
+        self.current = b""
+        return None
+
+class localBackend:
+    """
+    This class defines a storage backend that keeps objects as plain files inside a local directory, so that
+    every mode of the program can be run and tested without network access or AWS credentials.
+    Keys map directly onto relative file paths under root_dir, and keys that would resolve outside of it are refused.
+    Objects completed from a multipart upload get S3's composite ETag, md5(<part MD5s>)-N, which is kept in a
+    side file under etag_dir so it survives the run; every other object's ETag is the MD5 of its contents.
+    To Call: localBackend(root_dir)
+    Whereas: root_dir: type str, relative or absolute path to the directory standing in for the bucket
+    """
+    min_part_size = 1
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.etag_cache = {}
+        self.lock = threading.Lock()
+        if not os.path.isdir(root_dir):
+            os.makedirs(root_dir)
+
+    def object_path(self, key):
+        """
+        Returns: type str, the path of key under root_dir. Raises ValueError for absolute keys and keys that climb
+        out of root_dir with "..", the same containment as archive_stream.member_path.
+        """
+        path = os.path.normpath(key)
+        if os.path.isabs(path) or path == ".." or path.startswith(".." + os.sep):
+            raise ValueError("Invalid key " + key + ": it resolves outside of " + self.root_dir)
+        return os.path.join(self.root_dir, path)
+
+    def etag_path(self, path):
+        return os.path.join(self.root_dir, etag_dir, os.path.relpath(path, self.root_dir))
+
+    def make_etag(self, path, stat):
+        """
+        Local objects use the MD5 of their contents as an ETag, like single-part S3 objects, unless a composite ETag
+        was kept for them by complete_multipart. Digests are cached against (size, mtime) so repeated listings don't
+        re-read unchanged files.
+        """
+        with self.lock:
+            cached = self.etag_cache.get(path)
+        if cached != None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        etag = None
+        try:
+            fin = open(self.etag_path(path), 'r')
+            try:
+                size, mtime_ns, kept = fin.read().split()
+            finally:
+                fin.close()
+            if int(size) == stat.st_size and int(mtime_ns) == stat.st_mtime_ns:
+                etag = kept
+        except (OSError, ValueError):
+            etag = None
+        if etag == None:
+            etag = file_md5(path)
+        with self.lock:
+            self.etag_cache[path] = [stat.st_size, stat.st_mtime_ns, etag]
+        return etag
+
+    def put_file(self, full_path, key, checksum=None):
+        """
+        Copies full_path to key. If checksum is given, it is fed the bytes copied.
+        Returns: List [<num_bytes>, <etag>]
+        """
+        dest_path = self.object_path(key)
+        dest_dir = os.path.dirname(dest_path)
+        if dest_dir != "" and not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir, exist_ok=True)
+        md5 = hashlib.md5()
+        if checksum != None:
+            md5 = checksum
+        fin = open(full_path, 'rb')
+        try:
+            fout = open(dest_path, 'wb')
+            try:
+                num_bytes = copy_stream(fin, fout, md5)
+            finally:
+                fout.close()
+        finally:
+            fin.close()
+        stat = os.stat(dest_path)
+        with self.lock:
+            self.etag_cache[dest_path] = [stat.st_size, stat.st_mtime_ns, md5.hexdigest()]
+        return [num_bytes, md5.hexdigest()]
+
+    def put_bytes(self, data, key):
+        """
+        Writes the in-memory buffer data to key. Returns: List [<num_bytes>, <etag>]
+        """
+        dest_path = self.object_path(key)
+        dest_dir = os.path.dirname(dest_path)
+        if dest_dir != "" and not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir, exist_ok=True)
+        fout = open(dest_path, 'wb')
+        try:
+            fout.write(data)
+        finally:
+            fout.close()
+        etag = hashlib.md5(data).hexdigest()
+        stat = os.stat(dest_path)
+        with self.lock:
+            self.etag_cache[dest_path] = [stat.st_size, stat.st_mtime_ns, etag]
+        return [len(data), etag]
+
+    def get_file(self, key, full_path):
+        fin = open(self.object_path(key), 'rb')
+        try:
+            fout = open(full_path, 'wb')
+            try:
+                num_bytes = copy_stream(fin, fout)
+            finally:
+                fout.close()
+        finally:
+            fin.close()
+        return num_bytes
+
+    def open_range(self, key, start, end, if_match=None, if_none_match=None):
+        """
+        Opens bytes start..end (inclusive) of key, clipped to the end of the object. if_match and if_none_match
+        behave like the HTTP conditional headers of the same names.
+        Returns: List [<stream>, <total_size>, <etag>], or None if the object's ETag equals if_none_match
+        """
+        path = self.object_path(key)
+        stat = os.stat(path)
+        etag = self.make_etag(path, stat)
+        if if_none_match != None and etag == if_none_match:
+            return None
+        if if_match != None and etag != if_match:
+            raise preconditionFailed("Precondition failed: " + key + " changed during the transfer")
+        end = min(end, stat.st_size - 1)
+        return [rangeReader(open(path, 'rb'), start, max(end - start + 1, 0)), stat.st_size, etag]
+
+    def head_object(self, key):
+        path = self.object_path(key)
+        stat = os.stat(path)
+        return {'key': key, 'size': stat.st_size, 'etag': self.make_etag(path, stat)}
+
+    def copy_object(self, src_key, key, if_match=None):
+        """
+        Copies the object src_key to key without the bytes passing through the caller, like an S3 CopyObject.
+        If if_match is given, the copy fails unless src_key still has that ETag, like the x-amz-copy-source-if-match header.
+        Returns: type str, the ETag of the new object
+        """
+        src_path = self.object_path(src_key)
+        dest_path = self.object_path(key)
+        dest_dir = os.path.dirname(dest_path)
+        if dest_dir != "" and not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir, exist_ok=True)
+        etag = self.make_etag(src_path, os.stat(src_path))
+        if if_match != None and etag != if_match:
+            raise preconditionFailed("Precondition failed: " + src_key + " no longer has ETag " + if_match)
+        tmp_path = dest_path + partial_suffix
+        shutil.copyfile(src_path, tmp_path)
+        if not is_md5_etag(etag):
+            #Like CopyObject, the copy is a single-part object, whose ETag is the MD5 of its contents
+            etag = file_md5(tmp_path)
+        os.replace(tmp_path, dest_path)
+        stat = os.stat(dest_path)
+        with self.lock:
+            self.etag_cache[dest_path] = [stat.st_size, stat.st_mtime_ns, etag]
+        return etag
+
+    def upload_dir(self, upload_id):
+        return os.path.join(self.root_dir, multipart_dir, upload_id)
+
+    def create_multipart(self, key):
+        """
+        Starts a multipart upload of key, staging its parts in their own directory. Returns: type str, upload_id
+        """
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self.upload_dir(upload_id))
+        return upload_id
+
+    def upload_part(self, key, upload_id, part_number, data):
+        """
+        Stores one part of a multipart upload. Returns: type str, the ETag (MD5) of the part
+        """
+        part_path = os.path.join(self.upload_dir(upload_id), str(part_number))
+        fout = open(part_path, 'wb')
+        try:
+            fout.write(data)
+        finally:
+            fout.close()
+        return hashlib.md5(data).hexdigest()
+
+    def complete_multipart(self, key, upload_id, parts):
+        """
+        Joins parts, a list of [<part_number>, <etag>] in order, into key. The object is assembled under a
+        temporary name and renamed into place, so readers see either the old object or the complete new one.
+        Returns: type str, the ETag of the new object
+        """
+        stage_dir = self.upload_dir(upload_id)
+        tmp_path = os.path.join(stage_dir, "complete")
+        composite = hashlib.md5()
+        fout = open(tmp_path, 'wb')
+        try:
+            for part_number, etag in parts:
+                md5 = hashlib.md5()
+                fin = open(os.path.join(stage_dir, str(part_number)), 'rb')
+                try:
+                    data = fin.read(chunk_size)
+                    while data:
+                        md5.update(data)
+                        fout.write(data)
+                        data = fin.read(chunk_size)
+                finally:
+                    fin.close()
+                if md5.hexdigest() != etag:
+                    raise ValueError("InvalidPart: part " + str(part_number) + " of " + key + " does not have ETag " + etag)
+                composite.update(md5.digest())
+        finally:
+            fout.close()
+        etag = composite.hexdigest() + "-" + str(len(parts))
+        dest_path = self.object_path(key)
+        dest_dir = os.path.dirname(dest_path)
+        if dest_dir != "" and not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir, exist_ok=True)
+        os.replace(tmp_path, dest_path)
+        stat = os.stat(dest_path)
+        kept_path = self.etag_path(dest_path)
+        if not os.path.isdir(os.path.dirname(kept_path)):
+            os.makedirs(os.path.dirname(kept_path), exist_ok=True)
+        fout = open(kept_path, 'w')
+        try:
+            fout.write(str(stat.st_size) + " " + str(stat.st_mtime_ns) + " " + etag)
+        finally:
+            fout.close()
+        with self.lock:
+            self.etag_cache[dest_path] = [stat.st_size, stat.st_mtime_ns, etag]
+        self.abort_multipart(key, upload_id)
+        return etag
+
+    def abort_multipart(self, key, upload_id):
+        """
+        Discards the staged parts of upload_id. Returns: None
+        """
+        shutil.rmtree(self.upload_dir(upload_id), ignore_errors=True)
+        return None
+
+    def delete_object(self, key):
+        path = self.object_path(key)
+        for remove_path in [path, self.etag_path(path)]:
+            try:
+                os.remove(remove_path)
+            except FileNotFoundError:
+                None
+        return None
+
+    def delete_objects(self, keys):
+        """
+        Deletes a batch of keys. Returns: type list, of [<key>, <error message>] for the keys that failed
+        """
+        failures = []
+        for key in keys:
+            try:
+                self.delete_object(key)
+            except OSError as e:
+                failures.append([key, str(e)])
+        return failures
+
+    def list_pages(self, prefix="", page_size=list_page_size):
+        """
+        Yields lists of at most page_size {'key', 'size', 'etag'} dicts, walking one directory at a time.
+        """
+        page = []
+        for dirName, subdirList, fileList in os.walk(self.root_dir):
+            if dirName == self.root_dir:
+                for skip_dir in [multipart_dir, etag_dir]:
+                    if skip_dir in subdirList:
+                        subdirList.remove(skip_dir)
+            subdirList.sort()
+            for fname in sorted(fileList):
+                path = os.path.join(dirName, fname)
+                key = os.path.relpath(path, self.root_dir).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    stat = os.stat(path)
+                    page.append({'key': key, 'size': stat.st_size, 'etag': self.make_etag(path, stat)})
+                    if len(page) >= page_size:
+                        yield page
+                        page = []
+        if len(page) > 0:
+            yield page
+
+class s3Backend:
+    """
+    This class defines a storage backend on top of a single boto3 S3 client. The client (and with it the
+    connection pool, credentials and TLS sessions) is created once and shared by every worker thread.
+    To Call: s3Backend(bucket_name, prefix, max_connections)
+    Whereas: bucket_name:     type str, name of the S3 bucket
+             prefix:          type str, key prefix inside the bucket, "" for the bucket root
+             max_connections: type int, size of the shared HTTP connection pool
+    """
+    min_part_size = 5 * 1024 * 1024
+    def __init__(self, bucket_name, prefix="", max_connections=default_connections):
+        if boto3 == None:
+            raise ImportError("The S3 backend requires boto3. Install it with: pip install boto3")
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        config = Config(max_pool_connections=max_connections, retries={'max_attempts': 5, 'mode': 'standard'})
+        self.client = boto3.session.Session().client('s3', config=config)
+
+    def full_key(self, key):
+        return self.prefix + key
+
+    def put_file(self, full_path, key, checksum=None):
+        """
+        Uploads full_path to key with a single PUT. If checksum is given, it is fed the bytes sent.
+        Returns: List [<num_bytes>, <etag>]
+        """
+        fin = open(full_path, 'rb')
+        try:
+            body = fin
+            if checksum != None:
+                body = hashingReader(fin, checksum)
+            response = self.client.put_object(Bucket=self.bucket_name, Key=self.full_key(key), Body=body)
+        finally:
+            fin.close()
+        return [os.path.getsize(full_path), response['ETag'].strip('"')]
+
+    def put_bytes(self, data, key):
+        """
+        Uploads the in-memory buffer data to key with a single PUT. Returns: List [<num_bytes>, <etag>]
+        """
+        response = self.client.put_object(Bucket=self.bucket_name, Key=self.full_key(key), Body=data)
+        return [len(data), response['ETag'].strip('"')]
+
+    def get_file(self, key, full_path):
+        response = self.client.get_object(Bucket=self.bucket_name, Key=self.full_key(key))
+        body = response['Body']
+        fout = open(full_path, 'wb')
+        try:
+            num_bytes = copy_stream(body, fout)
+        finally:
+            fout.close()
+            body.close()
+        return num_bytes
+
+    def open_range(self, key, start, end, if_match=None, if_none_match=None):
+        """
+        Opens bytes start..end (inclusive) of key with a ranged GET, clipped to the end of the object. if_match and
+        if_none_match are sent as the HTTP conditional headers of the same names.
+        Returns: List [<stream>, <total_size>, <etag>], or None if the object's ETag equals if_none_match
+        """
+        kwargs = {'Bucket': self.bucket_name, 'Key': self.full_key(key)}
+        if if_match != None:
+            kwargs['IfMatch'] = '"' + if_match + '"'
+        if if_none_match != None:
+            kwargs['IfNoneMatch'] = '"' + if_none_match + '"'
+        try:
+            response = self.client.get_object(Range="bytes=" + str(start) + "-" + str(end), **kwargs)
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code in ['304', 'NotModified']:
+                return None
+            #S3 rejects any range on an empty object, so fall back to a plain GET
+            if code != 'InvalidRange' or start != 0:
+                raise
+            response = self.client.get_object(**kwargs)
+            return [response['Body'], response['ContentLength'], response['ETag'].strip('"')]
+        content_range = response.get('ContentRange')
+        if content_range == None:
+            return [response['Body'], response['ContentLength'], response['ETag'].strip('"')]
+        return [response['Body'], int(content_range.split("/")[-1]), response['ETag'].strip('"')]
+
+    def head_object(self, key):
+        response = self.client.head_object(Bucket=self.bucket_name, Key=self.full_key(key))
+        return {'key': key, 'size': response['ContentLength'], 'etag': response['ETag'].strip('"')}
+
+    def copy_object(self, src_key, key, if_match=None):
+        """
+        Copies the object src_key to key inside the bucket with CopyObject, which S3 allows up to 5GB. If if_match
+        is given, it is sent as CopySourceIfMatch, so the copy fails unless src_key still has that ETag.
+        Returns: type str, the ETag of the new object
+        """
+        kwargs = {'Bucket': self.bucket_name, 'Key': self.full_key(key), 'CopySource': {'Bucket': self.bucket_name, 'Key': self.full_key(src_key)}}
+        if if_match != None:
+            kwargs['CopySourceIfMatch'] = '"' + if_match + '"'
+        response = self.client.copy_object(**kwargs)
+        return response['CopyObjectResult']['ETag'].strip('"')
+
+    def create_multipart(self, key):
+        response = self.client.create_multipart_upload(Bucket=self.bucket_name, Key=self.full_key(key))
+        return response['UploadId']
+
+    def upload_part(self, key, upload_id, part_number, data):
+        if isinstance(data, memoryview):
+            data = viewReader(data)
+        response = self.client.upload_part(Bucket=self.bucket_name, Key=self.full_key(key), UploadId=upload_id, PartNumber=part_number, Body=data)
+        return response['ETag'].strip('"')
+
+    def complete_multipart(self, key, upload_id, parts):
+        part_list = []
+        for part_number, etag in parts:
+            part_list.append({'PartNumber': part_number, 'ETag': '"' + etag + '"'})
+        response = self.client.complete_multipart_upload(Bucket=self.bucket_name, Key=self.full_key(key), UploadId=upload_id, MultipartUpload={'Parts': part_list})
+        return response['ETag'].strip('"')
+
+    def abort_multipart(self, key, upload_id):
+        self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.full_key(key), UploadId=upload_id)
+        return None
+
+    def delete_object(self, key):
+        self.client.delete_object(Bucket=self.bucket_name, Key=self.full_key(key))
+        return None
+
+    def delete_objects(self, keys):
+        """
+        Deletes up to delete_batch_size keys with one DeleteObjects request.
+        Returns: type list, of [<key>, <error message>] for the keys that failed
+        """
+        objects = []
+        for key in keys:
+            objects.append({'Key': self.full_key(key)})
+        response = self.client.delete_objects(Bucket=self.bucket_name, Delete={'Objects': objects, 'Quiet': True})
+        failures = []
+        for error in response.get('Errors', []):
+            failures.append([error['Key'][len(self.prefix):], error.get('Code', "") + ": " + error.get('Message', "")])
+        return failures
+
+    def list_pages(self, prefix="", page_size=list_page_size):
+        """
+        Yields lists of at most page_size {'key', 'size', 'etag'} dicts, one ListObjectsV2 request per page.
+        """
+        kwargs = {'Bucket': self.bucket_name, 'Prefix': self.full_key(prefix), 'MaxKeys': page_size}
+        while True:
+            response = self.client.list_objects_v2(**kwargs)
+            page = []
+            for item in response.get('Contents', []):
+                page.append({'key': item['Key'][len(self.prefix):], 'size': item['Size'], 'etag': item['ETag'].strip('"')})
+            if len(page) > 0:
+                yield page
+            if not response.get('IsTruncated'):
+                return None
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+class transferEngine:
+    """
+    This class defines the in-process transfer engine. It owns one storage backend for the lifetime of the run,
+    so every transfer reuses the same connection pool instead of starting a new AWS CLI process per object.
+    Objects larger than part_size are downloaded as concurrent ranged GETs written at their offsets in a
+    preallocated file, so a single large archive isn't limited to one serial stream. Files larger than
+    threshold are uploaded as multipart uploads whose parts are sent concurrently and retried individually.
+    Downloads are written to a temporary name and renamed into place once complete, so a file at its real name
+    is always whole. If a transferJournal is attached as self.journal, completed parts are recorded in it, and
+    unfinished multipart uploads and partial downloads are kept so a later run can continue them.
+    If self.verify is True, the MD5 of every transfer is computed on the buffers as they are sent or received and
+    compared with the ETags the backend reports, see verify_download; a mismatch fails the transfer.
+    To Call: transferEngine(bucket_path, max_connections, part_size, max_parts, threshold)
+    Whereas: bucket_path:     type str, "s3://bucket-name/" or "file://directory/", see parse_bucket_path
+             max_connections: type int, size of the shared connection pool
+             part_size:       type int, size in bytes of each part of a large object
+             max_parts:       type int, number of parts (across all large objects) that may be in flight at once
+             threshold:       type int, size in bytes above which uploads are split into parts
+    """
+    def __init__(self, bucket_path, max_connections=default_connections, part_size=default_part_size, max_parts=default_max_parts, threshold=default_threshold):
+        if part_size < 1 or max_parts < 1:
+            raise ValueError("part_size and max_parts must be positive")
+        self.bucket_path = bucket_path
+        self.part_size = part_size
+        self.max_parts = max_parts
+        self.threshold = threshold
+        self.part_retries = default_part_retries
+        self.backend = get_backend(bucket_path, max_connections + max_parts)
+        self.part_pool = None
+        self.cache = None
+        self.dedup = None
+        self.trace = None
+        self.journal = None
+        self.verify = False
+        self.lock = threading.Lock()
+
+    def get_part_pool(self):
+        """
+        Returns: type workerPool, the pool that transfers parts of large objects, started on first use.
+        """
+        with self.lock:
+            if self.part_pool == None:
+                self.part_pool = workerPool(self.max_parts, name="Part")
+            return self.part_pool
+
+    def close(self):
+        """
+        Stops the part workers, if any were started. Returns: None
+        """
+        with self.lock:
+            part_pool = self.part_pool
+            self.part_pool = None
+        if part_pool != None:
+            part_pool.shutdown()
+        return None
+
+    def download_part(self, worker_name, key, full_path, start, end, etag, digests=None):
+        """
+        Fetches bytes start..end of key and writes them at the same offset in the preallocated full_path.
+        The request is conditional on etag, so an object replaced mid-download fails instead of mixing versions.
+        If digests is a dict, the MD5 of the part is stored in digests[start].
+        """
+        stream, total_size, etag = self.backend.open_range(key, start, end, if_match=etag)
+        md5 = None
+        if digests != None:
+            md5 = hashlib.md5()
+        try:
+            fout = open(full_path, 'r+b')
+            try:
+                fout.seek(start)
+                copy_stream(stream, fout, md5)
+            finally:
+                fout.close()
+        finally:
+            stream.close()
+        if md5 != None:
+            digests[start] = md5.hexdigest()
+        if self.journal != None:
+            self.journal.add_part('download', key, etag, start)
+        return None
+
+    def upload_part(self, worker_name, key, upload_id, source, part_number, start, length, etags, stats=None):
+        """
+        Uploads bytes start..start+length of source, the memory map of the file being uploaded, retrying up to
+        part_retries times with exponential backoff. The part is handed to the backend as a memoryview of the map,
+        so it is never copied into a bytes object, and only the pages being sent are read from disk and resident.
+        The part's ETag is stored in etags[part_number], and each retry is counted in stats['retries'].
+        """
+        with memoryview(source)[start:start + length] as data:
+            self.upload_part_data(worker_name, key, upload_id, part_number, data, etags, stats)
+        #The pages are clean, so dropping them from the map only frees them, keeping the process's RSS to the parts in flight
+        if hasattr(mmap, 'MADV_DONTNEED'):
+            aligned = start - start % mmap.PAGESIZE
+            source.madvise(mmap.MADV_DONTNEED, aligned, start + length - aligned)
+        if self.journal != None:
+            self.journal.add_part('upload', key, upload_id, part_number, etags[part_number])
+        return None
+
+    def upload_part_data(self, worker_name, key, upload_id, part_number, data, etags, stats=None):
+        """
+        Uploads the in-memory part data, retrying up to part_retries times with exponential backoff.
+        The part's ETag is stored in etags[part_number], and each retry is counted in stats['retries'].
+        """
+        expected = None
+        if self.verify:
+            expected = hashlib.md5(data).hexdigest()
+        attempt = 0
+        while True:
+            try:
+                etag = self.backend.upload_part(key, upload_id, part_number, data)
+                if expected != None and etag != expected:
+                    raise OSError("Checksum mismatch: part " + str(part_number) + " of " + key + " was stored with ETag " + etag + ", sent MD5 " + expected)
+                etags[part_number] = etag
+                return None
+            except Exception:
+                if attempt >= self.part_retries:
+                    raise
+                if stats != None:
+                    with self.lock:
+                        stats['retries'] = stats.get('retries', 0) + 1
+                time.sleep(retry_delay(attempt))
+                attempt += 1
+
+    def upload_file(self, full_path, key, stats=None, stat=None):
+        """
+        Uploads the local file full_path to key. If a dedupIndex is attached as self.dedup, the upload goes through
+        it, and content the bucket already holds isn't sent again.
+        Returns: type int, number of bytes uploaded.
+        """
+        if self.dedup != None:
+            return self.dedup.upload(self, full_path, key, stats, stat)
+        return self.upload_object(full_path, key, stats, stat)['size']
+
+    def copy_object(self, src_key, key, if_match, md5=None, stats=None):
+        """
+        Copies the object src_key to key inside the bucket, without the bytes passing through this machine. The copy
+        is conditional on src_key still having the ETag if_match, so an object overwritten since it was recorded is
+        never copied. With self.verify, the new object's ETag is compared with md5, the MD5 of the expected contents.
+        Returns: type str, the ETag of the new object
+        """
+        started_at = time.perf_counter()
+        etag = self.backend.copy_object(src_key, key, if_match=if_match)
+        first_response(stats, started_at)
+        if self.verify:
+            self.check_checksum(key, etag, md5, stats)
+        return etag
+
+    def upload_object(self, full_path, key, stats=None, stat=None):
+        """
+        Uploads the local file full_path to key. Files larger than threshold are sent as a multipart upload,
+        which is aborted if any part still fails after its retries, so a partial object never becomes visible.
+        With a journal, the upload is kept instead so a later run can continue it from its completed parts; an
+        upload that fails again after being continued is aborted, so the next run starts it afresh.
+        If stats is a dict, the time to the first response from the bucket is stored in stats['ttfb'] (the whole PUT
+        for a small file, the creation of the upload for a large one) and part retries are counted in
+        stats['retries']. stat is the os.stat_result of full_path
+        if the caller already has it, e.g. from a directory scan, so the file isn't stat'ed again.
+        Returns: type dict, {'key': <key>, 'size': <bytes uploaded>, 'etag': <etag of the new object>}
+        """
+        started_at = time.perf_counter()
+        if stat == None:
+            stat = os.stat(full_path)
+        size = stat.st_size
+        if size <= self.threshold:
+            checksum = None
+            if self.verify:
+                checksum = streamChecksum()
+            num_bytes, etag = self.backend.put_file(full_path, key, checksum)
+            first_response(stats, started_at)
+            if checksum != None:
+                self.check_checksum(key, etag, checksum.hexdigest() if checksum.num_bytes == num_bytes else None, stats)
+            return {'key': key, 'size': num_bytes, 'etag': etag}
+        part_size = multipart_size(size, self.part_size, self.backend.min_part_size)
+        upload_id = None
+        etags = {}
+        if self.journal != None:
+            upload_id = self.journal.find_upload(key, size, stat.st_mtime_ns, part_size)
+        resumed = upload_id != None
+        if resumed:
+            etags = self.journal.parts('upload', key, upload_id)
+        else:
+            upload_id = self.backend.create_multipart(key)
+            first_response(stats, started_at)
+            if self.journal != None:
+                self.journal.start_upload(key, upload_id, size, stat.st_mtime_ns, part_size)
+        try:
+            #Parts are read straight from a memory map of the file, shared by every part of this upload
+            fin = open(full_path, 'rb')
+            try:
+                source = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                fin.close()
+            #The map is closed even if submitting fails, once the parts already submitted have stopped using it
+            parts = jobGroup(self.get_part_pool())
+            try:
+                plan = plan_parts(size, part_size)
+                for part_number, start, length in plan:
+                    if part_number not in etags:
+                        parts.submit(self.upload_part, key, upload_id, source, part_number, start, length, etags, stats)
+            finally:
+                errors = parts.wait()
+                close_map(source)
+            if len(errors) > 0:
+                raise errors[0][1]
+            part_list = []
+            for number in range(1, len(plan) + 1):
+                part_list.append([number, etags[number]])
+            etag = self.backend.complete_multipart(key, upload_id, part_list)
+            first_response(stats, started_at)
+            if self.verify and stats != None:
+                #Every part was checked against the ETag it was stored with
+                stats['verified'] = None if resumed else True
+        except Exception:
+            if self.journal == None or resumed:
+                self.backend.abort_multipart(key, upload_id)
+                if self.journal != None:
+                    self.journal.end_upload(key)
+            raise
+        except BaseException:
+            if self.journal == None:
+                self.backend.abort_multipart(key, upload_id)
+            raise
+        if self.journal != None:
+            self.journal.end_upload(key)
+        return {'key': key, 'size': size, 'etag': etag}
+
+    def upload_data(self, data, key, stats=None):
+        """
+        Uploads the in-memory buffer data to key, so generated objects never have to be written to a local file.
+        Buffers are always sent with a single PUT, which S3 accepts up to 5GB.
+        Returns: type int, number of bytes uploaded.
+        """
+        started_at = time.perf_counter()
+        num_bytes, etag = self.backend.put_bytes(data, key)
+        first_response(stats, started_at)
+        if self.verify:
+            self.check_checksum(key, etag, hashlib.md5(data).hexdigest(), stats)
+        return num_bytes
+
+    def check_checksum(self, key, etag, md5, stats=None):
+        """
+        This function compares md5, the MD5 of the bytes sent or received for key, with the object's etag.
+        stats['verified'] is set to True if they match, or None if md5 is None or etag isn't a plain MD5 (an object
+        uploaded in parts), in which case nothing could be checked.
+        Raises OSError if they differ. Returns: None
+        """
+        verified = None
+        if md5 != None and is_md5_etag(etag):
+            if md5 != etag:
+                raise OSError("Checksum mismatch: " + key + " has ETag " + etag + ", but the bytes transferred have MD5 " + md5)
+            verified = True
+        if stats != None:
+            stats['verified'] = verified
+        return None
+
+    def upload_stream(self, chunks, key, stats=None):
+        """
+        Uploads the bytes yielded by chunks to key without knowing the total size in advance, so generated data
+        such as an archive never has to be written to a local file. Every part_size bytes become one part of a
+        multipart upload, sent concurrently while the stream is still being produced; at most max_parts parts
+        are buffered at once. A stream shorter than one part is sent with a single PUT instead. The multipart
+        upload is aborted if the stream or any part fails.
+        Returns: type dict, {'key': <key>, 'size': <bytes uploaded>, 'etag': <etag of the new object>}
+        """
+        started_at = time.perf_counter()
+        part_size = max(self.part_size, self.backend.min_part_size)
+        buffer = []
+        buffered = 0
+        size = 0
+        upload_id = None
+        parts = None
+        etags = {}
+        part_number = 0
+        try:
+            for chunk in chunks:
+                buffer.append(chunk)
+                buffered += len(chunk)
+                size += len(chunk)
+                while buffered >= part_size:
+                    data = b"".join(buffer)
+                    buffer = [data[part_size:]]
+                    buffered = len(buffer[0])
+                    if upload_id == None:
+                        upload_id = self.backend.create_multipart(key)
+                        first_response(stats, started_at)
+                        parts = jobGroup(self.get_part_pool())
+                    part_number += 1
+                    if part_number > 10000:
+                        raise ValueError("Stream for " + key + " is larger than 10000 parts of " + str(part_size) + " bytes")
+                    errors = parts.throttle(self.max_parts)
+                    if len(errors) > 0:
+                        raise errors[0][1]
+                    parts.submit(self.upload_part_data, key, upload_id, part_number, data[:part_size], etags, stats)
+            data = b"".join(buffer)
+            if upload_id == None:
+                num_bytes, etag = self.backend.put_bytes(data, key)
+                first_response(stats, started_at)
+                return {'key': key, 'size': num_bytes, 'etag': etag}
+            if len(data) > 0:
+                part_number += 1
+                parts.submit(self.upload_part_data, key, upload_id, part_number, data, etags, stats)
+            errors = parts.wait()
+            if len(errors) > 0:
+                raise errors[0][1]
+            part_list = []
+            for number in range(1, part_number + 1):
+                part_list.append([number, etags[number]])
+            etag = self.backend.complete_multipart(key, upload_id, part_list)
+        except BaseException:
+            if upload_id != None:
+                parts.wait()
+                self.backend.abort_multipart(key, upload_id)
+            raise
+        return {'key': key, 'size': size, 'etag': etag}
+
+    def download_file(self, key, full_path, stats=None):
+        """
+        Downloads key to the local file full_path, creating its directory if needed. If an objectCache is attached
+        as self.cache, the download is served through it.
+        Returns: type int, number of bytes downloaded.
+        """
+        if self.cache != None:
+            return self.cache.download(self, key, full_path, stats)
+        return self.download_object(key, full_path, stats=stats)['size']
+
+    def download_object(self, key, full_path, if_none_match=None, stats=None):
+        """
+        Downloads key to the local file full_path, creating its directory if needed. If if_none_match is given and
+        still equals the object's ETag, nothing is transferred and full_path is left untouched.
+        The object is written to full_path + partial_suffix and renamed to full_path once complete. With a journal,
+        a partial download of a large object is kept, and a later download of the same version of the object only
+        fetches the parts that are missing from it.
+        If stats is a dict, the time to the first response in seconds is stored in stats['ttfb'].
+        Returns: type dict, {'key': <key>, 'size': <bytes downloaded>, 'etag': <etag>}, or None if not modified
+        """
+        dest_dir = os.path.dirname(full_path)
+        if dest_dir != "" and not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir, exist_ok=True)
+        tmp_path = full_path + partial_suffix
+        #The first part doubles as the size probe, so small objects still cost exactly one request
+        started_at = time.perf_counter()
+        opened = self.backend.open_range(key, 0, self.part_size - 1, if_none_match=if_none_match)
+        if stats != None:
+            stats['ttfb'] = time.perf_counter() - started_at
+        if opened == None:
+            return None
+        stream, total_size, etag = opened
+        large = total_size > self.part_size
+        done = {}
+        if self.journal != None and large:
+            if os.path.isfile(tmp_path) and os.path.getsize(tmp_path) == total_size:
+                done = self.journal.parts('download', key, etag)
+            if len(done) == 0:
+                self.journal.forget_parts('download', key)
+        parts = None
+        digests = None
+        md5 = None
+        if self.verify:
+            digests = {}
+            md5 = hashlib.md5()
+        try:
+            if len(done) == 0:
+                fout = open(tmp_path, 'wb')
+                try:
+                    if large:
+                        fout.truncate(total_size)
+                    else:
+                        copy_stream(stream, fout, md5)
+                finally:
+                    fout.close()
+            if large:
+                parts = jobGroup(self.get_part_pool())
+                for part_number, start, length in plan_parts(total_size, self.part_size, self.part_size):
+                    if start not in done:
+                        parts.submit(self.download_part, key, tmp_path, start, start + length - 1, etag, digests)
+                if 0 not in done:
+                    fout = open(tmp_path, 'r+b')
+                    try:
+                        copy_stream(stream, fout, md5)
+                    finally:
+                        fout.close()
+                    if digests != None:
+                        digests[0] = md5.hexdigest()
+                    if self.journal != None:
+                        self.journal.add_part('download', key, etag, 0)
+        except Exception:
+            if parts != None:
+                parts.wait()
+            self.discard_partial(tmp_path, large)
+            raise
+        finally:
+            stream.close()
+        if parts != None:
+            errors = parts.wait()
+            if len(errors) > 0:
+                self.discard_partial(tmp_path, large)
+                raise errors[0][1]
+        if self.verify:
+            try:
+                if large:
+                    self.verify_download(key, tmp_path, total_size, etag, digests, stats)
+                else:
+                    self.check_checksum(key, etag, md5.hexdigest(), stats)
+            except OSError:
+                self.discard_partial(tmp_path, False)
+                raise
+        os.replace(tmp_path, full_path)
+        if self.journal != None and large:
+            self.journal.forget_parts('download', key)
+        return {'key': key, 'size': total_size, 'etag': etag}
+
+    def verify_download(self, key, full_path, total_size, etag, digests, stats=None):
+        """
+        This function checks a large object downloaded as ranges of part_size bytes, from the MD5 of each range
+        computed while it was written. An object uploaded in N parts of the same size has the ETag
+        md5(<part MD5s>)-N, which is rebuilt from the ranges' MD5s without reading the file again. Ranges continued
+        from an earlier run, and objects with a plain MD5 ETag, have to be hashed from full_path, which was just
+        written and is normally still in the page cache. Objects uploaded with another part size can't be checked.
+        Raises OSError if the object doesn't match. Returns: None
+        """
+        starts = range(0, total_size, self.part_size)
+        if is_md5_etag(etag):
+            return self.check_checksum(key, etag, file_md5(full_path), stats)
+        if etag.partition("-")[2] != str(len(starts)):
+            return self.check_checksum(key, etag, None, stats)
+        composite = hashlib.md5()
+        for start in starts:
+            digest = digests.get(start)
+            if digest == None:
+                digest = range_md5(full_path, start, min(self.part_size, total_size - start))
+            composite.update(bytes.fromhex(digest))
+        md5 = composite.hexdigest() + "-" + str(len(starts))
+        if md5 != etag:
+            raise OSError("Checksum mismatch: " + key + " has ETag " + etag + ", but the parts transferred give " + md5)
+        if stats != None:
+            stats['verified'] = True
+        return None
+
+    def discard_partial(self, tmp_path, large):
+        """
+        Removes the partial download tmp_path after a failure, unless a journal lets a later run continue it.
+        Returns: None
+        """
+        if self.journal == None or not large:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return None
+
+    def read_range(self, key, start, end=None, if_match=None):
+        """
+        Reads bytes start..end (inclusive) of key into memory with one ranged GET. Without end, everything from
+        start to the end of the object is read, since HTTP clips a range that runs past the end.
+        Returns: List [<bytes>, <total_size>, <etag>]
+        """
+        if end == None:
+            end = (1 << 62) - 1
+        stream, total_size, etag = self.backend.open_range(key, start, end, if_match=if_match)
+        try:
+            data = stream.read()
+        finally:
+            stream.close()
+        return [data, total_size, etag]
+
+    def open_stream(self, key):
+        """
+        Returns: type rangeStream, a file-like object that reads key in order while later parts are prefetched
+        """
+        return rangeStream(self, key, self.max_parts)
+
+    def head_object(self, key):
+        """
+        Returns: type dict, {'key': <key>, 'size': <bytes>, 'etag': <etag>} for key.
+        """
+        return self.backend.head_object(key)
+
+    def delete_object(self, key):
+        """
+        Deletes key. Deleting a key that doesn't exist is not an error. Returns: None
+        """
+        return self.backend.delete_object(key)
+
+    def delete_keys(self, keys, max_threads=default_connections, pool=None):
+        """
+        Deletes every key yielded by keys, in batches of delete_batch_size sent concurrently by max_threads workers,
+        or by the workers of pool if a running workerPool is given to share.
+        keys may be a generator, e.g. a listing, and is consumed as batches are queued rather than all at once.
+        Returns: type dict, {'deleted': <number of keys deleted>, 'failed': list of [<key>, <error message>]}
+        """
+        result = {'deleted': 0, 'failed': []}
+        lock = threading.Lock()
+        def delete_batch(worker_name, batch):
+            try:
+                failures = self.backend.delete_objects(batch)
+            except Exception as e:
+                failures = []
+                for key in batch:
+                    failures.append([key, repr(e)])
+            with lock:
+                result['deleted'] += len(batch) - len(failures)
+                result['failed'].extend(failures)
+        def submit_batches(group):
+            batch = []
+            for key in keys:
+                batch.append(key)
+                if len(batch) >= delete_batch_size:
+                    group.submit(delete_batch, batch)
+                    batch = []
+            if len(batch) > 0:
+                group.submit(delete_batch, batch)
+        if pool == None:
+            with workerPool(max_threads, name="Delete") as own_pool:
+                submit_batches(own_pool)
+        else:
+            group = jobGroup(pool, stop_on_error=False)
+            try:
+                submit_batches(group)
+            finally:
+                group.wait()
+        return result
+
+    def list_objects(self, prefix=""):
+        """
+        Yields one dict per object whose key starts with prefix: {'key': <key>, 'size': <bytes>, 'etag': <etag>}
+        Pages are fetched by a background thread up to list_prefetch_pages ahead of the consumer, so the next
+        page is usually ready by the time the current one has been handed out, and at most a few pages are
+        held in memory however many keys the bucket has.
+        """
+        pages = queue.Queue(maxsize=list_prefetch_pages)
+        stopped = threading.Event()
+        def put_page(page):
+            #Gives up once the consumer has stopped, so an abandoned listing doesn't block this thread forever
+            while not stopped.is_set():
+                try:
+                    pages.put(page, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        def fetch_pages():
+            try:
+                for page in self.backend.list_pages(prefix):
+                    if not put_page(page):
+                        return None
+                put_page(None)
+            except Exception as e:
+                put_page(e)
+        fetcher = threading.Thread(target=fetch_pages, name="Lister", daemon=True)
+        fetcher.start()
+        try:
+            while True:
+                page = pages.get()
+                if page == None:
+                    return None
+                if isinstance(page, Exception):
+                    raise page
+                for item in page:
+                    yield item
+        finally:
+            stopped.set()
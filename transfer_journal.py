@@ -0,0 +1,161 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+__author__ = 'MCE123'
+
+journal_prefix = ".s3journal-"    #Prefix of the journal files kept next to the files of a run.
+
+def journal_path(directory, op, bucket_path, list_file):
+    """
+    This function returns where the journal of an upload or download run is kept, so a rerun of the same .test
+    file against the same bucket finds it again.
+    directory:   type str, the output directory of a download, or the directory of the .test file of an upload
+    op:          type str, "upload" or "download"
+    bucket_path: type str, the bucket path
+    list_file:   type str, the .test file listing the transfers
+    Returns:     type str, the path of the journal, .s3journal-<hash>.db inside directory
+    """
+    run_id = op + "\n" + bucket_path + "\n" + os.path.abspath(list_file)
+    return os.path.join(directory, journal_prefix + hashlib.md5(run_id.encode('utf-8')).hexdigest()[:16] + ".db")
+
+class transferJournal:
+    """
+    This class defines the checkpoint journal of an upload or download run. It records every completed object,
+    with the size and mtime of its local file, and every completed part of a large object, so a run that died
+    partway can be resumed: finished objects are skipped, and multipart uploads and ranged downloads continue
+    from their completed parts instead of starting over.
+    The journal is a SQLite database like the sync state (see sync_engine.py). Every record is committed as
+    its own transaction, so a run killed at any moment leaves a consistent journal. The database is in WAL mode
+    with synchronous=NORMAL, so commits aren't flushed to disk one by one: a killed process loses nothing, and
+    a crash of the whole machine loses at most the last few records, whose files are then just transferred
+    again. It is shared by every worker thread, and a lock serializes access to the connection.
+    Parts are recorded per version of the object: the upload ID of a multipart upload, or the ETag of the
+    object being downloaded, so parts of a replaced object are never mixed with the current one.
+    To Call: transferJournal(path, resume)
+    Whereas: path:   type str, relative or absolute path to the journal file, see journal_path
+             resume: type bool, True to continue from what the journal already holds, False to start it afresh
+    """
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.skipped = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS objects (op TEXT, key TEXT, size INTEGER, mtime_ns INTEGER, done_at REAL, PRIMARY KEY (op, key))")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS uploads (key TEXT PRIMARY KEY, upload_id TEXT, size INTEGER, mtime_ns INTEGER, part_size INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS parts (op TEXT, key TEXT, version TEXT, part INTEGER, etag TEXT, PRIMARY KEY (op, key, version, part))")
+        if not resume:
+            self.conn.execute("DELETE FROM objects")
+            self.conn.execute("DELETE FROM uploads")
+            self.conn.execute("DELETE FROM parts")
+        self.conn.commit()
+
+    def execute(self, sql, params):
+        with self.lock:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def query(self, sql, params):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def finish(self, op, key, full_path):
+        """
+        Records key as transferred, along with the size and mtime of its local file full_path. Returns: None
+        """
+        stat = os.stat(full_path)
+        self.execute("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)", [op, key, stat.st_size, stat.st_mtime_ns, time.time()])
+        return None
+
+    def finished(self, op, key, full_path):
+        """
+        This function checks whether key was transferred by an earlier run and its local file full_path is
+        unchanged since, and counts it in skipped if so.
+        Returns: True if the transfer can be skipped
+        """
+        rows = self.query("SELECT size, mtime_ns FROM objects WHERE op = ? AND key = ?", [op, key])
+        if len(rows) == 0:
+            return False
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return False
+        if [stat.st_size, stat.st_mtime_ns] != list(rows[0]):
+            return False
+        with self.lock:
+            self.skipped += 1
+        return True
+
+    def find_upload(self, key, size, mtime_ns, part_size):
+        """
+        Returns: type str, the upload ID of an unfinished multipart upload of key from the same local file
+                 (same size and mtime) with the same part size, or None
+        """
+        rows = self.query("SELECT upload_id FROM uploads WHERE key = ? AND size = ? AND mtime_ns = ? AND part_size = ?",
+                          [key, size, mtime_ns, part_size])
+        if len(rows) == 0:
+            return None
+        return rows[0][0]
+
+    def start_upload(self, key, upload_id, size, mtime_ns, part_size):
+        """
+        Records a new multipart upload of key, replacing any older one. Returns: None
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM parts WHERE op = 'upload' AND key = ?", [key])
+            self.conn.execute("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?)", [key, upload_id, size, mtime_ns, part_size])
+            self.conn.commit()
+        return None
+
+    def end_upload(self, key):
+        """
+        Forgets the multipart upload of key and its parts, once it was completed or aborted. Returns: None
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM uploads WHERE key = ?", [key])
+            self.conn.execute("DELETE FROM parts WHERE op = 'upload' AND key = ?", [key])
+            self.conn.commit()
+        return None
+
+    def add_part(self, op, key, version, part, etag=""):
+        """
+        Records one completed part: the part number of an upload, or the start offset of a download.
+        Returns: None
+        """
+        self.execute("INSERT OR REPLACE INTO parts VALUES (?, ?, ?, ?, ?)", [op, key, version, part, etag])
+        return None
+
+    def parts(self, op, key, version):
+        """
+        Returns: type dict, part number or start offset -> ETag of the completed parts of this version of key
+        """
+        parts = {}
+        for part, etag in self.query("SELECT part, etag FROM parts WHERE op = ? AND key = ? AND version = ?", [op, key, version]):
+            parts[part] = etag
+        return parts
+
+    def forget_parts(self, op, key):
+        """
+        Forgets the completed parts of every version of key. Returns: None
+        """
+        self.execute("DELETE FROM parts WHERE op = ? AND key = ?", [op, key])
+        return None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def remove(self):
+        """
+        Closes the journal and deletes its files, e.g. once a run finished with nothing left to resume. Returns: None
+        """
+        self.close()
+        for path in [self.path, self.path + "-wal", self.path + "-shm"]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                None
+        return None
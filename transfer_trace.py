@@ -0,0 +1,190 @@
+import sys
+import json
+import threading
+import time
+__author__ = 'MCE123'
+
+def percentile(values, pct):
+    """
+    This function returns the nearest-rank percentile of a sorted list.
+    values:  type list, of numbers sorted ascending
+    pct:     type float, the percentile to return, 0-100
+    Returns: the pct percentile of values, or 0 for an empty list
+    """
+    if len(values) == 0:
+        return 0
+    rank = max(int(-(-pct * len(values) // 100)), 1)
+    return values[rank - 1]
+
+class transferTrace:
+    """
+    This class defines the structured timing record of a run. Every transfer is written as one JSON object per
+    line to trace_path (if given) with its queue wait, time to first byte, bytes, duration, retries, worker and,
+    with -vf, whether its checksum was verified, and the durations are kept in memory for the end-of-run summary.
+    Writes are buffered and serialized by a lock, so worker threads never wait on the console.
+    To Call: transferTrace(trace_path)
+    Whereas: trace_path: type str, relative or absolute path of the JSON-lines file to append to, or None to
+                         only keep the in-memory summary
+    """
+    def __init__(self, trace_path=None):
+        self.trace_path = trace_path
+        self.fout = None
+        if trace_path != None:
+            self.fout = open(trace_path, 'a', buffering=1024 * 1024)
+        self.lock = threading.Lock()
+        self.started_at = time.perf_counter()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.num_bytes = 0
+        self.retries = 0
+        self.verified = 0
+        self.unverified = 0
+        self.durations = []
+        self.queue_waits = []
+        self.ttfbs = []
+
+    def queued(self):
+        """
+        Counts a transfer as submitted, and returns: type float, the perf_counter time to pass to record()
+        """
+        with self.lock:
+            self.submitted += 1
+        return time.perf_counter()
+
+    def record(self, op, key, worker, queued_at, started_at, num_bytes, stats=None, error=None):
+        """
+        Records one finished (or failed) transfer.
+        op:         type str, "upload" or "download"
+        key:        type str, the object key
+        worker:     type str, the name of the worker thread that ran it
+        queued_at:  type float, perf_counter time the transfer was queued, as returned by queued()
+        started_at: type float, perf_counter time a worker started it
+        num_bytes:  type int, bytes transferred
+        stats:      type dict, optional {'ttfb': <seconds or None>, 'retries': <int>} filled in by the engine
+        error:      the exception that failed the transfer, or None
+        Returns:    None
+        """
+        finished_at = time.perf_counter()
+        if stats == None:
+            stats = {}
+        event = {'ts': round(time.time(), 6), 'op': op, 'key': key, 'worker': worker,
+                 'queue_wait': round(started_at - queued_at, 6), 'ttfb': stats.get('ttfb'),
+                 'duration': round(finished_at - started_at, 6), 'bytes': num_bytes,
+                 'retries': stats.get('retries', 0), 'ok': error == None}
+        if event['ttfb'] != None:
+            event['ttfb'] = round(event['ttfb'], 6)
+        if 'verified' in stats:
+            event['verified'] = stats['verified']
+        if error != None:
+            event['error'] = repr(error)
+        with self.lock:
+            self.retries += event['retries']
+            if error == None:
+                self.completed += 1
+                self.num_bytes += num_bytes
+                if event.get('verified') == True:
+                    self.verified += 1
+                elif 'verified' in event:
+                    self.unverified += 1
+                self.durations.append(event['duration'])
+                self.queue_waits.append(event['queue_wait'])
+                if event['ttfb'] != None:
+                    self.ttfbs.append(event['ttfb'])
+            else:
+                self.failed += 1
+            if self.fout != None:
+                self.fout.write(json.dumps(event) + "\n")
+        return None
+
+    def summary(self):
+        """
+        Returns: type dict, the totals, throughput and latency percentiles (in ms) of the transfers recorded so far,
+                 each percentile None if nothing was measured
+        """
+        with self.lock:
+            durations = sorted(self.durations)
+            queue_waits = sorted(self.queue_waits)
+            ttfbs = sorted(self.ttfbs)
+            elapsed = time.perf_counter() - self.started_at
+            result = {'transfers': self.completed, 'failed': self.failed, 'bytes': self.num_bytes, 'seconds': round(elapsed, 3),
+                      'verified': self.verified, 'unverified': self.unverified}
+        result['mb_per_s'] = round(result['bytes'] / 1048576.0 / elapsed, 3) if elapsed > 0 else 0
+        result['objects_per_s'] = round(result['transfers'] / elapsed, 3) if elapsed > 0 else 0
+        for name, values in [['duration', durations], ['queue_wait', queue_waits], ['ttfb', ttfbs]]:
+            for pct in [50, 95, 99]:
+                result[name + '_p' + str(pct) + '_ms'] = round(percentile(values, pct) * 1000, 3) if len(values) > 0 else None
+        return result
+
+    def percentiles(self, s, name):
+        """
+        Returns: type str, the p50/p95/p99 of name from the summary s, e.g. "1.2/3.4/5.6", or "n/a" without samples
+        """
+        if s[name + '_p50_ms'] == None:
+            return 'n/a'
+        return str(s[name + '_p50_ms']) + '/' + str(s[name + '_p95_ms']) + '/' + str(s[name + '_p99_ms'])
+
+    def report(self):
+        """
+        Returns: type list, of str lines summarizing the run, for printing and the log file
+        """
+        s = self.summary()
+        lines = []
+        lines.append('Transfers: ' + str(s['transfers']) + ' ok, ' + str(s['failed']) + ' failed, ' + str(s['bytes']) + ' bytes')
+        lines.append('Throughput: ' + str(s['mb_per_s']) + ' MB/s, ' + str(s['objects_per_s']) + ' objects/s')
+        lines.append('Latency p50/p95/p99 (ms): ' + self.percentiles(s, 'duration')
+                     + ', Queue Wait p50/p95/p99 (ms): ' + self.percentiles(s, 'queue_wait')
+                     + ', TTFB p50/p95/p99 (ms): ' + self.percentiles(s, 'ttfb'))
+        if s['verified'] + s['unverified'] > 0:
+            lines.append('Checksums: ' + str(s['verified']) + ' verified, ' + str(s['unverified']) + ' could not be checked')
+        return lines
+
+    def close(self):
+        with self.lock:
+            if self.fout != None:
+                self.fout.close()
+                self.fout = None
+
+class progressView:
+    """
+    This class defines an aggregated console progress line, redrawn in place from one background thread every
+    interval seconds, so workers never print per file.
+    To Call: progressView(trace, interval)
+    Whereas: trace:    type transferTrace, the trace whose counters are shown
+             interval: type float, seconds between redraws
+    """
+    def __init__(self, trace, interval=1.0):
+        self.trace = trace
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="Progress", daemon=True)
+        self.thread.start()
+
+    def draw(self):
+        trace = self.trace
+        with trace.lock:
+            done = trace.completed + trace.failed
+            submitted = trace.submitted
+            num_bytes = trace.num_bytes
+            failed = trace.failed
+        elapsed = time.perf_counter() - trace.started_at
+        rate = num_bytes / 1048576.0 / elapsed if elapsed > 0 else 0
+        sys.stdout.write("\r" + str(done) + "/" + str(submitted) + " transfers, " + str(round(num_bytes / 1048576.0, 1)) + " MB, "
+                         + str(round(rate, 1)) + " MB/s, " + str(failed) + " failed ")
+        sys.stdout.flush()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.draw()
+
+    def stop(self):
+        """
+        Draws the final state and stops redrawing, once. Returns: None
+        """
+        if self.stopped.is_set():
+            return None
+        self.stopped.set()
+        self.thread.join()
+        self.draw()
+        sys.stdout.write("\n")
+        return None
@@ -0,0 +1,207 @@
+import threading
+import traceback
+import queue
+__author__ = 'MCE123'
+
+class workerPool:
+    """
+    This class defines a fixed pool of long-lived worker threads that pull jobs from a bounded queue.
+    submit() blocks while the queue is full, so a producer reading a 100k-line .test file never gets more
+    than queue_size jobs ahead of the workers, and idle workers sleep on the queue instead of spinning.
+    Each job is called as func(worker_name, *args). Exceptions raised by a job are caught and recorded in
+    errors, so one failed transfer doesn't take down its worker.
+    set_active() limits how many workers run jobs at once, so a controller can tune the concurrency of a
+    running pool; the other workers hold their next job until a slot frees up.
+    To Call: workerPool(num_workers, queue_size, name)
+    Whereas: num_workers: type int, is the number of worker threads to start
+             queue_size:  type int, is the maximum number of queued jobs, defaults to 4 jobs per worker
+             name:        type str, is the prefix of the worker thread names, e.g. "Thread" gives "Thread-0"
+    """
+    def __init__(self, num_workers, queue_size=None, name="Thread"):
+        if num_workers < 1:
+            raise ValueError("workerPool needs at least one worker, got " + str(num_workers))
+        if queue_size == None:
+            queue_size = num_workers * 4
+        self.num_workers = num_workers
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.errors = []
+        self.num_submitted = 0
+        self.num_completed = 0
+        self.closed = False
+        self.cancelled = False
+        self.active = num_workers
+        self.running = 0
+        self.waiting = 0
+        self.slots = threading.Condition()
+        self.workers = []
+        for worker_id in range(num_workers):
+            worker = threading.Thread(target=self.run_worker, name=name + "-" + str(worker_id), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def run_worker(self):
+        worker_name = threading.current_thread().name
+        while True:
+            job = self.jobs.get()
+            try:
+                if job == None:
+                    return None
+                func, args = job
+                if self.cancelled:
+                    continue
+                self.acquire_slot()
+                try:
+                    func(worker_name, *args)
+                except Exception as e:
+                    with self.lock:
+                        self.errors.append([args, e, traceback.format_exc()])
+                finally:
+                    self.release_slot()
+                with self.lock:
+                    self.num_completed += 1
+            finally:
+                self.jobs.task_done()
+
+    def acquire_slot(self):
+        with self.slots:
+            self.waiting += 1
+            while self.running >= self.active:
+                self.slots.wait()
+            self.waiting -= 1
+            self.running += 1
+
+    def release_slot(self):
+        with self.slots:
+            self.running -= 1
+            self.slots.notify()
+
+    def set_active(self, num_active):
+        """
+        Lets at most num_active workers (1 to num_workers) run jobs at once. Jobs already running finish.
+        Returns: type int, the new number of active workers
+        """
+        with self.slots:
+            self.active = max(1, min(self.num_workers, num_active))
+            self.slots.notify_all()
+            return self.active
+
+    def backlog(self):
+        """
+        Returns: type int, the number of submitted jobs that haven't started yet
+        """
+        with self.slots:
+            return self.jobs.qsize() + self.waiting
+
+    def submit(self, func, *args):
+        """
+        Queues func(worker_name, *args), blocking while the queue is full. Returns: None
+        """
+        if self.closed:
+            raise RuntimeError("Cannot submit to a workerPool after shutdown()")
+        self.jobs.put([func, args])
+        with self.lock:
+            self.num_submitted += 1
+        return None
+
+    def wait(self):
+        """
+        Blocks until every job submitted so far has finished, leaving the workers running. Returns: None
+        """
+        self.jobs.join()
+        return None
+
+    def cancel(self):
+        """
+        Discards queued jobs that haven't started yet, e.g. after KeyboardInterrupt. Jobs already running finish.
+        Returns: None
+        """
+        self.cancelled = True
+        return None
+
+    def shutdown(self):
+        """
+        Waits for the queued jobs to finish, then stops and joins every worker.
+        Returns: type list, the errors as [<job args>, <exception>, <traceback str>], empty if every job succeeded
+        """
+        if not self.closed:
+            self.closed = True
+            for worker in self.workers:
+                self.jobs.put(None)
+            for worker in self.workers:
+                worker.join()
+        return self.errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type != None:
+            self.cancel()
+        self.shutdown()
+        return False
+
+class jobGroup:
+    """
+    This class defines a group of related jobs (e.g. the parts of one large object) submitted to a shared
+    workerPool, so the caller can wait for just those jobs while the pool keeps serving other work.
+    After the first job in the group fails, the group's remaining queued jobs are skipped, unless stop_on_error
+    is False, e.g. for a batch of independent transfers.
+    To Call: jobGroup(pool, stop_on_error)
+    Whereas: pool:          type workerPool, is the pool that runs the jobs. The caller must not itself be one of
+                            this pool's workers, otherwise wait() can deadlock.
+             stop_on_error: type bool, True to skip the remaining jobs after the first failure
+    """
+    def __init__(self, pool, stop_on_error=True):
+        self.pool = pool
+        self.stop_on_error = stop_on_error
+        self.condition = threading.Condition()
+        self.pending = 0
+        self.errors = []
+
+    def run_job(self, worker_name, func, args):
+        try:
+            if len(self.errors) == 0 or not self.stop_on_error:
+                func(worker_name, *args)
+        except Exception as e:
+            with self.condition:
+                self.errors.append([args, e, traceback.format_exc()])
+        finally:
+            with self.condition:
+                self.pending -= 1
+                self.condition.notify_all()
+
+    def submit(self, func, *args):
+        """
+        Queues func(worker_name, *args) on the pool as part of this group. Returns: None
+        """
+        with self.condition:
+            self.pending += 1
+        try:
+            self.pool.submit(self.run_job, func, args)
+        except Exception:
+            with self.condition:
+                self.pending -= 1
+            raise
+        return None
+
+    def throttle(self, max_pending):
+        """
+        Blocks until fewer than max_pending jobs of the group are unfinished, so a producer can't queue more
+        work (and hold more buffers) than the pool keeps up with.
+        Returns: type list, the errors so far as [<job args>, <exception>, <traceback str>]
+        """
+        with self.condition:
+            while self.pending >= max_pending and (len(self.errors) == 0 or not self.stop_on_error):
+                self.condition.wait()
+        return self.errors
+
+    def wait(self):
+        """
+        Blocks until every job in the group has finished or been skipped.
+        Returns: type list, the errors as [<job args>, <exception>, <traceback str>]
+        """
+        with self.condition:
+            while self.pending > 0:
+                self.condition.wait()
+        return self.errors
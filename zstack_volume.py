@@ -0,0 +1,211 @@
+import os
+import io
+import re
+import json
+import struct
+__author__ = 'MCE123'
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+volume_extension = ".zstack"            #Extension of the keys of volume objects.
+volume_magic = b"ZSTK"                  #First bytes of every volume object.
+volume_version = 1                      #Version of the volume layout written by volume_chunks.
+header_struct = struct.Struct('<4sHHQ') #Fixed header: magic, version, reserved, length of the JSON index that follows.
+index_probe_size = 64 * 1024            #Bytes read by the first request of a partial read, enough for the index of any tile.
+slice_pattern = re.compile(r'^(.*)-z(\d+)(\.[A-Za-z0-9]+)$')
+chunk_size = 1024 * 1024                #Size of each read while streaming slices into a volume.
+
+def slice_tile(filename):
+    """
+    This function works out which volume a z-slice belongs to, from names such as "pre_exp_scan_r1-FTC-x02-y02-z07.tiff".
+    filename: type str, the name of the slice
+    Returns:  List [<volume key>, <z>], e.g. ["pre_exp_scan_r1-FTC-x02-y02-tiff.zstack", 7], or None if filename isn't a slice
+    """
+    match = slice_pattern.match(filename)
+    if match == None:
+        return None
+    return [match.group(1) + "-" + match.group(3)[1:] + volume_extension, int(match.group(2))]
+
+def is_volume(key):
+    """
+    Returns: True if key is a volume object
+    """
+    return key.endswith(volume_extension)
+
+def group_slices(files):
+    """
+    This function groups files by the volume their slices belong to.
+    files:   type iter, of [<full_path>, <filename>]
+    Returns: List [<volumes>, <others>], where volumes is a dict of volume key -> list of [<z>, <filename>, <full_path>]
+             and others is the list of [<full_path>, <filename>] that aren't slices
+    """
+    volumes = {}
+    others = []
+    for full_path, filename in files:
+        tile = slice_tile(filename)
+        if tile == None:
+            others.append([full_path, filename])
+        else:
+            volumes.setdefault(tile[0], []).append([tile[1], filename, full_path])
+    return [volumes, others]
+
+def volume_chunks(slices):
+    """
+    This function yields one tile's volume object piece by piece, so it can be streamed into a multipart upload
+    without ever being held in memory: a fixed header, a JSON index of every slice's name, z and byte range
+    (relative to the end of the index), then the slices' bytes in z order, so any z range is one contiguous byte
+    range. The index is built from the slices' sizes on disk, before any of them is read.
+    slices:  type list, of [<z>, <filename>, <full_path>]
+    Returns: generator of type bytes
+    """
+    slices = sorted(slices)
+    index = []
+    offset = 0
+    for z, filename, full_path in slices:
+        size = os.path.getsize(full_path)
+        index.append({'name': filename, 'z': z, 'offset': offset, 'length': size})
+        offset += size
+    index_bytes = json.dumps({'slices': index}, separators=(',', ':')).encode('utf-8')
+    yield header_struct.pack(volume_magic, volume_version, 0, len(index_bytes))
+    yield index_bytes
+    for entry, (z, filename, full_path) in zip(index, slices):
+        num_bytes = 0
+        fin = open(full_path, 'rb')
+        try:
+            data = fin.read(chunk_size)
+            while data:
+                num_bytes += len(data)
+                yield data
+                data = fin.read(chunk_size)
+        finally:
+            fin.close()
+        if num_bytes != entry['length']:
+            raise OSError(full_path + " changed size while it was being packed")
+
+def parse_header(data, key):
+    """
+    This function parses the fixed header at the start of data.
+    Returns: type int, the offset of the first slice byte, i.e. the end of the index
+    """
+    if len(data) < header_struct.size:
+        raise ValueError(key + " is too short to be a volume object")
+    magic, version, reserved, index_length = header_struct.unpack_from(data)
+    if magic != volume_magic or version != volume_version:
+        raise ValueError(key + " is not a version " + str(volume_version) + " volume object")
+    return header_struct.size + index_length
+
+def parse_index(data, key):
+    """
+    Returns: type list, of {'name', 'z', 'offset', 'length'} slice entries of the volume whose first bytes are data
+    """
+    data_start = parse_header(data, key)
+    return json.loads(data[header_struct.size:data_start].decode('utf-8'))['slices']
+
+def read_index(engine, key):
+    """
+    This function reads the index of the volume key, usually with one small ranged GET.
+    engine:  type transferEngine, the engine for the bucket
+    key:     type str, the volume key
+    Returns: type dict, {'slices': <index entries>, 'data_start': <offset of the first slice byte>, 'etag': <etag>,
+             'prefix': <the bytes read so far>}
+    """
+    data, total_size, etag = engine.read_range(key, 0, index_probe_size - 1)
+    data_start = parse_header(data, key)
+    if len(data) < data_start:
+        more, total_size, etag = engine.read_range(key, len(data), data_start - 1, if_match=etag)
+        data = data + more
+    return {'slices': parse_index(data, key), 'data_start': data_start, 'etag': etag, 'prefix': data}
+
+def read_volume(engine, key, z_first=None, z_last=None):
+    """
+    This function reads slices of the volume key. Without a z range, the whole volume is fetched in one request.
+    With one, the index is read first, and then the slices z_first..z_last (inclusive) in one more ranged GET,
+    which is conditional on the index's ETag so slices of a replaced volume are never mixed.
+    engine:  type transferEngine, the engine for the bucket
+    key:     type str, the volume key
+    z_first: type int, the first z to read, None for the first slice
+    z_last:  type int, the last z to read, None for the last slice
+    Returns: type list, of [<filename>, <z>, <bytes>] in z order
+    """
+    if z_first == None and z_last == None:
+        data, total_size, etag = engine.read_range(key, 0)
+        data_start = parse_header(data, key)
+        return [[entry['name'], entry['z'], data[data_start + entry['offset']:data_start + entry['offset'] + entry['length']]]
+                for entry in parse_index(data, key)]
+    index = read_index(engine, key)
+    entries = []
+    for entry in index['slices']:
+        if (z_first == None or entry['z'] >= z_first) and (z_last == None or entry['z'] <= z_last):
+            entries.append(entry)
+    if len(entries) == 0:
+        return []
+    start = index['data_start'] + entries[0]['offset']
+    end = index['data_start'] + entries[-1]['offset'] + entries[-1]['length']
+    if end <= len(index['prefix']):
+        data = index['prefix'][start:end]
+    else:
+        data, total_size, etag = engine.read_range(key, start, end - 1, if_match=index['etag'])
+    base = entries[0]['offset']
+    return [[entry['name'], entry['z'], data[entry['offset'] - base:entry['offset'] - base + entry['length']]] for entry in entries]
+
+def write_slices(slices, outdir):
+    """
+    This function writes slices back out as per-slice files in outdir. The names come from the volume's index, so
+    names that would escape outdir are refused (see archive_stream.member_path).
+    slices:  type list, of [<filename>, <z>, <bytes>], as returned by read_volume
+    outdir:  type str, relative or absolute path to the output directory, created if needed
+    Returns: type int, the number of bytes written
+    """
+    import archive_stream
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir, exist_ok=True)
+    num_bytes = 0
+    for filename, z, data in slices:
+        full_path = archive_stream.member_path(outdir, filename)
+        dest_dir = os.path.dirname(full_path)
+        if dest_dir != outdir and not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir, exist_ok=True)
+        fout = open(full_path, 'wb')
+        try:
+            fout.write(data)
+        finally:
+            fout.close()
+        num_bytes += len(data)
+    return num_bytes
+
+def decode_slice(filename, data):
+    """
+    This function decodes one slice into a NumPy array. NPY slices are loaded directly, other formats are decoded
+    with Pillow.
+    filename: type str, the name of the slice, whose extension gives its format
+    data:     type bytes, the encoded slice
+    Returns:  type numpy.ndarray
+    """
+    if numpy == None:
+        raise ImportError("Reading slices into arrays requires numpy. Install it with: pip install numpy")
+    if filename.endswith(".npy"):
+        return numpy.load(io.BytesIO(data))
+    if Image == None:
+        raise ImportError("Decoding " + filename + " requires Pillow. Install it with: pip install Pillow")
+    image = Image.open(io.BytesIO(data))
+    try:
+        return numpy.asarray(image)
+    finally:
+        image.close()
+
+def to_array(slices):
+    """
+    This function decodes slices into one NumPy array of shape (z, y, x[, channels]) with decode_slice.
+    slices:  type list, of [<filename>, <z>, <bytes>], as returned by read_volume
+    Returns: type numpy.ndarray
+    """
+    if numpy == None:
+        raise ImportError("Reading volumes into arrays requires numpy. Install it with: pip install numpy")
+    return numpy.stack([decode_slice(filename, data) for filename, z, data in slices])